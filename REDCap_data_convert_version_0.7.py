@@ -24,45 +24,44 @@
 # Checkbox field types are unique because REDCap requires a separate column for each
 # permissible value found in the data dictionary.  Each separate column is filled with 1
 # or 0 depending on whether that value has been checked or not. The new checkbox columns
-# follow the format of the field name + three underscores (___) + each individual choice
-# found in the metadata.
-# Yesno field types do not have permissible values in the data dictionary, so it is
-# assumed that 1 = no, 2 = yes.
+# follow the format of the field name + three underscores (___) + the code of each
+# individual choice found in the metadata.
+# Yesno and truefalse field types do not have permissible values in the data dictionary,
+# so REDCap's codes are used: 1 = yes, 0 = no, and 1 = true, 0 = false.
 # Radio and Dropdown field types do not have any special cases and are both handled in
 # the same manor.
 #
+# USAGE:
+#   python -m redcap_convert data.xlsx metadata.csv -o converted.csv [--sheet Sheet1]
+#   python -m redcap_convert --manifest uploads.txt metadata.csv --output-dir converted
+# The data dictionary is compiled once and reused for every file listed in a manifest.
+#   python -m redcap_convert data.csv metadata.csv -o converted.csv --state data.state
+# With --state, only rows that are new or changed since the last run are converted again.
+# With --profile profile.json, the time and memory of each stage and field are written to that
+# file, and the stages and slowest fields to the error log.
+#
 # DEBUGGING:
 # 
 
 import pandas as pd
+import numpy as np
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import csv
 import datetime
-import xlsxwriter
-
-
-def create_df_from_csv(file_name):
-    """ Returns a DataFrame from a cvs file """
-
-    return pd.read_csv(file_name)
-
-
-def create_df_from_excel(file_name):
-    """ Returns a DataFrame from a excel file"""
-
-    return pd.read_excel(file_name)
-
-
-def return_matches_between_data_and_metadata(data_list, metadata_list):
-    """ Returns a list of all items common to the data_list and the metadata_list.
-
-        data_list is either a list of the field names in the target_data_df or
-        a list of values in a specified column in the target_data_df.
-
-        metadata_list is either the values under the Variable / Field Name column in the metadata
-        DataFrame or the choices found in the Choices, calculations, etc. column of the
-        metadata DataFrame."""
-
-    matches = list(set(metadata_list).intersection(data_list))
-    return matches
+import functools
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import pickle
+import re
+import sys
+import time
+import tracemalloc
 
 
 def return_difference_between_data_and_metadata(data_list, metadata_list):
@@ -95,57 +94,30 @@ def return_data_values_and_their_index_in_metadata_choices_or_data(data_values,
     return values_index_dict
 
 
-def return_checkbox_error_value_and_position_in_data(error_data_values, cleaned_values_list, orig_values_list):
-    """ For field type checkbox, returns a dictionary containing erroneous data values (data values that do not match
-        choices found in the metadata_df's column 'Choices, Calculations, OR Slider Labels'
-        and their index within the list of values in a specified column in data_df.
-
-        debug*** -- if an error value is a substring of a value in metadata_choices,
-        and this metadata_choices value(a non-error value) is found in the list of data_values,
-        then this non-error value is then reported as an error value.
-
-        error value = axi
-        metadata_choices value = axilla
-        axilla will now be reported as an error value."""
-
-    position_list = []
-    for item in error_data_values:
-        # creates a list of the indices where the error value appears in the cleaned_values_list
-        error_index = [idx for idx, s in enumerate(cleaned_values_list) if item in s]
-        # adds 1 to each value in error_index to represent the position
-        position = [x + 1 for x in error_index]
-        # extends position_list with the values in position
-        position_list.extend(position)
-        index_list = [x - 1 for x in position_list]
-        result_list = [orig_values_list[i] for i in index_list]
-    error_values_and_index_dict = dict(zip(result_list, position_list))
-    return error_values_and_index_dict
-
-
-def return_error_value_and_position_in_data(error_data_values, cleaned_values_list, orig_values_list):
-    """ For all field types except checkbox, returns a dictionary containing erroneous data values
-        (data values that do not match choices found in the metadata_df's column 'Choices, Calculations,
-         OR Slider Labels' and their POSITION within the list of values in a specified in the data_df."""
-
-    position_list = []
-    for item in error_data_values:
-        position_list.append(cleaned_values_list.index(item) + 1)
-        index_list = [x - 1 for x in position_list]
-        result_list = [orig_values_list[i] for i in index_list]
-    error_values_and_index_dict = dict(zip(result_list, position_list))
-    return error_values_and_index_dict
-
-
-def return_error_field_name_and_index_in_data(error_data_values, cleaned_values_list, orig_values_list):
-    """ For all field types except checkbox, returns a dictionary containing erroneous data values
-        (data values that do not match choices found in the metadata_df's column 'Choices, Calculations,
-         OR Slider Labels' and their INDEX within the list of values in a specified in the data_df."""
-    index_list = []
-    for item in error_data_values:
-        index_list.append(cleaned_values_list.index(item))
-        result_list = [orig_values_list[i] for i in index_list]
-    error_values_and_index_dict = dict(zip(result_list, index_list))
-    return error_values_and_index_dict
+def return_error_records(data_field_name, error_mask, orig_values, reason, first_position=1, expected=''):
+    """ Returns a NumPy structured array of ERROR_RECORD_DTYPE with one record for every erroneous
+        cell in a column: every position where error_mask is True, not only the first occurrence of
+        each erroneous value. Each record holds the cell's POSITION in the data (first_position is
+        the position of the first value in orig_values), the data_field_name, the original value,
+        what was expected instead (the metadata choices or the text validation type), and the
+        reason it is an error. reason is a string, or an array of strings lined up with
+        orig_values. Missing values are given the reason 'missing value'.
+
+        The records are found in one vectorized pass over the mask."""
+
+    error_index = np.nonzero(np.asarray(error_mask, dtype=bool))[0]
+    error_values = np.asarray(orig_values, dtype=object)[error_index]
+
+    if not isinstance(reason, str):
+        reason = np.asarray(reason, dtype=object)[error_index]
+
+    error_records = np.empty(len(error_index), dtype=ERROR_RECORD_DTYPE)
+    error_records['row'] = error_index + first_position
+    error_records['field'] = data_field_name
+    error_records['value'] = error_values
+    error_records['expected'] = expected
+    error_records['reason'] = np.where(pd.isna(error_values), 'missing value', reason)
+    return error_records
 
 
 def error_message(ix_dict, log):
@@ -156,167 +128,371 @@ def error_message(ix_dict, log):
     log.write(str(ix_dict) + "\n")
 
 
-def return_data_df_containing_only_matching_cols(orig_data_df, matches_between_data_and_metadata):
-    """ Returns a data DataFrame that only contains the columns that matched
-        with the metadata_df's column 'Variable / Field Name'."""
+def return_cleaned_data_values(data_values):
+    """ Returns a Series of strings with whitespace at the beginning and end of a word removed,
+        double spaces turned to one space, and all values made lowercase. Floats are truncated
+        to integers before being turned into strings, so 2.0 becomes '2'.
 
-    data_matches_df = orig_data_df[matches_between_data_and_metadata]
-    return data_matches_df
+        The rules are applied to the whole column at once with the .str accessor. Missing data
+        stays NaN, so the returned Series lines up row for row with data_values."""
 
+    data_values = pd.Series(data_values)
+    cleaned_data_values = pd.Series(np.nan, index=data_values.index, dtype=object)
+    not_missing = data_values.notna()
 
-def return_cleaned_data_values(data_values_list):
-    """ Returns a list of strings with whitespace at the beginning and end of a word removed,
-        double spaces turned to one space, and all values made lowercase."""
+    # numeric columns have no strings in them, and every value is turned into an integer string
+    if pd.api.types.is_numeric_dtype(data_values) and not pd.api.types.is_bool_dtype(data_values):
+        numbers = data_values[not_missing]
+        cleaned_data_values[not_missing] = np.trunc(numbers).astype(np.int64).astype(str)
+        return cleaned_data_values
 
-    cleaned_data_values_list = []
-    for count in range(len(data_values_list)):
-        if type(data_values_list[count]) != str:
-            if type(data_values_list[count]) == float:
-                if not isnan(data_values_list[count]):
-                    var1 = int(data_values_list[count])
-                    var1 = str(var1)
-                    cleaned_data_values_list.append(var1)
-            else:
-                var1 = str(data_values_list[count])
-                var1 = var1.replace('  ', ' ')
-                var1 = var1.strip()
-                var1 = var1.lower()
-                cleaned_data_values_list.append(var1)
-    return cleaned_data_values_list
+    # booleans become the text 'true' and 'false', since the .str accessor refuses a column of them
+    if pd.api.types.is_bool_dtype(data_values) or pd.api.types.infer_dtype(data_values, skipna=True) == 'boolean':
+        data_values = data_values.astype(object).map({True: 'true', False: 'false'})
+
+    # values that are not strings come out of the .str accessor as NaN
+    strings = data_values.astype(object)
+    is_string = strings.str.len().notna()
+    cleaned_data_values[is_string] = strings[is_string]
+
+    others = strings[not_missing & ~is_string]
+    if not others.empty:
+        numbers = pd.to_numeric(others, errors='coerce')
+        is_float = others.map(type) == float
+        cleaned_data_values[is_float[is_float].index] = np.trunc(
+            numbers[is_float].astype(float)).astype(np.int64).astype(str)
+        cleaned_data_values[is_float[~is_float].index] = others[~is_float].astype(str)
+
+    cleaned_data_values[not_missing] = (cleaned_data_values[not_missing].str.replace('  ', ' ', regex=False)
+                                        .str.strip().str.lower())
+    return cleaned_data_values
 
 
 def parse_metadata_choices(metadata_choices_string, separator):
-    """ Returns a list of strings parsed around the separator in metadata_choice_string.
-        One string is passed in that contains all the metadata choices for a single column
-        separated by the specified separator."""
+    """ Returns a list of (choice, code) tuples parsed around the separator in
+        metadata_choice_string. One string is passed in that contains all the metadata choices for
+        a single column separated by the specified separator, each written as 'code, label'.
+
+        The code is the one written in the metadata, such as 0, 99 or -1. The label is everything
+        after the first comma, so labels may have commas in them, and it is cleaned the way data
+        values are. A choice without a comma is its own code."""
 
-    pipe_num = metadata_choices_string.count(separator)
     parsed_list = []
-    for count in range(pipe_num + 1):
-        var1 = metadata_choices_string.split(separator)[count]
-        var1 = var1.split(',')[1]
-        var1 = var1.strip()
-        var1 = var1.replace('  ', ' ')
-        var1 = var1.lower()
-        parsed_list.append(var1)
+    for metadata_choice in metadata_choices_string.split(separator):
+        code, comma, label = metadata_choice.partition(',')
+        if not comma:
+            label = code
+        label = label.strip().replace('  ', ' ').lower()
+        parsed_list.append((label, code.strip()))
     return parsed_list
 
 
-def return_index_of_data_values_in_metadata(data_values_list, all_meta_choices_and_their_index):
-    """ Returns a list of number strings that replaces keys with their
-        value in a dictionary. This list is used to update the values of the columns
-        in the data DataFrame.
+def return_index_of_data_values_in_metadata(data_values, metadata_choices_and_their_index):
+    """ Returns a categorical Series of number strings that replaces each data value with its code
+        in a dictionary. This Series is used to update the values of the columns in the data DataFrame.
 
-        data_values_list is a list of all the values in the target_data_df of a specified column.
-        all_choices_and_their_index is a dictionary containing the metadata_df choices as keys and
-        the index of these choices as values."""
+        data_values is the cleaned values of a specified column in the target_data_df.
+        metadata_choices_and_their_index is a dictionary containing the metadata_df choices as keys
+        and the index of these choices as values.
 
-    string_list = ', '.join(data_values_list)
-    for i, j in all_meta_choices_and_their_index.items():
-        string_list = string_list.replace(i, j)
-    back2list = string_list.split(',')
-    return back2list
+        Every value is looked up whole in one vectorized pass, so a choice that is a substring of
+        another choice ('no' inside 'not known') cannot corrupt the result. Values that are not
+        a choice become NaN.
 
+        The categories are the codes, so each value is stored as a small integer pointing at its
+        code instead of as a Python string, and the codes are only turned into text when written."""
 
-def date_validation(data_values_list, date_format_string):
-    """ Validates the format of a list of strings and returns a new list with correct
-        date formats. First, checks for missing data, and replaces empty data with an empty
-        string."""
+    data_values = pd.Series(data_values, dtype=object)
+    codes = list(dict.fromkeys(metadata_choices_and_their_index.values()))
+    code_positions = dict((code, position) for position, code in enumerate(codes))
+    category_positions = data_values.map(dict(
+        (choice, code_positions[code]) for choice, code in metadata_choices_and_their_index.items()))
+    return pd.Series(pd.Categorical.from_codes(category_positions.fillna(-1).values.astype(np.int64), codes),
+                     index=data_values.index)
 
-    import dateutil.parser
 
-    new_list = []
-    for str_date in data_values_list:
-        if isnan(str_date):
-            new_list.append(None)
-        else:
-            str_date = str(str_date)
-            parsed_str_date = dateutil.parser.parse(str_date)
-            if date_format_string == 'date_mdy':
-                reformatted_date = str(parsed_str_date.month).rjust(2, '0') + '/' + str(
-                    parsed_str_date.day).rjust(2, '0') + '/' + str(parsed_str_date.year)
-                new_list.append(reformatted_date)
-            elif date_format_string == 'date_dmy':
-                reformatted_date = str(parsed_str_date.day).rjust(2, '0') + '/' + str(
-                    parsed_str_date.month).rjust(2, '0') + '/' + str(parsed_str_date.year)
-                new_list.append(reformatted_date)
-            elif date_format_string == 'date_ymd':
-                reformatted_date = str(parsed_str_date.year) + '/' + str(
-                    parsed_str_date.month).rjust(2, '0') + '/' + str(parsed_str_date.day).rjust(2, '0')
-                new_list.append(reformatted_date)
-    return new_list
+# date formats written to the output for each REDCap date validation type
+DATE_OUTPUT_FORMATS = {
+    'date_mdy': '%m/%d/%Y',
+    'date_dmy': '%d/%m/%Y',
+    'date_ymd': '%Y/%m/%d',
+}
 
+# explicit date formats tried in order for each date validation type before falling back to dateutil
+DATE_INPUT_FORMATS = {
+    'date_mdy': ['%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d'],
+    'date_dmy': ['%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d'],
+    'date_ymd': ['%Y/%m/%d', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%m/%d/%y'],
+}
 
-def decimal_point_validation(data_values_list):
-    """ Changes the format of a float or an integer to two decimal places."""
+# number of date strings that dateutil has parsed that are remembered between columns
+DATE_CACHE_SIZE = 65536
 
-    new_list = [None if isnan(num) else "{:.2f}".format(num) for num in data_values_list]
-    return new_list
 
+# dateutil fills in the parts a date string leaves out from a default date. Its year is one that
+# no date string is expected to have, so strings without a year can be recognised
+DATE_DEFAULT = datetime.datetime(1, 1, 1)
 
-def integer_validation(data_values_list, data_field_name):
-    """ Validates the format of a list of numbers and returns and a new
-     list containing only integers."""
 
-    new_list = []
-    for x in data_values_list:
-        if type(x) != int and type(x) != float:
-            print(str(data_field_name) + ": Error. Value " + str(x) + " must be an integer")
-        elif type(x) == float:
-            new_x = int(x)
-            new_list.append(new_x)
-        elif isnan(x):
-            new_list.append(None)
-        else:
-            new_list.append(x)
-    return new_list
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date_string(date_string, dayfirst):
+    """ Parses a single date string with dateutil and returns it as a Timestamp, or NaT when
+        the string is not a date. Strings without a year, such as '12' or '3/4', are not dates.
+        Results are memoized, so a date that repeats across rows and columns is only parsed once."""
+
+    import dateutil.parser
+
+    try:
+        parsed_date = dateutil.parser.parse(date_string, dayfirst=dayfirst, default=DATE_DEFAULT)
+    except (ValueError, OverflowError):
+        return pd.NaT
+    if parsed_date.year == DATE_DEFAULT.year:
+        return pd.NaT
+    try:
+        return pd.Timestamp(parsed_date)
+    except (ValueError, OverflowError):
+        return pd.NaT
+
+
+def date_validation(data_values, date_format_string):
+    """ Validates the format of a column of dates and returns a Series with the dates in the
+        format REDCap expects for date_format_string. Missing data and values that could not be
+        parsed as dates are NaN in the returned Series, which lines up row for row with data_values.
+
+        Each distinct date string is parsed once. The explicit formats in DATE_INPUT_FORMATS are
+        tried first with pd.to_datetime, and only strings that none of them match are passed to
+        dateutil."""
+
+    data_values = pd.Series(data_values).reset_index(drop=True)
+    if pd.api.types.is_datetime64_any_dtype(data_values):
+        return data_values.dt.strftime(DATE_OUTPUT_FORMATS[date_format_string])
+
+    not_missing = data_values.notna()
+    date_strings = data_values[not_missing].astype(str).str.strip()
+
+    # parses every distinct date string, trying one explicit format at a time
+    unique_date_strings = pd.Series(pd.unique(date_strings), dtype=object)
+    parsed_dates = pd.Series(pd.NaT, index=unique_date_strings.index, dtype='datetime64[ns]')
+    for date_format in DATE_INPUT_FORMATS[date_format_string]:
+        not_parsed = parsed_dates.isna()
+        if not not_parsed.any():
+            break
+        parsed_dates[not_parsed] = pd.to_datetime(
+            unique_date_strings[not_parsed], format=date_format, errors='coerce')
+
+    # anything left over goes to dateutil's heuristics
+    not_parsed = parsed_dates.isna()
+    if not_parsed.any():
+        dayfirst = date_format_string == 'date_dmy'
+        parsed_dates[not_parsed] = pd.to_datetime(pd.Series(
+            [parse_date_string(date_string, dayfirst) for date_string in unique_date_strings[not_parsed]],
+            index=unique_date_strings[not_parsed].index, dtype=object), errors='coerce')
+
+    reformatted_dates = pd.Series(
+        parsed_dates.dt.strftime(DATE_OUTPUT_FORMATS[date_format_string]).values, index=unique_date_strings)
+    new_dates = pd.Series(np.nan, index=data_values.index, dtype=object)
+    new_dates[not_missing] = date_strings.map(reformatted_dates)
+    return new_dates
+
+
+# the number of decimal places each numeric validation type is written with. Numbers are written as
+# they were given for 'number'
+NUMERIC_VALIDATION_DECIMALS = {
+    'integer': 0,
+    'number': None,
+    'number_1dp': 1,
+    'number_2dp': 2,
+    'number_3dp': 3,
+    'number_4dp': 4,
+}
+
+
+def return_limit(limit):
+    """ Returns a text validation min or max from the data dictionary as a float, or None when
+        there is none or it is not a number."""
+
+    if limit is None or isnan(limit):
+        return None
+    try:
+        return float(limit)
+    except ValueError:
+        return None
+
+
+def return_numeric_expected(validation_type, minimum=None, maximum=None):
+    """ Returns what was expected of a numeric field, for the error records: its validation type
+        and the range its values must be in."""
+
+    minimum = return_limit(minimum)
+    maximum = return_limit(maximum)
+    if minimum is not None and maximum is not None:
+        return validation_type + ' from ' + format(minimum, 'g') + ' to ' + format(maximum, 'g')
+    if minimum is not None:
+        return validation_type + ' of at least ' + format(minimum, 'g')
+    if maximum is not None:
+        return validation_type + ' of at most ' + format(maximum, 'g')
+    return validation_type
+
+
+def numeric_validation(data_values, validation_type, minimum=None, maximum=None):
+    """ Validates every value of a numeric text field in one pass. validation_type is one of
+        NUMERIC_VALIDATION_DECIMALS, and minimum and maximum are the field's text validation min
+        and max, or None.
+
+        Values are converted with pd.to_numeric, so numbers typed as text are accepted. A value is
+        an error when it is not a number, is not a whole number that fits in 64 bits for
+        'integer', or is outside the minimum and maximum. Returns the converted values, lined up
+        with data_values, a boolean array that is True for every error, and an array of the
+        reason for each error. Integers are converted to a nullable integer column, so they are
+        written without a decimal point, and the 'number_Ndp' types to text with N decimal places.
+        Missing values stay missing and are not errors here."""
+
+    data_values = pd.Series(data_values).reset_index(drop=True)
+    missing = data_values.isna().values
+    if pd.api.types.is_numeric_dtype(data_values.dtype) and not pd.api.types.is_bool_dtype(data_values.dtype):
+        numbers = data_values.astype(np.float64).values
+    else:
+        numbers = pd.to_numeric(data_values.astype(str).str.strip().where(~missing),
+                                errors='coerce').astype(np.float64).values
+
+    decimals = NUMERIC_VALIDATION_DECIMALS[validation_type]
+    not_a_number = ~np.isfinite(numbers) & ~missing
+    if decimals == 0:
+        # integers are written from a 64 bit integer column, so larger whole numbers are not valid
+        not_a_number |= np.isfinite(numbers) & ((numbers != np.floor(numbers)) | (numbers < -2.0 ** 63) |
+                                                (numbers >= 2.0 ** 63))
+    error_reasons = np.full(len(numbers), '', dtype=object)
+    error_reasons[not_a_number] = 'not a valid ' + validation_type
+
+    # range checks, where comparisons with NaN are always False
+    minimum = return_limit(minimum)
+    maximum = return_limit(maximum)
+    with np.errstate(invalid='ignore'):
+        if minimum is not None:
+            error_reasons[~not_a_number & (numbers < minimum)] = 'less than the minimum of ' + format(minimum, 'g')
+        if maximum is not None:
+            error_reasons[~not_a_number & (numbers > maximum)] = 'more than the maximum of ' + format(maximum, 'g')
+    error_values = error_reasons != ''
+
+    valid = ~error_values & ~missing
+    if decimals is None:
+        converted_values = data_values.where(valid | missing)
+    elif decimals == 0:
+        converted_values = pd.Series(pd.array(np.where(valid, numbers, np.nan), dtype='Int64'))
+    else:
+        converted_values = pd.Series(np.nan, index=data_values.index, dtype=object)
+        converted_values[valid] = np.char.mod('%.' + str(decimals) + 'f', numbers[valid]).astype(object)
+    return converted_values, error_values, error_reasons
+
+
+# the date and time parts of the REDCap date, datetime and time validation types, as regular
+# expressions that can be put together
+MONTH_PATTERN = r'(0?[1-9]|1[0-2])'
+DAY_PATTERN = r'(0?[1-9]|[12][0-9]|3[01])'
+YEAR_PATTERN = r'[0-9]{4}'
+TIME_PATTERN = r'([01]?[0-9]|2[0-3]):[0-5][0-9]'
+DATE_PATTERNS = {
+    'mdy': MONTH_PATTERN + '[-/.]' + DAY_PATTERN + '[-/.]' + YEAR_PATTERN,
+    'dmy': DAY_PATTERN + '[-/.]' + MONTH_PATTERN + '[-/.]' + YEAR_PATTERN,
+    'ymd': YEAR_PATTERN + '[-/.]' + MONTH_PATTERN + '[-/.]' + DAY_PATTERN,
+}
+
+# a validator for every text validation type that is not a date or a number. Each is a compiled
+# regular expression that a whole value must match, or a function that is given the column of
+# stripped values as text and returns a boolean Series that is True for every valid value. The
+# regular expressions avoid lookarounds and backreferences, so pandas can run them on Arrow
+# strings without falling back to Python. Use register_text_validator to add more.
+TEXT_VALIDATORS = {
+    'email': re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+"),
+    'phone': re.compile(r"\(?[2-9][0-9]{2}\)?[-. ]?[2-9][0-9]{2}[-. ]?[0-9]{4}( *(x|ext\.?) *[0-9]+)?",
+                        re.IGNORECASE),
+    'zipcode': re.compile(r"[0-9]{5}(-[0-9]{4})?"),
+    'postalcode_canada': re.compile(r"[ABCEGHJ-NPRSTVXY][0-9][ABCEGHJ-NPRSTV-Z][ -]?[0-9][ABCEGHJ-NPRSTV-Z][0-9]",
+                                    re.IGNORECASE),
+    'ssn': re.compile(r"[0-9]{3}-[0-9]{2}-[0-9]{4}"),
+    'alpha_only': re.compile(r"[A-Za-z]+"),
+    'time': re.compile(TIME_PATTERN),
+    'time_mm_ss': re.compile(r"[0-5][0-9]:[0-5][0-9]"),
+}
+for date_order, date_pattern in DATE_PATTERNS.items():
+    TEXT_VALIDATORS['datetime_' + date_order] = re.compile(date_pattern + ' +' + TIME_PATTERN)
+    TEXT_VALIDATORS['datetime_seconds_' + date_order] = re.compile(date_pattern + ' +' + TIME_PATTERN + ':[0-5][0-9]')
+
+
+def register_text_validator(validation_type, validator):
+    """ Adds a validator for validation_type to TEXT_VALIDATORS, replacing any it had. validator is
+        a regular expression, compiled or not, that a whole value must match, or a function that is
+        given a Series of stripped values as text and returns a boolean Series of the valid ones."""
+
+    if isinstance(validator, str):
+        validator = re.compile(validator)
+    TEXT_VALIDATORS[validation_type] = validator
+
+
+def text_validation(data_values, validation_type):
+    """ Returns a boolean array that is True for every value of data_values that is not valid for
+        validation_type, a key of TEXT_VALIDATORS. The whole column is checked in one pass with
+        Series.str.fullmatch, or by the validator function. Missing values are not errors here."""
+
+    data_values = pd.Series(data_values).reset_index(drop=True)
+    missing = data_values.isna().values
+    validator = TEXT_VALIDATORS[validation_type]
+    # a column with a blank cell is read as floats, so whole numbers such as 10001.0 are checked as
+    # the integers they were typed as
+    text_values = data_values.astype(object)
+    is_whole_float = text_values.map(lambda value: isinstance(value, float) and value.is_integer()).values
+    text_values[is_whole_float] = text_values[is_whole_float].map(lambda value: str(int(value)))
+    text_values = text_values.astype(str).str.strip()
+    if hasattr(validator, 'pattern'):
+        valid = text_values.str.fullmatch(validator)
+    else:
+        valid = validator(text_values)
+    return ~np.asarray(valid, dtype=bool) & ~missing
 
 
 def no_text_validation_error_values_for_df(data_values):
     """Checks for missing data for values that are type text but do not require text
-    validation. If data is missing, then True is appended. If not data is missing, than
-    False is appended."""
+    validation. Returns an array that is True where data is missing and False where it is
+    not, found for the whole column at once."""
 
-    new_list = []
-    for item in data_values:
-        if isnan(item):
-            new_list.append(True)
-        else:
-            new_list.append(False)
-    return new_list
+    return pd.isna(pd.Series(data_values)).to_numpy()
 
 
-def return_checkbox_col_field_names(data_field_name, metadata_choices_list):
-    """ Returns a list of the new column names for the checkbox columns. These new column names
-        are named with the convention 'data field name'___'choice from metadata'."""
+def return_checkbox_col_field_names(data_field_name, metadata_choices):
+    """ Returns a list of the new column names for the checkbox columns, one for each choice in
+        metadata_choices, a dictionary of the metadata choices and their codes. These new column
+        names are named with the convention 'data field name'___'code of the choice', the way
+        REDCap names them."""
 
     new_list = []
-    for count in range(len(metadata_choices_list)):
-        name = data_field_name + '___' + metadata_choices_list[count]
+    for choice in metadata_choices:
+        name = data_field_name + '___' + metadata_choices[choice]
         new_list.append(name)
     return new_list
 
 
-def return_checkbox_col_values(metadata_choice, checkbox_data_values):
-    """ Returns a list of 0s and 1 based on whether the metadata_choice passed in
-        is found in each row of the checkbox_data_values.
-        1 is added if the metadata_choice is found, 0 if not."""
+def return_checkbox_col_values(checkbox_data_values, metadata_choices_list, separator):
+    """ Returns a NumPy boolean matrix with one row per value in checkbox_data_values and one column
+        per choice in metadata_choices_list. A cell is True when that choice has been checked in that
+        row. Also returns a boolean array that is True for every row containing a value that is not
+        one of the metadata choices.
 
-    new_list = []
-    for choice in checkbox_data_values:
-        if choice.find(metadata_choice) != -1:
-            new_list.append(1)
-        else:
-            new_list.append(0)
-    return new_list
+        Each value is split around the separator once, and each piece is mapped to the position of
+        its choice with a single dictionary lookup. Missing values have no choices checked."""
 
+    number_of_rows = len(checkbox_data_values)
+    checkbox_matrix = np.zeros((number_of_rows, len(metadata_choices_list)), dtype=bool)
+    checkbox_error_mask = np.zeros(number_of_rows, dtype=bool)
 
-def update_data_df_with_checkbox_cols(orig_data_df, col_field_names, col_values):
-    """ Adds the checkbox columns to the existing target_data_df naming them with col_field_names
-        and fills the columns with col_values"""
+    parsed_checkbox_data_values = parse_checkbox_data_values(checkbox_data_values, separator)
+    choice_positions = parsed_checkbox_data_values.map(
+        dict((choice, position) for position, choice in enumerate(metadata_choices_list)))
+    is_choice = choice_positions.notna().values
 
-    for i, j in zip(col_field_names, col_values):
-        orig_data_df[i] = j
+    row_positions = parsed_checkbox_data_values.index.values
+    checkbox_matrix[row_positions[is_choice], choice_positions.values[is_choice].astype(np.int64)] = True
+    checkbox_error_mask[row_positions[~is_choice]] = True
+    return checkbox_matrix, checkbox_error_mask
 
 
 def return_list_of_properly_formatted_field_names(field_names):
@@ -335,213 +511,1435 @@ def return_list_of_properly_formatted_field_names(field_names):
     return new_list
 
 
-def return_values_that_match_metadata_choices(
-        difference_list, source_list):
-    """ Returns a list of data values that contains only the values that have matched those within
-        the metadata_choices. All the mismatches between metadata choices and data_values are removed."""
+def parse_checkbox_data_values(checkbox_data_values, separator):
+    """ Every value from a checkbox column is parsed around the separator in one pass. Returns a
+        Series with one item per parsed choice, indexed by the position of the row it came from.
+        Each choice is stripped, double spaces are turned to one space, and it is made lowercase,
+        the same way parse_metadata_choices cleans the metadata choices. Empty values are dropped."""
 
-    match_list = source_list[:]
-    for item in difference_list:
-        match_list.remove(item)
-    return match_list
+    parsed_values = pd.Series(checkbox_data_values, dtype=object).reset_index(drop=True)
+    parsed_values = parsed_values.str.split(separator, regex=False).explode()
+    parsed_values = parsed_values.str.strip().str.replace('  ', ' ', regex=False).str.lower()
+    return parsed_values[parsed_values.notna() & (parsed_values != '')]
 
 
-def parse_checkbox_data_values(checkbox_value_string, separator):
-    """ A single value from a checkbox column is passed in a parsed around the separator.
-        The parsed checkbox value is used for error reporting."""
+def write_error_workbook(data_df, error_data_df, workbook_path):
+    """ Writes data_df to an excel file at workbook_path with the background of every cell that
+        is True in error_data_df colored pink. Missing values that are errors are written as 'NaN'.
 
-    parsed_list = []
-    pipe_num = checkbox_value_string.count(separator)
-    for count in range(pipe_num + 1):
-        var1 = checkbox_value_string.split(separator)[count]
-        var1 = var1.replace(' ', '')
-        var1 = var1.lower()
-        parsed_list.append(var1)
-    return parsed_list
+        The flagged cells are found with np.nonzero on the error matrix, so only those cells are
+        looked up and formatted. The workbook is written a row at a time in xlsxwriter's
+        constant_memory mode."""
 
+    # xlsxwriter is only imported when there are errors, so clean files start faster
+    import xlsxwriter
 
-def change_cell_background_color(col_index_list, worksheet, formatting):
-    """ col_index list is a list of the indices of erroneous field names within the
-        data_df.
-        worksheet is the name of the worksheet being used for xlsxwriter
-        row_length is the number of values found in the specified column"""
+    error_matrix = error_data_df.reindex(columns=data_df.columns).fillna(False).astype(bool).values
+    error_rows, error_cols = np.nonzero(error_matrix)
+    # the position in error_rows/error_cols where the errors of each row start
+    row_starts = np.searchsorted(error_rows, np.arange(len(data_df) + 1))
 
-    for index in col_index_list:
-        worksheet.set_column(index, index, 20, formatting)
+    data_values = data_df.astype(object).where(data_df.notna(), None).values
 
+    workbook = xlsxwriter.Workbook(workbook_path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    data_worksheet = workbook.add_worksheet('Sheet1')
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    formats = workbook.add_format()
+    formats.set_bg_color('#FF00FF')
 
-def text_validation_values_for_error_df(updated_date_list):
-    """ Appends False to a list if no error has been found, and appends True when an error has been
-        found. This list is then added to the values in the corresponding column in the error_data_df."""
+    data_worksheet.write_row(0, 0, list(data_df.columns), header_format)
+    for row_position, row_values in enumerate(data_values):
+        data_worksheet.write_row(row_position + 1, 0, row_values)
+        # the current row is still in memory, so its flagged cells can be written over with the pink format
+        for col_position in error_cols[row_starts[row_position]:row_starts[row_position + 1]]:
+            target_string = row_values[col_position]
+            if target_string is None:
+                target_string = 'NaN'
+            data_worksheet.write(row_position + 1, col_position, target_string, formats)
+
+    workbook.close()
+
+
+# the tokens of a REDCap branching logic or calculation expression: a field reference such as [sex],
+# [site(2)] or [event_1_arm_1][sex], a quoted string, a number, an operator, a parenthesis, a comma,
+# or a word, which is and, or, or the name of a function
+EXPRESSION_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<field>(?:\[[^\]]*\])+)
+      | '(?P<single_quoted>[^']*)'
+      | "(?P<double_quoted>[^"]*)"
+      | (?P<number>[0-9]+(?:\.[0-9]*)?|\.[0-9]+)
+      | (?P<operator><=|>=|<>|!=|==|=|<|>|\+|-|\*|/|\^)
+      | (?P<parenthesis>[()])
+      | (?P<comma>,)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+# a field reference, with the code of a checkbox choice when it has one
+EXPRESSION_FIELD_PATTERN = re.compile(r"\[([^\]()]+)(?:\(([^)]*)\))?\]$")
+
+
+def return_numbers(values):
+    """ Returns values as an array of floats, NaN where a value is missing or not a number."""
+
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        return values.astype(np.float64)
+    return pd.to_numeric(pd.Series(values).astype(object), errors='coerce').astype(np.float64).values
+
+
+def round_half_away_from_zero(numbers, decimal_places=0.0):
+    """ Returns numbers rounded to decimal_places the way REDCap rounds, with halves away from zero."""
+
+    scale = 10.0 ** decimal_places
+    return np.sign(numbers) * np.floor(np.abs(numbers) * scale + 0.5) / scale
+
+
+def return_sum(*numbers):
+    """ Returns the sum of the numbers in each row, leaving out missing ones. A row with no numbers is NaN."""
+
+    numbers = np.vstack(numbers)
+    counts = (~np.isnan(numbers)).sum(axis=0)
+    return np.where(counts > 0, np.nansum(numbers, axis=0), np.nan)
+
+
+def return_mean(*numbers):
+    """ Returns the mean of the numbers in each row, leaving out missing ones. A row with no numbers is NaN."""
+
+    counts = (~np.isnan(np.vstack(numbers))).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return return_sum(*numbers) / counts
+
+
+# functions that calculations and branching logic can call. Each is given an array of floats for
+# every argument, with NaN for missing values, and returns an array of floats
+CALCULATION_FUNCTIONS = {
+    'round': round_half_away_from_zero,
+    'roundup': lambda numbers, decimal_places=0.0: (
+        np.sign(numbers) * np.ceil(np.abs(numbers) * 10.0 ** decimal_places) / 10.0 ** decimal_places),
+    'rounddown': lambda numbers, decimal_places=0.0: (
+        np.sign(numbers) * np.floor(np.abs(numbers) * 10.0 ** decimal_places) / 10.0 ** decimal_places),
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': lambda numbers, base=np.e: np.log(numbers) / np.log(base),
+    'min': lambda *numbers: functools.reduce(np.fmin, numbers),
+    'max': lambda *numbers: functools.reduce(np.fmax, numbers),
+    'sum': return_sum,
+    'mean': return_mean,
+    'if': lambda condition, if_true, if_false: np.where(~np.isnan(condition) & (condition != 0), if_true, if_false),
+}
+
+
+def register_calculation_function(name, function):
+    """ Adds function to CALCULATION_FUNCTIONS as name, replacing any function it had. function is
+        given an array of floats for every argument and returns an array of floats. Expressions
+        already compiled by a DataDictionary are not compiled again."""
+
+    CALCULATION_FUNCTIONS[name.lower()] = function
+
+
+def return_expression_tokens(expression):
+    """ Returns a list of (kind, value) tuples for the tokens of a branching logic or calculation
+        expression. kind is 'field', 'string', 'number', 'operator', 'parenthesis', 'comma' or 'word'.
+        Field values are (variable name, checkbox code or None) tuples. Raises ValueError for
+        anything else."""
+
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = EXPRESSION_TOKEN_PATTERN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError("Unexpected text at '" + expression[position:].strip() + "'")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'field':
+            # only the last reference counts, because the first names the event in longitudinal projects
+            field_match = EXPRESSION_FIELD_PATTERN.match(value[value.rfind('['):])
+            if field_match is None:
+                raise ValueError("Unexpected field reference " + value)
+            value = (field_match.group(1).strip(), field_match.group(2))
+        elif kind in ('single_quoted', 'double_quoted'):
+            kind = 'string'
+        elif kind == 'word':
+            value = value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+class ExpressionParser(object):
+    """ A recursive descent parser that compiles a REDCap branching logic or calculation expression
+        into a tree of tuples, which evaluate_expression evaluates over whole columns at once:
+
+            ('or', left, right)          ('and', left, right)
+            ('compare', operator, left, right)
+            ('arithmetic', operator, left, right)
+            ('negate', operand)
+            ('function', name, [arguments])
+            ('field', variable name, checkbox code or None)
+            ('literal', value)
+
+        From the loosest to the tightest, the operators bind in the order or, and, comparisons,
+        + and -, * and /, a leading -, and ^, which groups from the right."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = return_expression_tokens(expression)
+        self.position = 0
+
+    def parse(self):
+        """ Returns the tree of the whole expression."""
+
+        if not self.tokens:
+            raise ValueError("The expression is empty")
+        tree = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ValueError("Unexpected '" + str(self.tokens[self.position][1]) + "'")
+        return tree
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind, values=None):
+        """ Returns the next token when it is of kind (and one of values, when given), or None."""
+
+        token = self.peek()
+        if token[0] == kind and (values is None or token[1] in values):
+            self.position += 1
+            return token
+        return None
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while self.take('word', ('or',)):
+            tree = ('or', tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_comparison()
+        while self.take('word', ('and',)):
+            tree = ('and', tree, self.parse_comparison())
+        return tree
+
+    def parse_comparison(self):
+        tree = self.parse_sum()
+        operator = self.take('operator', ('=', '==', '<>', '!=', '<', '<=', '>', '>='))
+        if operator:
+            tree = ('compare', operator[1], tree, self.parse_sum())
+        return tree
+
+    def parse_sum(self):
+        tree = self.parse_product()
+        operator = self.take('operator', ('+', '-'))
+        while operator:
+            tree = ('arithmetic', operator[1], tree, self.parse_product())
+            operator = self.take('operator', ('+', '-'))
+        return tree
+
+    def parse_product(self):
+        tree = self.parse_negation()
+        operator = self.take('operator', ('*', '/'))
+        while operator:
+            tree = ('arithmetic', operator[1], tree, self.parse_negation())
+            operator = self.take('operator', ('*', '/'))
+        return tree
+
+    def parse_negation(self):
+        if self.take('operator', ('-',)):
+            return ('negate', self.parse_negation())
+        return self.parse_power()
+
+    def parse_power(self):
+        tree = self.parse_operand()
+        if self.take('operator', ('^',)):
+            tree = ('arithmetic', '^', tree, self.parse_negation())
+        return tree
+
+    def parse_operand(self):
+        if self.take('parenthesis', ('(',)):
+            tree = self.parse_or()
+            if not self.take('parenthesis', (')',)):
+                raise ValueError("A parenthesis is not closed")
+            return tree
+        kind, value = self.peek()
+        if kind == 'field':
+            self.position += 1
+            return ('field', value[0], value[1])
+        if kind == 'string':
+            self.position += 1
+            return ('literal', value)
+        if kind == 'number':
+            self.position += 1
+            return ('literal', float(value))
+        if kind == 'word' and value in CALCULATION_FUNCTIONS:
+            self.position += 1
+            return ('function', value, self.parse_arguments())
+        if kind is None:
+            raise ValueError("The expression ends too soon")
+        raise ValueError("Unexpected '" + str(value) + "'")
+
+    def parse_arguments(self):
+        """ Returns the trees of the arguments of a function, in the parentheses after its name."""
+
+        if not self.take('parenthesis', ('(',)):
+            raise ValueError("A function name is not followed by '('")
+        arguments = []
+        if not self.take('parenthesis', (')',)):
+            arguments.append(self.parse_or())
+            while self.take('comma'):
+                arguments.append(self.parse_or())
+            if not self.take('parenthesis', (')',)):
+                raise ValueError("A parenthesis is not closed")
+        return arguments
+
+
+def compile_expression(expression):
+    """ Returns the tree of a branching logic or calculation expression. Raises ValueError when it
+        can not be read."""
+
+    return ExpressionParser(expression).parse()
+
+
+def return_expression_fields(tree):
+    """ Returns the set of (variable name, checkbox code) tuples a compiled expression refers to."""
+
+    if tree[0] == 'field':
+        return set([(tree[1], tree[2])])
+    fields = set()
+    for branch in tree[1:]:
+        for item in (branch if isinstance(branch, list) else [branch]):
+            if isinstance(item, tuple):
+                fields |= return_expression_fields(item)
+    return fields
+
+
+def return_comparison(operator, left_values, right_values):
+    """ Returns a boolean array comparing two Series the way REDCap does. When both values of a
+        row are numbers they are compared as numbers, so '1.50' equals 1.5. Otherwise = and <>
+        compare the values as text, with missing values as '', and the other operators are False."""
+
+    left_numbers = return_numbers(left_values)
+    right_numbers = return_numbers(right_values)
+    both_numbers = ~np.isnan(left_numbers) & ~np.isnan(right_numbers)
+
+    with np.errstate(invalid='ignore'):
+        if operator in ('=', '==', '<>', '!='):
+            left_text = left_values.astype(object).where(left_values.notna(), '').astype(str).values
+            right_text = right_values.astype(object).where(right_values.notna(), '').astype(str).values
+            equal = np.where(both_numbers, left_numbers == right_numbers, left_text == right_text)
+            return ~equal if operator in ('<>', '!=') else equal
+        comparisons = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+        return both_numbers & comparisons[operator](left_numbers, right_numbers)
+
+
+# the arithmetic operators of calculations
+ARITHMETIC_OPERATORS = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide, '^': np.power}
+
+
+def evaluate_expression(tree, return_field_values, rows):
+    """ Evaluates a compiled expression over rows rows at once. return_field_values is given a
+        variable name and a checkbox code or None, and returns the Series of that field's converted
+        values. Returns a Series for a field or literal, an array of floats for arithmetic and
+        functions, and a boolean array for anything else."""
+
+    kind = tree[0]
+    if kind == 'field':
+        return return_field_values(tree[1], tree[2])
+    if kind == 'literal':
+        return pd.Series([tree[1]] * rows, dtype=object)
+    if kind == 'compare':
+        return return_comparison(tree[1], as_values(evaluate_expression(tree[2], return_field_values, rows)),
+                                 as_values(evaluate_expression(tree[3], return_field_values, rows)))
+    # numbers that are missing, or that come from dividing by 0, make the result missing
+    with np.errstate(all='ignore'):
+        if kind == 'arithmetic':
+            return ARITHMETIC_OPERATORS[tree[1]](
+                return_numbers(evaluate_expression(tree[2], return_field_values, rows)),
+                return_numbers(evaluate_expression(tree[3], return_field_values, rows)))
+        if kind == 'negate':
+            return -return_numbers(evaluate_expression(tree[1], return_field_values, rows))
+        if kind == 'function':
+            arguments = [return_numbers(evaluate_expression(argument, return_field_values, rows))
+                         for argument in tree[2]]
+            return np.broadcast_to(CALCULATION_FUNCTIONS[tree[1]](*arguments), (rows,)).astype(np.float64)
+    left = as_condition(evaluate_expression(tree[1], return_field_values, rows))
+    right = as_condition(evaluate_expression(tree[2], return_field_values, rows))
+    return left & right if kind == 'and' else left | right
+
+
+def as_values(result):
+    """ Returns the result of part of an expression as a Series of values. True and False become 1
+        and 0, as they do in REDCap."""
+
+    if isinstance(result, pd.Series):
+        return result.reset_index(drop=True)
+    if result.dtype == bool:
+        result = result.astype(np.int64)
+    return pd.Series(result)
+
+
+def as_condition(result):
+    """ Returns the result of part of an expression as a boolean array. A value on its own is true
+        when it is a number other than 0."""
+
+    if isinstance(result, np.ndarray) and result.dtype == bool:
+        return result
+    numbers = return_numbers(result)
+    return ~np.isnan(numbers) & (numbers != 0)
+
+
+def return_field_values_function(data_df, target_data_df, data_dictionary, unconverted_field_names):
+    """ Returns the function that evaluate_expression looks up fields with. It returns the
+        converted values of a field from target_data_df, or of one checkbox column for a checkbox
+        reference such as [site(2)]. It raises KeyError for a field that is missing from data_df,
+        or that is in unconverted_field_names because it could not be converted."""
+
+    variable_labels = data_dictionary.return_field_labels_by_variable_name()
+
+    def return_field_values(variable_name, checkbox_code):
+        field_label = variable_labels.get(variable_name)
+        if field_label is None or field_label not in data_df.columns or field_label in unconverted_field_names:
+            raise KeyError(variable_name)
+        if checkbox_code is None:
+            return target_data_df[field_label].reset_index(drop=True)
+        checkbox_field_name = field_label + '___' + checkbox_code.strip().strip("'\"")
+        if checkbox_field_name in target_data_df.columns:
+            return target_data_df[checkbox_field_name].reset_index(drop=True)
+        raise KeyError(variable_name + '(' + checkbox_code + ')')
+
+    return return_field_values
+
+
+def return_calculated_text(numbers):
+    """ Returns calculated numbers as text for the target_data_df, without a decimal point for whole
+        numbers. Missing numbers are NaN."""
+
+    return pd.Series([str(int(number)) if number.is_integer() else repr(float(number))
+                      if np.isfinite(number) else np.nan for number in numbers], dtype=object)
+
+
+def check_calculations(data_df, target_data_df, data_dictionary, unconverted_field_names):
+    """ Calculates every calc field in data_df from the converted values of the fields its
+        calculation refers to, a whole column at a time. target_data_df is updated in place:
+        missing values of a calc field are filled with the calculated ones, which later calc fields
+        can refer to, and given numbers are written the same way as the calculated ones. Fields that refer to a field that is missing from the data, or in
+        unconverted_field_names because it could not be converted, are not calculated.
+
+        Returns a dictionary of data field name -> boolean array that is True for every row whose
+        value is not the calculated one, for the fields with any, and a list of notes about the
+        calculations that could not be done."""
+
+    mismatches = collections.OrderedDict()
+    notes = []
+    return_field_values = return_field_values_function(
+        data_df, target_data_df, data_dictionary, unconverted_field_names)
+
+    for data_field_name, (calculation, tree, problem) in data_dictionary.return_compiled_calculations().items():
+        if data_field_name not in data_df.columns:
+            continue
+        if tree is None:
+            notes.append(data_field_name + ": calculation " + problem + ": " + calculation)
+            continue
+        try:
+            calculated_numbers = return_numbers(evaluate_expression(tree, return_field_values, len(data_df)))
+        except KeyError as error:
+            notes.append(data_field_name + ": calculation not done, because " + str(error.args[0]) +
+                         " is not in the data or could not be converted")
+            continue
+        except TypeError:
+            notes.append(data_field_name + ": calculation not done, because a function has the wrong "
+                                           "number of arguments: " + calculation)
+            continue
+        calculated = np.isfinite(calculated_numbers)
+
+        # given values are checked against the calculated ones, and missing values are filled in
+        given_values = data_df[data_field_name].reset_index(drop=True)
+        given = given_values.notna().values
+        given_numbers = return_numbers(given_values)
+        with np.errstate(invalid='ignore'):
+            not_calculated_value = given & (np.isnan(given_numbers) | (calculated & ~np.isclose(
+                given_numbers, calculated_numbers, rtol=1e-9, atol=1e-9)))
+        if not_calculated_value.any():
+            mismatches[data_field_name] = not_calculated_value
+        # given numbers are written the way calculated ones are, so '60.0' and a filled 60 are both '60'.
+        # Given values that are not numbers are kept as they are
+        filled_values = given_values.astype(object).copy()
+        given_number = given & np.isfinite(given_numbers)
+        filled_values[given_number] = return_calculated_text(given_numbers[given_number]).values
+        fill = ~given & calculated
+        filled_values[fill] = return_calculated_text(calculated_numbers[fill]).values
+        filled_values.index = target_data_df.index
+        target_data_df[data_field_name] = filled_values
+    return mismatches, notes
+
+
+def check_branching_logic(data_df, target_data_df, data_dictionary, unconverted_field_names):
+    """ Finds the rows where each field of data_df is hidden by its branching logic, and so must be
+        empty. data_df holds the original values, and target_data_df the converted ones that the
+        branching logic is evaluated on. Fields that refer to a field that is missing from the
+        data, or in unconverted_field_names because it could not be converted, are not checked.
+
+        Returns a dictionary of data field name -> boolean array that is True for every row where
+        the field is hidden, for the fields with any, and a list of notes about the fields whose
+        branching logic could not be checked."""
+
+    hidden_fields = collections.OrderedDict()
+    notes = []
+    return_field_values = return_field_values_function(
+        data_df, target_data_df, data_dictionary, unconverted_field_names)
+
+    for data_field_name, (expression, tree, problem) in data_dictionary.return_compiled_branching_logic().items():
+        if data_field_name not in data_df.columns:
+            continue
+        if tree is None:
+            notes.append(data_field_name + ": branching logic " + problem + ": " + expression)
+            continue
+        try:
+            shown = as_condition(evaluate_expression(tree, return_field_values, len(data_df)))
+        except KeyError as error:
+            notes.append(data_field_name + ": branching logic not checked, because " + str(error.args[0]) +
+                         " is not in the data or could not be converted")
+            continue
+        except TypeError:
+            notes.append(data_field_name + ": branching logic not checked, because a function has the wrong "
+                                           "number of arguments: " + expression)
+            continue
+        if not shown.all():
+            hidden_fields[data_field_name] = ~shown
+    return hidden_fields, notes
+
+
+# default number of rows read at a time when a csv file is converted in chunks
+DEFAULT_CHUNKSIZE = 100000
+
+# one record per erroneous cell: its position in the data, its field name, its original value, what
+# was expected instead, and the reason it is an error
+ERROR_RECORD_DTYPE = np.dtype([('row', np.int64), ('field', object), ('value', object), ('expected', object),
+                               ('reason', object)])
+
+# number of error records buffered before they are written to the structured error report
+ERROR_RECORD_BATCH_SIZE = 100000
+
+# number of erroneous values, and positions of each, written to the error log for each field
+ERROR_SUMMARY_EXAMPLES = 10
+
+# number of the slowest fields written to the error log by a Profiler
+PROFILE_TOP_FIELDS = 10
+
+# columns with more distinct values than this fraction of their rows are converted row by row
+DEDUPE_MAX_UNIQUE_FRACTION = 0.5
+
+# changes whenever the state saved by an incremental run changes, so that old states are not used
+INCREMENTAL_STATE_VERSION = 1
+
+# changes whenever the way a data dictionary is compiled changes, so that old caches are rebuilt
+DATA_DICTIONARY_CACHE_VERSION = 6
+
+# changes whenever the way an excel sheet is cached changes, so that old cached copies are reread
+EXCEL_CACHE_VERSION = 1
+
+# one compiled row of the data dictionary. choices maps each parsed choice label to the
+# code REDCap expects for it, the code written before the label in the metadata choices.
+# validation_min and validation_max are the text validation min and max, or None,
+# branching_logic is the expression that says when the field is shown, or None, and calculation is
+# the formula of a calc field, or None.
+DataDictionaryField = collections.namedtuple(
+    'DataDictionaryField', ['field_label', 'variable_name', 'field_type', 'validation_type', 'choices',
+                            'validation_min', 'validation_max', 'branching_logic', 'calculation'])
+
+
+class DataDictionary(object):
+    """ A data dictionary (metadata) compiled once into a hash index. Each properly formatted
+        field label is mapped to a DataDictionaryField holding its variable name, field type,
+        text validation type, and parsed choices, so looking up a data column is O(1) instead
+        of a scan over every row of the metadata DataFrame.
+
+        When a field label appears more than once in the metadata, the first row is used."""
+
+    # field types whose 'Choices, Calculations, OR Slider Labels' column holds a list of choices
+    choice_field_types = ('radio', 'dropdown', 'checkbox')
+    # field types whose choices are fixed by REDCap instead of listed in the metadata, with the
+    # codes REDCap gives them
+    fixed_choices = {'yesno': {'no': '0', 'yes': '1'}, 'truefalse': {'false': '0', 'true': '1'}}
+    # field types whose values are free text. Only text fields have a text validation type, since
+    # the same column of a slider field says whether its number is shown
+    text_field_types = ('text', 'notes', 'slider', 'file', 'descriptive')
+
+    def __init__(self, metadata_df):
+        # checks the metadata field names and changes them to the proper format because these
+        # field names are referenced throughout the code
+        metadata_df = metadata_df.copy()
+        metadata_df.columns = return_list_of_properly_formatted_field_names(list(metadata_df.columns))
+
+        # values from metadata_df's first column, reported when a data field name does not match
+        self.variable_names = metadata_df.variable_field_name.tolist()
+        self.fields = {}
+
+        field_labels = return_list_of_properly_formatted_field_names(metadata_df.field_label.tolist())
+        # older data dictionaries may not have the text validation min and max columns
+        no_limits = [None] * len(metadata_df)
+        # the branching logic column's name has punctuation in it, so it is found by how it starts
+        branching_logic_columns = [name for name in metadata_df.columns if str(name).startswith('branching_logic')]
+        branching_logic = (metadata_df[branching_logic_columns[0]].tolist() if branching_logic_columns
+                           else no_limits)
+        rows = zip(field_labels, self.variable_names, metadata_df.field_type.tolist(),
+                   metadata_df.text_validation_type_or_show_slider_number.tolist(),
+                   metadata_df.choices_calculations_or_slider_labels.tolist(),
+                   metadata_df['text_validation_min'].tolist() if 'text_validation_min' in metadata_df else no_limits,
+                   metadata_df['text_validation_max'].tolist() if 'text_validation_max' in metadata_df else no_limits,
+                   branching_logic)
+        for field_label, variable_name, field_type, validation_type, choices_string, validation_min, \
+                validation_max, field_branching_logic in rows:
+            if field_label in self.fields:
+                continue
+            if isnan(validation_type) or not validation_type or field_type != 'text':
+                validation_type = None
+            if validation_min is not None and isnan(validation_min):
+                validation_min = None
+            if validation_max is not None and isnan(validation_max):
+                validation_max = None
+            if field_branching_logic is not None and (isnan(field_branching_logic) or
+                                                      not str(field_branching_logic).strip()):
+                field_branching_logic = None
+            # only choice fields have choices, which are listed in the metadata or fixed by REDCap
+            if field_type in self.choice_field_types and not isnan(choices_string):
+                parsed_choices_list = parse_metadata_choices(str(choices_string), '|')
+            else:
+                parsed_choices_list = []
+            choices = dict(self.fixed_choices.get(field_type, {}))
+            for choice, code in parsed_choices_list:
+                choices.setdefault(choice, code)
+            # calc fields hold their formula where other fields hold their choices
+            calculation = None
+            if field_type == 'calc' and not isnan(choices_string) and str(choices_string).strip():
+                calculation = str(choices_string)
+            self.fields[field_label] = DataDictionaryField(
+                field_label, variable_name, field_type, validation_type, choices, validation_min, validation_max,
+                field_branching_logic, calculation)
+
+    @classmethod
+    def from_file(cls, metadata_source, sheet_name=None, cache_dir=None):
+        """ Returns a DataDictionary built from a csv or excel metadata file. When an excel file has
+            more than one sheet, sheet_name must say which sheet to read.
+
+            When cache_dir is given, the compiled dictionary is saved there, keyed by a hash of the
+            file's contents, and later calls load it from the cache instead of parsing the file
+            again. A changed file has a different hash, so its dictionary is rebuilt."""
+
+        if cache_dir is None:
+            return cls(read_data_file(metadata_source, sheet_name))
+
+        cache_path = return_data_dictionary_cache_path(metadata_source, sheet_name, cache_dir)
+        data_dictionary = load_data_dictionary_cache(cache_path)
+        if data_dictionary is None:
+            data_dictionary = cls(read_data_file(metadata_source, sheet_name))
+            save_data_dictionary_cache(data_dictionary, cache_path)
+        return data_dictionary
+
+    @classmethod
+    def from_fields(cls, variable_names, fields):
+        """ Returns a DataDictionary made from an already compiled list of variable names and
+            list of DataDictionaryFields."""
+
+        data_dictionary = cls.__new__(cls)
+        data_dictionary.variable_names = list(variable_names)
+        data_dictionary.fields = dict((field.field_label, field) for field in fields)
+        return data_dictionary
+
+    def return_field_labels_by_variable_name(self):
+        """ Returns a dictionary of variable name -> field label, for looking up the fields that
+            branching logic refers to."""
+
+        field_labels = {}
+        for field in self.fields.values():
+            field_labels.setdefault(field.variable_name, field.field_label)
+        return field_labels
+
+    def return_unknown_expression_fields(self, tree):
+        """ Returns a sorted list of the field references in a compiled expression, written the way
+            they are in branching logic, such as [weight] or [site(3)], that are not fields of the
+            data dictionary, or not choices of the checkbox field they refer to."""
+
+        field_labels = self.return_field_labels_by_variable_name()
+        unknown_fields = []
+        for variable_name, checkbox_code in return_expression_fields(tree):
+            field = self.fields.get(field_labels.get(variable_name))
+            if checkbox_code is None:
+                if field is None:
+                    unknown_fields.append('[' + variable_name + ']')
+            elif (field is None or field.field_type != 'checkbox' or
+                  checkbox_code.strip().strip("'\"") not in field.choices.values()):
+                unknown_fields.append('[' + variable_name + '(' + checkbox_code + ')]')
+        return sorted(unknown_fields)
+
+    def return_compiled_expressions(self, property_name):
+        """ Returns a dictionary of field label -> (expression, compiled tree, problem) for every
+            field with an expression in property_name, 'branching_logic' or 'calculation', in the
+            order of the data dictionary. The tree is None when the expression could not be read,
+            or refers to fields that are not in the data dictionary, and problem then says which.
+            Expressions are compiled the first time they are needed and kept for later calls."""
+
+        # from_fields does not call __init__, so the compiled expressions are set up here
+        compiled_expressions = getattr(self, 'compiled_expressions', None)
+        if compiled_expressions is None:
+            compiled_expressions = self.compiled_expressions = {}
+        if property_name not in compiled_expressions:
+            field_expressions = collections.OrderedDict()
+            for field in self.fields.values():
+                expression = getattr(field, property_name)
+                if not expression:
+                    continue
+                problem = None
+                try:
+                    tree = compile_expression(str(expression))
+                except ValueError:
+                    tree = None
+                    problem = "could not be read"
+                else:
+                    # a field the expression refers to that is not in the data dictionary would only
+                    # be found missing when the expression is evaluated, so it is reported here
+                    unknown_fields = self.return_unknown_expression_fields(tree)
+                    if unknown_fields:
+                        tree = None
+                        problem = ("refers to " + ", ".join(unknown_fields) + ", which " +
+                                   ("is" if len(unknown_fields) == 1 else "are") + " not in the data dictionary")
+                field_expressions[field.field_label] = (expression, tree, problem)
+            compiled_expressions[property_name] = field_expressions
+        return compiled_expressions[property_name]
+
+    def return_compiled_branching_logic(self):
+        """ Returns a dictionary of field label -> (branching logic, compiled tree, problem), as
+            described for return_compiled_expressions."""
+
+        return self.return_compiled_expressions('branching_logic')
+
+    def return_compiled_calculations(self):
+        """ Returns a dictionary of field label -> (calculation, compiled tree, problem) for every
+            calc field, as described for return_compiled_expressions."""
+
+        return self.return_compiled_expressions('calculation')
+
+    def __contains__(self, field_label):
+        return field_label in self.fields
+
+    def __getitem__(self, field_label):
+        return self.fields[field_label]
+
+    def __len__(self):
+        return len(self.fields)
+
+
+def return_data_dictionary_cache_path(metadata_source, sheet_name, cache_dir):
+    """ Returns the path of the cached compiled dictionary for metadata_source. The file name is a
+        hash of the metadata file's contents, the sheet read, and DATA_DICTIONARY_CACHE_VERSION."""
+
+    file_hash = return_file_hash(metadata_source, (sheet_name, DATA_DICTIONARY_CACHE_VERSION))
+    return os.path.join(cache_dir, file_hash + '.pickle')
+
+
+def return_file_hash(file_path, extra=None):
+    """ Returns the sha256 hash of the contents of file_path, and of the repr of extra when given."""
+
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(1 << 20), b''):
+            file_hash.update(block)
+    if extra is not None:
+        file_hash.update(repr(extra).encode('utf-8'))
+    return file_hash.hexdigest()
+
+
+def save_data_dictionary_cache(data_dictionary, cache_path):
+    """ Pickles the compiled data_dictionary to cache_path. Only plain lists and tuples are saved,
+        so the cache can be loaded no matter how the converter was started. The file is written
+        to a temporary name first, so a half written cache is never read."""
+
+    cache_data = {
+        'version': DATA_DICTIONARY_CACHE_VERSION,
+        'field_properties': DataDictionaryField._fields,
+        'variable_names': list(data_dictionary.variable_names),
+        'fields': [tuple(field) for field in data_dictionary.fields.values()],
+    }
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    temporary_cache_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary_cache_path, 'wb') as cache_file:
+        pickle.dump(cache_data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_cache_path, cache_path)
+
+
+def load_data_dictionary_cache(cache_path):
+    """ Returns the DataDictionary pickled at cache_path, or None if there is no cache there or it
+        was written by a version of the converter that compiles dictionaries differently."""
+
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cache_data = pickle.load(cache_file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
+    if (cache_data.get('version') != DATA_DICTIONARY_CACHE_VERSION or
+            tuple(cache_data.get('field_properties', ())) != DataDictionaryField._fields):
+        return None
+    return DataDictionary.from_fields(
+        cache_data['variable_names'], [DataDictionaryField(*field) for field in cache_data['fields']])
 
-    new_list = []
-    for choice in updated_date_list:
-        if choice:
-            new_list.append(False)
-        else:
-            new_list.append(True)
-    return new_list
 
+def isnan(num):
+    """ Checks if a item in a list is NaN."""
 
-def checkbox_values_for_error_df(error_value_indices, data_values):
-    """ Appends False to a list if no checkbox error has been found, and appends True when an error has
-        been found. This list is then added to the values in the corresponding column in the
-        error_data_df. """
+    return num != num
 
-    num_of_values = len(data_values)
-    true_false_list = [False] * num_of_values
-    for index in error_value_indices:
-        true_false_list[index] = True
-    return true_false_list
 
+# the result of converting one column. converted_df holds the column(s) that replace the original
+# column in the target_data_df, or is None when the column is left unchanged. error_values is the
+# column of True(error) and False(no error) values for the error_data_df, or None when there is
+# none. error_records is a structured array of ERROR_RECORD_DTYPE for every erroneous cell.
+# error_message is written to the error log for errors that are not about single cells, and
+# has_errors is True when the column contains errors that stop the csv file from being output.
+TransformedColumn = collections.namedtuple(
+    'TransformedColumn',
+    ['data_field_name', 'converted_df', 'error_values', 'error_records', 'error_message', 'has_errors'])
+
+
+def transform_data_column(current_data_field_name, data_values, current_field, first_position=1, dedupe=True):
+    """ Converts one column of data values into the format REDCap expects for current_field, the
+        compiled metadata of the column. Returns a TransformedColumn.
+
+        When dedupe is True, the column is factorized first, and only its distinct values are
+        cleaned, validated, recoded and tokenized. The results are then broadcast back to every
+        row with the factorized codes, so the work grows with the number of distinct values
+        instead of the number of rows. Columns with more than DEDUPE_MAX_UNIQUE_FRACTION of their
+        rows distinct are converted row by row, since factorizing them saves nothing.
+
+        Columns are independent of each other, so this function only uses its arguments and can
+        be run in a worker process."""
+
+    data_values = data_values.reset_index(drop=True)
+
+    # the position of each row's value among the distinct values, or None when every row is converted
+    codes = None
+    values_to_convert = data_values
+    if dedupe and len(data_values):
+        codes, unique_values = pd.factorize(data_values)
+        if len(unique_values) <= DEDUPE_MAX_UNIQUE_FRACTION * len(data_values):
+            # missing values are converted once, as an extra distinct value after the others
+            values_to_convert = pd.Series(unique_values)
+            missing = codes < 0
+            if missing.any():
+                values_to_convert = values_to_convert.reindex(range(len(unique_values) + 1))
+                codes = np.where(missing, len(unique_values), codes)
+        else:
+            codes = None
+
+    converted_df, error_values, error_reason, expected, error_message, has_errors = return_converted_values(
+        current_data_field_name, values_to_convert, current_field)
+
+    # broadcasts the results for the distinct values back to every row
+    if codes is not None:
+        if converted_df is not None:
+            converted_df = converted_df.iloc[codes].reset_index(drop=True)
+        if error_values is not None:
+            error_values = np.asarray(error_values, dtype=bool)[codes]
+        if not isinstance(error_reason, str):
+            error_reason = np.asarray(error_reason, dtype=object)[codes]
+
+    # every erroneous cell, with its position and the reason it is an error
+    if error_values is None:
+        error_records = np.empty(0, dtype=ERROR_RECORD_DTYPE)
+    else:
+        error_records = return_error_records(
+            current_data_field_name, error_values, data_values.values, error_reason, first_position, expected)
+
+    return TransformedColumn(current_data_field_name, converted_df, error_values, error_records,
+                             error_message, has_errors)
+
+
+def return_converted_values(current_data_field_name, data_values, current_field):
+    """ Converts data_values, the values of one column or the distinct values of it, for
+        transform_data_column. Returns the converted_df, the error_values, the reason for the
+        errors (a string, or an array lined up with data_values), what was expected instead, the
+        error_message, and has_errors, as described for TransformedColumn."""
+
+    converted_df = None
+    error_values = None
+    error_reason = 'not a choice'
+    # the metadata choices, separated by '|', or the text validation type
+    expected = '|'.join(current_field.choices)
+    error_message = ''
+    has_errors = False
+
+    # validate format of text fields, and check other free text fields for missing data
+    if current_field.field_type in DataDictionary.text_field_types:
+        # if the text validation column is not empty, format validation is needed
+        if current_field.validation_type:
+            text_validation_type = current_field.validation_type
+            error_reason = 'not a valid ' + text_validation_type
+            expected = text_validation_type
+
+            # Checks valid format for date
+            if text_validation_type in DATE_OUTPUT_FORMATS:
+                # date values in correct data format, NaN where a date is missing or could not be parsed
+                updated_date_format_values = date_validation(data_values, text_validation_type)
+                # True(error) and False(no error) values for the error_data_df
+                error_values = updated_date_format_values.isna().values
+                # dates that were given but could not be parsed stop the csv file from being output
+                has_errors = bool((error_values & data_values.notna().values).any())
+                # corrected data formats for the target_data_df
+                converted_df = updated_date_format_values.to_frame(current_data_field_name)
+
+            # Validates numbers, converts them to the format of their validation type, and checks
+            # them against the text validation min and max
+            elif text_validation_type in NUMERIC_VALIDATION_DECIMALS:
+                converted_values, invalid_values, error_reason = numeric_validation(
+                    data_values, text_validation_type, current_field.validation_min, current_field.validation_max)
+                expected = return_numeric_expected(
+                    text_validation_type, current_field.validation_min, current_field.validation_max)
+                # missing values are flagged, but only values that are not valid numbers stop the
+                # csv file from being output
+                error_values = invalid_values | data_values.isna().values
+                has_errors = bool(invalid_values.any())
+                converted_df = converted_values.to_frame(current_data_field_name)
+
+            # Validates the other text validation types with their validator from TEXT_VALIDATORS
+            elif text_validation_type in TEXT_VALIDATORS:
+                invalid_values = text_validation(data_values, text_validation_type)
+                error_values = invalid_values | data_values.isna().values
+                has_errors = bool(invalid_values.any())
+
+            # validation types without a validator are only checked for missing data
+            else:
+                error_values = data_values.isna().values
 
-def isnan(num):
-    """ Checks if a item in a list is NaN."""
+        # if there is no text validation required, the only errors are missing data
+        else:
+            error_values = no_text_validation_error_values_for_df(data_values)
+    # calc fields have a formula instead of choices. Their values are checked against it, and filled
+    # in where they are missing, by check_calculations once every other column is converted
+    elif current_field.field_type == 'calc':
+        error_values = np.zeros(len(data_values), dtype=bool)
+    else:
+        # cleans data_values for comparison metadata_source choices.
+        # Missing values stay NaN so the cleaned values line up with the rows of the data_df
+        cleaned_data_values_from_current_field_name_col = return_cleaned_data_values(data_values)
+
+        # the parsed metadata choices, already cleaned so that each item in the list is an
+        # individual choice. If the choices cell was empty, this list is ['no', 'yes']
+        parsed_metadata_choices_list = list(current_field.choices)
+
+        # checkbox
+        if current_field.field_type == 'checkbox':
+            # creates a list of column names that will be added to the target_df
+            col_names_for_new_checkbox_cols = return_checkbox_col_field_names(
+                current_data_field_name, current_field.choices)
+
+            # tokenizes every value once and builds a matrix of which choices are checked in each row
+            values_for_new_checkbox_cols, error_values = return_checkbox_col_values(
+                cleaned_data_values_from_current_field_name_col, parsed_metadata_choices_list, '|')
+
+            if error_values.any():
+                has_errors = True
+            else:
+                # the new checkbox columns that replace the current_data_field_name column, as 1 byte flags
+                converted_df = pd.DataFrame(values_for_new_checkbox_cols.astype(np.int8),
+                                            columns=col_names_for_new_checkbox_cols)
+        else:
+            # True for every value that is not found in the metadata_df choices, including missing data
+            error_values = (~cleaned_data_values_from_current_field_name_col.isin(
+                parsed_metadata_choices_list)).values
+
+            # missing values are flagged, but only values that are not choices stop the csv file
+            # from being output. If there are any, the column is not converted
+            if (error_values & data_values.notna().values).any():
+                has_errors = True
+            else:
+                # replace the data values with their codes from the metadata_source choices
+                data_values_index_in_metadata_choices = return_index_of_data_values_in_metadata(
+                    cleaned_data_values_from_current_field_name_col, current_field.choices)
+                converted_df = data_values_index_in_metadata_choices.to_frame(current_data_field_name)
+
+    return converted_df, error_values, error_reason, expected, error_message, has_errors
+
+
+def write_error_summary(error_records, error_log, max_examples=ERROR_SUMMARY_EXAMPLES):
+    """ Writes a summary of error_records to the error_log. For each field, the number of errors
+        and the reasons for them are written, followed by up to max_examples of the erroneous
+        values and the first max_examples positions where each was found. Every record is kept in
+        the structured error report written by an ErrorRecordWriter."""
+
+    if not len(error_records):
+        return
+    error_records_df = pd.DataFrame(error_records)
+    for data_field_name, field_error_records_df in error_records_df.groupby('field', sort=False):
+        reason_counts = field_error_records_df['reason'].value_counts(sort=False)
+        error_log.write(str(data_field_name) + ": " + str(len(field_error_records_df)) + " errors (" +
+                        ", ".join(reason + ": " + str(count) for reason, count in reason_counts.items()) + ")\n")
+        # the first erroneous values, in the order they were found, and the first positions of each
+        examples = {}
+        for value, positions in field_error_records_df.groupby('value', sort=False, dropna=False)['row']:
+            if len(examples) >= max_examples:
+                break
+            examples['NaN' if value != value else value] = [int(position) for position in positions[:max_examples]]
+        error_log.write("    " + str(examples) + "\n")
+
+
+def return_field_name_error_records(data_field_names, data_dictionary):
+    """ Returns a structured array of ERROR_RECORD_DTYPE with a record for every data field name that
+        does not match a field label in the data_dictionary. The row of these records is 0, the
+        header row."""
+
+    field_name_errors = [data_field_name for data_field_name in data_field_names
+                         if data_field_name not in data_dictionary]
+    error_records = np.empty(len(field_name_errors), dtype=ERROR_RECORD_DTYPE)
+    error_records['row'] = 0
+    error_records['field'] = field_name_errors
+    error_records['value'] = field_name_errors
+    error_records['expected'] = 'a field label from the data dictionary'
+    error_records['reason'] = 'field name not in data dictionary'
+    return error_records
+
+
+class ErrorRecordWriter(object):
+    """ Appends error records to a structured error report, so that large numbers of errors can be
+        loaded and queried by other tools. The report is a Parquet file when path ends in
+        '.parquet', which needs pyarrow, and a csv file otherwise. Each record has the columns
+        row, field, value, expected, and reason. Records are buffered and written batch_size at a
+        time. Use it as a context manager, or call close() when done."""
+
+    def __init__(self, path, batch_size=ERROR_RECORD_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.number_of_records = 0
+        self.buffered_records = []
+        self.number_of_buffered_records = 0
+        self.parquet_writer = None
+        self.header_written = False
+        if path.endswith('.parquet'):
+            import pyarrow
+            import pyarrow.parquet
+            self.parquet_schema = pyarrow.schema([
+                ('row', pyarrow.int64()), ('field', pyarrow.string()), ('value', pyarrow.string()),
+                ('expected', pyarrow.string()), ('reason', pyarrow.string())])
+            self.parquet_writer = pyarrow.parquet.ParquetWriter(path, self.parquet_schema)
+
+    def write(self, error_records):
+        """ Adds a structured array of ERROR_RECORD_DTYPE to the report."""
+
+        if not len(error_records):
+            return
+        self.buffered_records.append(error_records)
+        self.number_of_buffered_records += len(error_records)
+        self.number_of_records += len(error_records)
+        if self.number_of_buffered_records >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered records to the report."""
+
+        if not self.buffered_records and self.header_written:
+            return
+        error_records = np.concatenate([np.empty(0, dtype=ERROR_RECORD_DTYPE)] + self.buffered_records)
+        self.buffered_records = []
+        self.number_of_buffered_records = 0
+
+        # raw values of every type are written as their text, and missing values stay empty
+        error_records_df = pd.DataFrame(error_records)
+        error_records_df['value'] = error_records_df['value'].where(
+            error_records_df['value'].isna(), error_records_df['value'].astype(str))
+        for column in ('field', 'expected', 'reason'):
+            error_records_df[column] = error_records_df[column].astype(str)
+
+        if self.parquet_writer is not None:
+            import pyarrow
+            if len(error_records_df):
+                self.parquet_writer.write_table(pyarrow.Table.from_pandas(
+                    error_records_df, schema=self.parquet_schema, preserve_index=False))
+        else:
+            error_records_df.to_csv(self.path, mode='a' if self.header_written else 'w',
+                                    header=not self.header_written, index=False)
+        self.header_written = True
+
+    def close(self):
+        """ Writes any buffered records and closes the report."""
+
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def return_peak_rss_bytes():
+    """ Returns the most memory the process has held so far in bytes, or None where the resource
+        module is not available, such as on Windows."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, and Linux reports kilobytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+class Profiler(object):
+    """ Records how long each stage of a conversion takes, how many rows it handled, and how much
+        memory it used, along with the same for every field that is converted. Memory is measured
+        with tracemalloc, as the most memory allocated during the stage beyond what was allocated
+        when it began, and as the peak resident memory of the process when the stage ended.
+
+        Stages are timed with the stage() context manager, which can also be used to decorate a
+        function. Stages can be nested. The records are written to the error log by write_log()
+        and to a JSON file by save()."""
+
+    def __init__(self, trace_memory=True):
+        self.records = []
+        self.open_stages = []
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None, kind='stage'):
+        """ Times the code run inside it as the stage name that handled rows rows. kind is 'stage'
+            for a stage of the conversion, or 'field' for the conversion of one field."""
+
+        tracing = tracemalloc.is_tracing()
+        open_stage = {'memory_at_start': 0, 'peak_memory': 0}
+        if tracing:
+            open_stage['memory_at_start'], peak_memory = tracemalloc.get_traced_memory()
+            # the enclosing stage keeps the peak so far, since it is reset for this stage
+            if self.open_stages:
+                self.open_stages[-1]['peak_memory'] = max(self.open_stages[-1]['peak_memory'], peak_memory)
+            tracemalloc.reset_peak()
+        self.open_stages.append(open_stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.open_stages.pop()
+            memory_peak_bytes = None
+            if tracing and tracemalloc.is_tracing():
+                peak_memory = max(open_stage['peak_memory'], tracemalloc.get_traced_memory()[1])
+                memory_peak_bytes = max(peak_memory - open_stage['memory_at_start'], 0)
+                if self.open_stages:
+                    self.open_stages[-1]['peak_memory'] = max(self.open_stages[-1]['peak_memory'], peak_memory)
+            self.add_record(name, seconds, rows, kind, memory_peak_bytes)
+
+    def add_record(self, name, seconds, rows=None, kind='stage', memory_peak_bytes=None):
+        """ Records a stage or field that was timed somewhere else, such as in a worker process."""
+
+        self.records.append({
+            'kind': kind,
+            'name': name,
+            'seconds': round(seconds, 6),
+            'rows': None if rows is None else int(rows),
+            'memory_peak_bytes': memory_peak_bytes,
+            'peak_rss_bytes': return_peak_rss_bytes(),
+        })
+
+    def return_field_totals(self):
+        """ Returns a list of the total seconds, rows and largest memory peak of each field, which
+            is converted once for every chunk of a file, with the slowest field first."""
+
+        field_totals = collections.OrderedDict()
+        for record in self.records:
+            if record['kind'] != 'field':
+                continue
+            totals = field_totals.setdefault(record['name'], {
+                'name': record['name'], 'seconds': 0.0, 'rows': 0, 'memory_peak_bytes': None})
+            totals['seconds'] = round(totals['seconds'] + record['seconds'], 6)
+            totals['rows'] += record['rows'] or 0
+            if record['memory_peak_bytes'] is not None:
+                totals['memory_peak_bytes'] = max(totals['memory_peak_bytes'] or 0, record['memory_peak_bytes'])
+        return sorted(field_totals.values(), key=lambda totals: totals['seconds'], reverse=True)
+
+    def write_log(self, error_log, top_fields=PROFILE_TOP_FIELDS):
+        """ Writes every stage, and the top_fields slowest fields, to the error_log."""
 
-    return num != num
+        error_log.write("\n")
+        error_log.write("Profile\n")
+        error_log.write("-------\n")
+        for record in self.records:
+            if record['kind'] == 'stage':
+                error_log.write(return_profile_line(record) + "\n")
+        field_totals = self.return_field_totals()
+        if field_totals and top_fields:
+            error_log.write("Slowest fields:\n")
+            for totals in field_totals[:top_fields]:
+                error_log.write("    " + return_profile_line(totals) + "\n")
+
+    def to_dict(self, top_fields=PROFILE_TOP_FIELDS):
+        """ Returns the records as a dictionary that can be saved as JSON."""
+
+        return {
+            'stages': [record for record in self.records if record['kind'] == 'stage'],
+            'fields': [record for record in self.records if record['kind'] == 'field'],
+            'slowest_fields': self.return_field_totals()[:top_fields],
+        }
+
+    def close(self):
+        """ Stops tracing memory, if this Profiler started it."""
+
+        if self.started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.started_tracing = False
+
+
+def return_profile_line(record):
+    """ Returns one line of the error log describing a stage or field recorded by a Profiler."""
+
+    line = record['name'] + ": " + format(record['seconds'], '.3f') + " seconds"
+    if record.get('rows') is not None:
+        line += ", " + str(record['rows']) + " rows"
+    if record.get('memory_peak_bytes') is not None:
+        line += ", " + format(record['memory_peak_bytes'] / 1048576.0, '.1f') + " MB allocated at peak"
+    if record.get('peak_rss_bytes') is not None:
+        line += ", " + format(record['peak_rss_bytes'] / 1048576.0, '.1f') + " MB peak RSS"
+    return line
+
+
+def return_stage(profiler, name, rows=None):
+    """ Returns profiler.stage(name, rows), or a context manager that does nothing when profiler is
+        None."""
+
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, rows)
+
+
+def save_profile(profile, path):
+    """ Writes a profile, a dictionary of Profiler.to_dict() results, to path as JSON."""
+
+    with open(path, 'w') as profile_file:
+        json.dump(profile, profile_file, indent=2)
+        profile_file.write("\n")
+
+
+def profile_transform_data_column(current_data_field_name, data_values, current_field, first_position=1,
+                                  dedupe=True):
+    """ Returns the result of transform_data_column, and the seconds it took. This is what runs in
+        a worker process when a profiled file is converted in parallel."""
+
+    start = time.perf_counter()
+    transformed_column = transform_data_column(current_data_field_name, data_values, current_field,
+                                               first_position, dedupe)
+    return transformed_column, time.perf_counter() - start
+
+
+def return_worker_pool(workers, executor='thread'):
+    """ Returns a new pool of workers threads, or of workers processes when executor is 'process',
+        for transform_data_df to convert columns in. Returns None when workers is not more than 1,
+        so that columns are converted one after another. The caller shuts the pool down, and can
+        use it as a context manager to do so.
+
+        Threads are the default, because most of the work on a column is done by pandas and numpy
+        and a thread pool shares the columns without copying them. A process pool has to pickle
+        every column and its converted result, which costs more than it saves for most files. It
+        only pays off when the per-value Python work is large, such as dates or text validation on
+        columns with many distinct values, and the machine has the cores to spare."""
+
+    if not workers or workers <= 1:
+        return None
+    if executor == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+
+def transform_data_df(data_df, data_dictionary, error_log, first_position=1, workers=None, executor='thread',
+                      profiler=None, dedupe=True, row_positions=None):
+    """ Converts the values of every column in data_df that matches a field label in the
+        data_dictionary into the format REDCap expects. data_df's columns must already be properly
+        formatted field names. Value errors are written to error_log.
+
+        Returns the converted target_data_df, an error_data_df of the same shape as data_df that
+        is True where an error was found, total_error_count, which has one item for every column
+        that contains errors, and a structured array of ERROR_RECORD_DTYPE with a record for every
+        erroneous cell of the matched columns. first_position is the position reported in the error log for
+        the first row of data_df, so that chunks of a larger file report their true positions. When
+        the rows of data_df are not next to each other in the file, row_positions gives the position
+        of each of them instead.
+
+        When workers is more than 1, the columns are converted in parallel by a pool of that many
+        workers. executor is 'thread' for a thread pool or 'process' for a process pool, which is
+        made for this call only. executor may also be a pool from return_worker_pool, or any other
+        concurrent.futures.Executor, that the caller keeps for many calls, so that each call does not
+        pay for starting workers. workers is not used then. The results are put together in the
+        same order as the columns of data_df.
 
+        When a profiler is given, the time each field takes is recorded in it. dedupe is passed on
+        to transform_data_column, so that only the distinct values of each column are converted.
 
-def main():
-    # variable names for the files
-    data_source = 'G:\\My Documents\Python Scripts\\seizure - mytest.xlsx'
-    metadata_source = 'G:\My Documents\Python Scripts\\GliomaDashboard_DataDictionary_2018-08-08.csv'
+        Once every column is converted, calc fields are checked against their calculations and
+        filled in where they are missing, and fields are checked against their branching logic."""
 
     # *** adds 1 to a list every time an error is experienced.
     total_error_count = []
 
-    # open error log text file
-    error_log = open("redcap_error_log.txt", "w+")
-    # captures current data and time
-    now = datetime.datetime.now()
-    # writes now, and the files used to the error log
-    error_log.write(str(now) + "\n")
-    error_log.write("Data dictionary file used: " + metadata_source + "\n")
-    error_log.write("Data file used: " + data_source + "\n")
-
-    # Checks whether the data_source is a csv file or an excel file
-    if data_source.endswith('.csv'):
-        # Creates DataFrame from the data_source csv file
-        data_df = create_df_from_csv(data_source)
-    elif data_source.endswith('.xlsx') or data_source.endswith('.xls'):
-        # Creates DataFrame from the data_source excel file
-        data_source_excel = pd.ExcelFile(data_source)
-        # If there is more than one sheet in the excel file, asks the user to specify which sheet
-        if len(data_source_excel.sheet_names) > 1:
-            print("There are multiple excel sheets within " + data_source + ". Please specify a sheet name.")
-            excel_sheet = input("Enter sheet name: ")
-            data_df = pd.read_excel(data_source, excel_sheet)
-        else:
-            data_df = create_df_from_excel(data_source)
-    else:
-        error_log.write("Incorrect file type. Only .csv, .xls, and .xlsx are supported.")
-
-    # Checks whether the metadata_source is a csv file or an excel file
-    if metadata_source.endswith('.csv'):
-        # Creates DataFrame from the metadata_source csv file
-        metadata_df = create_df_from_csv(metadata_source)
-    elif metadata_source.endswith('.xlsx') or metadata_source.endswith('.xls'):
-        # Creates DataFrame from the metadata_source excel file
-        metadata_source_excel = pd.ExcelFile(metadata_source)
-        # If there is more than one sheet in the excel file, asks the user to specify which sheet
-        if len(metadata_source_excel.sheet_names) > 1:
-            print("There are multiple excel sheets within " + metadata_source + ". Please specify a sheet name.")
-            excel_sheet = input("Enter sheet name: ")
-            metadata_df = pd.read_excel(metadata_source, excel_sheet)
-    else:
-        error_log.write("Incorrect file type. Only .csv, .xls, and .xlsx are supported.")
+    # the position in the file of every row of data_df, reported in the error log and error records
+    if row_positions is None:
+        row_positions = np.arange(first_position, first_position + len(data_df))
+    row_positions = np.asarray(row_positions, dtype=np.int64)
 
-    # create a copy of data_df to update with correctly formatted values
-    target_data_df = data_df.copy(deep=True)
     # create an empty DataFrame with the same dimensions as data_df for error reporting
     error_data_df = pd.DataFrame().reindex_like(data_df)
 
-    # converts column field names from target_data_df to a list to be compared to values in first column of metadata_df
-    data_field_names = list(target_data_df.columns)
-    # checks data_field_names and changes to proper format
-    reformatted_data_field_names = return_list_of_properly_formatted_field_names(data_field_names)
-
-    # changes field names to the list of properly formatted field names
-    target_data_df.columns = reformatted_data_field_names
-    data_df.columns = reformatted_data_field_names
-    error_data_df.columns = reformatted_data_field_names
-
-    # converts column field names from metadata_df to a list
-    metadata_field_names = list(metadata_df.columns)
-    # checks metadata_field_names and changes to proper format because these field names
-    # are referenced throughout the code
-    metadata_field_names = return_list_of_properly_formatted_field_names(metadata_field_names)
-    # changes metadata_df's field names to the list of properly formatted field names
-    metadata_df.columns = metadata_field_names
-
-    # converts values from metadata_df's first column to a list to be compared to column field names in data_df
-    values_in_first_col_of_metadata_df = metadata_df.variable_field_name.tolist()
-
-    # converts values from metadata_df's Field Label column to a list to be compared to column field
-    # names in data_df
-    field_label_metadata_values = metadata_df.field_label.tolist()
-    # reformat reformatted_field_label_metadata_values
-    reformatted_field_label_metadata_values = return_list_of_properly_formatted_field_names(field_label_metadata_values)
-    metadata_df.field_label = reformatted_field_label_metadata_values
-
-    # items in common between reformatted_data_field_names and values_in_first_col_of_metadata_df
-    # matches_between_data_field_names_and_metadata_first_col_values = return_matches_between_data_and_metadata(
-    #    reformatted_data_field_names, values_in_first_col_of_metadata_df)
-
-    matches_between_data_field_names_and_metadata_field_label_values = return_matches_between_data_and_metadata(
-        reformatted_data_field_names, reformatted_field_label_metadata_values)
-
-    # items that were found in reformatted_data_field_names but not in values_in_first_col_of_metadata_df
-    # data_field_names_not_found_in_metadata_first_col_values = return_difference_between_data_and_metadata(
-    # reformatted_data_field_names, values_in_first_col_of_metadata_df)
-
-    # items that were found in reformatted_data_field names but not in field label values in the metadata
+    # the field names in data_df that matched the field label values of the metadata, in data_df's order
+    matches_between_data_field_names_and_metadata_field_label_values = [
+        data_field_name for data_field_name in data_df.columns if data_field_name in data_dictionary]
+
+    # every value in a column that did not match the metadata is an error
+    for data_field_name in data_df.columns:
+        if data_field_name not in data_dictionary:
+            error_data_df[data_field_name] = True
+
+    # the arguments of transform_data_column for every matched column
+    matched_field_names = matches_between_data_field_names_and_metadata_field_label_values
+    jobs = (matched_field_names,
+            [data_df[data_field_name] for data_field_name in matched_field_names],
+            [data_dictionary[data_field_name] for data_field_name in matched_field_names],
+            [first_position] * len(matched_field_names),
+            [dedupe] * len(matched_field_names))
+
+    # a pool given by the caller is used and left open, and otherwise one is made for this call only
+    pool = None
+    if len(matched_field_names) > 1:
+        if isinstance(executor, concurrent.futures.Executor):
+            pool = contextlib.nullcontext(executor)
+        else:
+            pool = return_worker_pool(workers, executor)
+    if pool is not None:
+        with pool as pool:
+            if profiler is None:
+                transformed_columns = list(pool.map(transform_data_column, *jobs))
+            else:
+                transformed_columns = []
+                for transformed_column, seconds in pool.map(profile_transform_data_column, *jobs):
+                    profiler.add_record(transformed_column.data_field_name, seconds, len(data_df), 'field')
+                    transformed_columns.append(transformed_column)
+    elif profiler is None:
+        transformed_columns = list(map(transform_data_column, *jobs))
+    else:
+        transformed_columns = []
+        for job in zip(*jobs):
+            with profiler.stage(job[0], len(data_df), 'field'):
+                transformed_columns.append(transform_data_column(*job))
+
+    # puts the converted columns together, replacing each original column where it was
+    target_data_df_parts = []
+    transformed_columns_by_name = dict((column.data_field_name, column) for column in transformed_columns)
+    for data_field_name in data_df.columns:
+        transformed_column = transformed_columns_by_name.get(data_field_name)
+        if transformed_column is None or transformed_column.converted_df is None:
+            target_data_df_parts.append(data_df[[data_field_name]])
+        else:
+            transformed_column.converted_df.index = data_df.index
+            target_data_df_parts.append(transformed_column.converted_df)
+    target_data_df = pd.concat(target_data_df_parts, axis=1) if target_data_df_parts else data_df.copy()
+
+    # calc fields are checked against their calculations, and then the rows where branching logic
+    # hides each field are found. Both use the converted values
+    unconverted_field_names = set(column.data_field_name for column in transformed_columns if column.has_errors)
+    calculation_mismatches, calculation_notes = check_calculations(
+        data_df, target_data_df, data_dictionary, unconverted_field_names)
+    unconverted_field_names.update(calculation_mismatches)
+    hidden_fields, branching_notes = check_branching_logic(
+        data_df, target_data_df, data_dictionary, unconverted_field_names)
+    # a check can be skipped in one chunk of a file and not another, so the notes of every call are
+    # written along with the rows they are about
+    if not len(row_positions):
+        rows_checked = ""
+    elif row_positions[-1] - row_positions[0] + 1 == len(row_positions):
+        rows_checked = " (rows " + str(row_positions[0]) + " to " + str(row_positions[-1]) + ")"
+    else:
+        rows_checked = (" (" + str(len(row_positions)) + " rows from row " + str(row_positions[0]) + " to " +
+                        str(row_positions[-1]) + ")")
+    for note in calculation_notes + branching_notes:
+        error_log.write(note + rows_checked + "\n")
+
+    # a hidden field must be empty, so a missing value where it is hidden is not an error, and any
+    # other value there is
+    branching_violations = collections.OrderedDict()
+    column_error_records = []
+    for transformed_column in transformed_columns:
+        error_values = transformed_column.error_values
+        field_error_records = transformed_column.error_records
+        hidden = hidden_fields.get(transformed_column.data_field_name)
+        if hidden is not None:
+            given = data_df[transformed_column.data_field_name].notna().values
+            if error_values is not None:
+                error_values = np.asarray(error_values, dtype=bool) & ~(hidden & ~given)
+                field_error_records = field_error_records[
+                    ~(hidden & ~given)[field_error_records['row'] - first_position]]
+            if (hidden & given).any():
+                branching_violations[transformed_column.data_field_name] = hidden & given
+        if error_values is not None:
+            error_data_df[transformed_column.data_field_name] = np.asarray(error_values)
+        field_error_records['row'] = row_positions[field_error_records['row'] - first_position]
+        if transformed_column.has_errors:
+            total_error_count.append(1)
+            write_error_summary(field_error_records, error_log)
+        error_log.write(transformed_column.error_message)
+        column_error_records.append(field_error_records)
+
+    expression_error_records = []
+    for error_reason, errors, property_name, expected_prefix in (
+            ('does not match calculation', calculation_mismatches, 'calculation', 'the value of '),
+            ('hidden by branching logic', branching_violations, 'branching_logic', 'no value unless ')):
+        for data_field_name, field_error_values in errors.items():
+            error_data_df[data_field_name] = (
+                error_data_df[data_field_name].astype(object).where(error_data_df[data_field_name].notna(), False)
+                .astype(bool).values | field_error_values)
+            field_error_records = return_error_records(
+                data_field_name, field_error_values, data_df[data_field_name].values, error_reason, first_position,
+                expected_prefix + str(getattr(data_dictionary[data_field_name], property_name)))
+            field_error_records['row'] = row_positions[field_error_records['row'] - first_position]
+            total_error_count.append(1)
+            write_error_summary(field_error_records, error_log)
+            expression_error_records.append(field_error_records)
+
+    # every erroneous cell of every column
+    error_records = np.concatenate(
+        [np.empty(0, dtype=ERROR_RECORD_DTYPE)] + column_error_records + expression_error_records)
+
+    return target_data_df, error_data_df, total_error_count, error_records
+
+
+def write_field_name_errors(data_field_names, data_dictionary, error_log):
+    """ Writes the data field names that do not match a field label in the data_dictionary, and
+        their position in data_field_names, to the error_log. Returns True if there were any."""
+
+    # items that were found in data_field_names but not in field label values in the metadata
     data_field_names_not_found_in_metadata_field_label = return_difference_between_data_and_metadata(
-        reformatted_data_field_names, reformatted_field_label_metadata_values)
-
-    # values_for_error_df is a list of 0s and 1s to be placed in the error_df. 1 means an error was
-    # found, while 0 means no error was found.
-    counter4 = 0
-    while counter4 < len(data_field_names_not_found_in_metadata_field_label):
-        error_data_df[data_field_names_not_found_in_metadata_field_label[counter4]] = True
-        counter4 = counter4 + 1
-
-    # add values_for_error_df to the error_df
-    # error_data_df.columns = values_for_error_df
-
-    # a new data DataFrame that holds only the columns that matched the metadata_source
-    data_df_containing_only_matching_cols = return_data_df_containing_only_matching_cols(
-        target_data_df, matches_between_data_field_names_and_metadata_field_label_values)
-    # a new metadata_source DataFrame that holds only the columns that matched the data
-    metadata_df_containing_only_matched_rows = \
-        metadata_df.loc[metadata_df['field_label'].isin(
-            matches_between_data_field_names_and_metadata_field_label_values)]
-
-    # creates a list of all fields that are field type 'text' in the metadata_df
-    list_of_field_names_that_have_field_type_text_from_metadata_df = \
-        list(metadata_df_containing_only_matched_rows.loc
-             [metadata_df_containing_only_matched_rows['field_type'] == 'text', 'field_label'])
-
-    # creates a list of all fields that are field type 'checkbox' in the metadata_df
-    list_of_field_names_that_have_field_type_checkbox = list(
-        metadata_df_containing_only_matched_rows.loc[metadata_df_containing_only_matched_rows['field_type'] ==
-                                                     'checkbox', 'field_label'])
-
-    # Field Label error reporting
-
-    # dictionary containing reformatted_data_field_names that did not match the values_in_first_col_of_metadata_df
-    # and the position at which they are found in the target_data_df
+        data_field_names, list(data_dictionary.fields))
+
+    # dictionary containing data_field_names that did not match the field labels of the metadata
+    # and the position at which they are found in the data
     field_name_error_value_and_index = return_data_values_and_their_index_in_metadata_choices_or_data(
-        data_field_names_not_found_in_metadata_field_label, reformatted_data_field_names)
+        data_field_names_not_found_in_metadata_field_label, list(data_field_names))
 
     if field_name_error_value_and_index:
-        total_error_count.append(1)
         error_log.write("\n")
         error_log.write('Field Name Errors\n')
         error_log.write('-----------------\n')
         # error message for fields that did not match between the data fields and metadata_source values
         error_message(field_name_error_value_and_index, error_log)
         error_log.write("Was expecting one of these values: \n")
-        error_log.write(str(values_in_first_col_of_metadata_df))
+        error_log.write(str(data_dictionary.variable_names))
+    return bool(field_name_error_value_and_index)
+
+
+def write_value_errors_header(error_log):
+    """ Writes the heading of the value errors section to the error_log."""
 
     error_log.write("\n")
     error_log.write("\n")
@@ -549,248 +1947,724 @@ def main():
     error_log.write('---------------\n')
     error_log.write("These values are not options found in the metadata_source:\n")
 
-    # list of column names that have error values in them, used later to format
-    # new excel spreadsheet with pink colored errors
-    data_col_names_containing_errors = []
-
-    # iterates over the field name's in the data_df that matched the field label values of the metadata_df
-    for ix, current_data_field_name in enumerate(matches_between_data_field_names_and_metadata_field_label_values):
-
-        # validate format of field type 'text'
-        # Represents a list of items that are only 'text' field type in the metadata_df
-        # and checks to make sure that the list is not empty
-        if current_data_field_name in list_of_field_names_that_have_field_type_text_from_metadata_df:
-            # Creates a series to check if the the 'text validation' column in the metadata_df is empty
-            text_validation_values_series = \
-                metadata_df_containing_only_matched_rows.loc[
-                    metadata_df_containing_only_matched_rows['field_label'] ==
-                    current_data_field_name, 'text_validation_type_or_show_slider_number']
-            # if the check validation column is not empty, format validation is needed
-            if text_validation_values_series.any():
-                text_validation_values_that_are_not_nan_list = list(
-                    metadata_df_containing_only_matched_rows.loc[metadata_df_containing_only_matched_rows[
-                                                                     'field_label'] == current_data_field_name,
-                                                                 'text_validation_type_or_show_slider_number'])
-
-                # Checks valid format for date
-                if 'date' in text_validation_values_that_are_not_nan_list[0]:
-                    # list of all date values in a specified column
-                    date_data_values_list = list(
-                        data_df_containing_only_matching_cols[current_data_field_name])
-                    # list of date values in correct data format
-                    updated_date_format_values = date_validation(
-                        date_data_values_list, text_validation_values_that_are_not_nan_list[0])
-                    # list of Trues(error) and False(no error) based on errors found in date values
-                    date_error_values_for_error_df = text_validation_values_for_error_df(updated_date_format_values)
-                    # adds these True/False error values to the error_data_df
-                    error_data_df[current_data_field_name] = date_error_values_for_error_df
-                    # adds corrected data formats to target_data_df
-                    target_data_df[current_data_field_name] = updated_date_format_values
-
-                # checks and changes format to two decimal places
-                elif text_validation_values_that_are_not_nan_list[0] == 'number_2dp':
-                    # list of decimal point values in a specified column
-                    data_values_with_decimal_point_text_validation_required = list(
-                        data_df_containing_only_matching_cols[current_data_field_name])
-                    # if all values are of type int or float, then update their format
-                    if all(isinstance(x, (int, float)) for x in
-                           data_values_with_decimal_point_text_validation_required):
-                        updated_data_values_with_correct_decimal_point_format = decimal_point_validation(
-                            data_values_with_decimal_point_text_validation_required)
-                        # list of True(error) and False(no error) based on errors found within these values
-                        decimal_point_error_values_for_error_df = text_validation_values_for_error_df(
-                            updated_data_values_with_correct_decimal_point_format)
-                        # adds these True/False error values to the error_data_df
-                        error_data_df[current_data_field_name] = decimal_point_error_values_for_error_df
-                        # adds corrected data formats to target_data_df
-                        target_data_df[current_data_field_name] = updated_data_values_with_correct_decimal_point_format
-                    else:
-                        total_error_count.append(1)
-                        data_col_names_containing_errors.append(current_data_field_name)
-                        error_log.write("Error. Cannot convert column" + current_data_field_name +
-                                        "to two decimal places.\n")
-
-                # Validates if value is an integer
-                elif text_validation_values_that_are_not_nan_list[0] == 'integer':
-                    # list of values in a specified column
-                    data_values_with_int_text_validation_required = list(
-                        data_df_containing_only_matching_cols[current_data_field_name])
-                    # converted values to type int
-                    updated_data_values_as_integers = integer_validation(
-                        data_values_with_int_text_validation_required, current_data_field_name)
-                    integer_error_values_for_error_df = text_validation_values_for_error_df(
-                        updated_data_values_as_integers)
-                    error_data_df[current_data_field_name] = integer_error_values_for_error_df
-                    # add updated values to target_data_df
-                    target_data_df[current_data_field_name] = updated_data_values_as_integers
 
-                else:
-                    pass
-            # if there is no text validation required, there are no errors to report
-            elif not text_validation_values_series.any():
-                no_text_validation_required_values = data_df[current_data_field_name]
-                no_text_validation_error_values = no_text_validation_error_values_for_df(
-                    no_text_validation_required_values)
-                error_data_df[current_data_field_name] = no_text_validation_error_values
-        else:
-            # creates list of values found in the current_field_name column of the data_df
-            orig_data_values_from_current_field_name_col = list(
-                data_df_containing_only_matching_cols[current_data_field_name])
-
-            # the number of values found within each column
-            # number_of_values_in_each_col = len(orig_data_values_from_current_field_name_col)
-
-            # cleans data_values_from_current_field_name_col for comparison metadata_source choices
-            cleaned_data_values_from_current_field_name_col = return_cleaned_data_values(
-                orig_data_values_from_current_field_name_col)
-
-            # creates a DataFrame to check if cell is empty
-            metadata_df_to_check_for_null_choices = metadata_df.loc[metadata_df['field_label'] ==
-                                                                    current_data_field_name,
-                                                                    'choices_calculations_or_slider_labels']
-
-            # if cell is empty, metadata_source data comparison list becomes ['no', 'yes']
-            # if it is not empty, than the choices must be parsed and cleaned so that
-            # each item in the list is an individual choice
-            if metadata_df_to_check_for_null_choices.dropna().empty:
-                parsed_metadata_choices_list = ['no', 'yes']
-            else:
-                metadata_choices_for_one_row = list(metadata_df.loc[metadata_df['field_label'] ==
-                                                                    current_data_field_name,
-                                                                    'choices_calculations_or_slider_labels'])
-                parsed_metadata_choices_list = parse_metadata_choices(metadata_choices_for_one_row[0], '|')
-
-            # list of data values found in the metadata_df choices
-            # data_values_that_match_metadata_choices = return_matches_between_data_and_metadata(
-                # parsed_metadata_choices_list, cleaned_data_values_from_current_field_name_col)
-
-            # list of data values not found in the metadata_df choices
-            data_values_that_do_not_match_metadata_choices = return_difference_between_data_and_metadata(
-                cleaned_data_values_from_current_field_name_col, parsed_metadata_choices_list)
-
-            # checkbox
-            if current_data_field_name in list_of_field_names_that_have_field_type_checkbox:
-                # creates a list of column names that will be added to the target_df
-                col_names_for_new_checkbox_cols = return_checkbox_col_field_names(
-                    current_data_field_name, parsed_metadata_choices_list)
-
-                values_for_new_checkbox_cols = []
-                counter1 = 0
-                # loops through the parsed metadata choices
-                # and checks if that choice is an option in the data
-                while counter1 < len(parsed_metadata_choices_list):
-                    values_for_new_checkbox_cols.append(
-                        return_checkbox_col_values(parsed_metadata_choices_list[counter1],
-                                                   cleaned_data_values_from_current_field_name_col))
-                    counter1 = counter1 + 1
-
-                # check for errors
-                counter2 = 0
-                checkbox_values_that_do_not_match_metadata_choices = []
-                # loops through orig_data_values_from_current_field_name_col and parses
-                # these values so they can be compared to the parsed_metadata_choices_list
-                while counter2 < len(orig_data_values_from_current_field_name_col):
-                    parsed_checkbox_data_values = parse_checkbox_data_values(
-                        orig_data_values_from_current_field_name_col[counter2], '|')
-                    checkbox_values_one_row_non_matches = return_difference_between_data_and_metadata(
-                        parsed_checkbox_data_values, parsed_metadata_choices_list)
-                    if checkbox_values_one_row_non_matches:
-                        checkbox_values_that_do_not_match_metadata_choices.append(checkbox_values_one_row_non_matches)
-                    counter2 = counter2 + 1
-
-                if checkbox_values_that_do_not_match_metadata_choices:
+def convert_csv_in_chunks(data_source, data_dictionary, output_path, error_output_path, error_log,
+                          chunksize=DEFAULT_CHUNKSIZE, workers=None, error_record_writer=None, profiler=None,
+                          executor='thread'):
+    """ Converts a csv data_source chunksize rows at a time, so memory use stays bounded no matter
+        how large the file is. Each converted chunk is appended to output_path, and every row that
+        contains an error is appended to error_output_path along with its position in the file and
+        the field names that had errors. error_output_path is only written when there are rows
+        containing errors, and one left by an earlier conversion is removed.
+
+        The converted rows are written to a '.partial' file that only replaces output_path once the
+        whole file has been converted without errors, so like main(), no csv file is output when
+        there are errors. workers and executor are passed on to transform_data_df, and when they
+        ask for a new pool of workers, it is made once and used for every chunk. When
+        error_record_writer is given, the error records of every chunk are added to it. When a
+        profiler is given, each chunk is recorded in it as a stage. Returns True when the file was
+        converted without errors."""
+
+    partial_output_path = output_path + '.partial'
+    total_error_count = []
+    reformatted_data_field_names = None
+    error_rows_written = False
+    if os.path.exists(error_output_path):
+        os.remove(error_output_path)
+
+    with contextlib.ExitStack() as pools:
+        # a new pool of workers is made once, and used for every chunk
+        if not isinstance(executor, concurrent.futures.Executor):
+            worker_pool = return_worker_pool(workers, executor)
+            if worker_pool is not None:
+                executor = pools.enter_context(worker_pool)
+
+        for chunk_number, data_df in enumerate(pd.read_csv(data_source, chunksize=chunksize)):
+            chunk_start = time.perf_counter()
+            first_chunk = reformatted_data_field_names is None
+            if first_chunk:
+                # checks data_field_names and changes to proper format, once for the whole file
+                reformatted_data_field_names = return_list_of_properly_formatted_field_names(
+                    list(data_df.columns))
+                if write_field_name_errors(reformatted_data_field_names, data_dictionary, error_log):
                     total_error_count.append(1)
-                    data_col_names_containing_errors.append(current_data_field_name)
-                    # flattens list of lists
-                    checkbox_values_that_do_not_match_metadata_choices = [
-                        val for sublist in checkbox_values_that_do_not_match_metadata_choices for val in sublist]
-                    checkbox_error_values_and_index_dict = return_checkbox_error_value_and_position_in_data(
-                        checkbox_values_that_do_not_match_metadata_choices,
-                        cleaned_data_values_from_current_field_name_col, orig_data_values_from_current_field_name_col)
-                    checkbox_error_index_list = list(checkbox_error_values_and_index_dict.values())
-                    checkbox_error_index_list = [x - 1 for x in checkbox_error_index_list]
-                    checkbox_error_values_for_error_df = checkbox_values_for_error_df(
-                        checkbox_error_index_list, cleaned_data_values_from_current_field_name_col)
-                    error_data_df[current_data_field_name] = checkbox_error_values_for_error_df
-                    error_log.write(current_data_field_name + ": " + str(checkbox_error_values_and_index_dict))
-                else:
-                    # updates target_data_df with the new checkbox columns
-                    update_data_df_with_checkbox_cols(
-                        target_data_df, col_names_for_new_checkbox_cols, values_for_new_checkbox_cols)
-                    # drops the current_data_field_name column in the new DataFrame
-                    target_data_df = target_data_df.drop(current_data_field_name, 1)
-            else:
-                list_of_data_values_that_only_contain_matches_with_metadata_choices = \
-                    return_values_that_match_metadata_choices(
-                        data_values_that_do_not_match_metadata_choices,
-                        cleaned_data_values_from_current_field_name_col)
+                if error_record_writer is not None:
+                    error_record_writer.write(
+                        return_field_name_error_records(reformatted_data_field_names, data_dictionary))
+                write_value_errors_header(error_log)
+            data_df.columns = reformatted_data_field_names
+
+            target_data_df, error_data_df, chunk_error_count, error_records = transform_data_df(
+                data_df, data_dictionary, error_log, first_position=data_df.index[0] + 1, workers=workers,
+                executor=executor, profiler=profiler)
+            total_error_count.extend(chunk_error_count)
+            if error_record_writer is not None:
+                error_record_writer.write(error_records)
+
+            # once an error has been found the converted csv file will not be output, so stop writing it
+            if not total_error_count:
+                target_data_df.to_csv(partial_output_path, mode='w' if first_chunk else 'a',
+                                      header=first_chunk, index=False)
+
+            # rows containing errors, with the names of the fields where the errors were found
+            error_data_df = error_data_df.fillna(False).astype(bool)
+            rows_containing_errors = error_data_df.any(axis=1)
+            error_rows_df = data_df[rows_containing_errors].copy()
+            error_rows_df.insert(0, 'row', error_rows_df.index + 1)
+            error_rows_df['error_fields'] = [
+                '|'.join(error_data_df.columns[flags]) for flags in error_data_df[rows_containing_errors].values]
+            if len(error_rows_df):
+                error_rows_df.to_csv(error_output_path, mode='a' if error_rows_written else 'w',
+                                     header=not error_rows_written, index=False)
+                error_rows_written = True
+
+            if profiler is not None:
+                profiler.add_record('chunk ' + str(chunk_number + 1), time.perf_counter() - chunk_start,
+                                    len(data_df))
 
-                # if there are mismatches, then an error message is needed
-                if data_values_that_do_not_match_metadata_choices:
-                    total_error_count.append(1)
-                    data_col_names_containing_errors.append(current_data_field_name)
-                    data_error_values_and_index_dict = return_error_value_and_position_in_data(
-                        data_values_that_do_not_match_metadata_choices, cleaned_data_values_from_current_field_name_col,
-                        orig_data_values_from_current_field_name_col)
-                    other_error_index_list = list(data_error_values_and_index_dict.values())
-                    other_error_index_list = [x - 1 for x in other_error_index_list]
-                    other_error_values_for_error_df = checkbox_values_for_error_df(
-                        other_error_index_list, cleaned_data_values_from_current_field_name_col)
-                    error_data_df[current_data_field_name] = other_error_values_for_error_df
-                    error_log.write(current_data_field_name + ": " + str(data_error_values_and_index_dict) + "\n")
-                elif not data_values_that_do_not_match_metadata_choices:
-                    error_data_df[current_data_field_name] = False
-                else:
-                    # indexing
-                    # dictionary containing the matched data values and their index from the metadata_source
-                    matched_data_values_and_position_in_metadata_choices_dict = \
-                        return_data_values_and_their_index_in_metadata_choices_or_data(
-                            list_of_data_values_that_only_contain_matches_with_metadata_choices,
-                            parsed_metadata_choices_list)
-                    # replace list of values with the indexes from the metadata_source list
-                    data_values_index_in_metadata_choices = return_index_of_data_values_in_metadata(
-                        cleaned_data_values_from_current_field_name_col,
-                        matched_data_values_and_position_in_metadata_choices_dict)
-                    # update data DataFrame column values
-                    target_data_df[current_data_field_name] = data_values_index_in_metadata_choices
-
-    # if there are errors throughout the file, return an Excel file containing the
-    # original data with error cells colored pink and a text file that explains the
-    # the errors found
     if total_error_count:
+        if os.path.exists(partial_output_path):
+            os.remove(partial_output_path)
+    elif os.path.exists(partial_output_path):
+        os.replace(partial_output_path, output_path)
+    return not total_error_count
+
+
+def return_row_keys(data_df, record_id_field=None):
+    """ Returns an Index with a unique key for every row of data_df, made from the row's value in
+        the record_id_field column (the first column when record_id_field is None) and the number
+        of earlier rows with the same record id, so that repeated events of one record each get
+        their own key. record_id_field may be given as it appears in the file's header. Raises
+        ValueError when it is not a column of data_df."""
+
+    if record_id_field is None:
+        record_id_field = data_df.columns[0]
+    else:
+        record_id_field = return_list_of_properly_formatted_field_names([record_id_field])[0]
+        if record_id_field not in data_df.columns:
+            raise ValueError("The record id column " + record_id_field + " is not in the data")
+    record_ids = data_df[record_id_field].astype(str)
+    occurrences = record_ids.groupby(record_ids, sort=False).cumcount().astype(str)
+    return pd.Index((record_ids + '#' + occurrences).values)
+
+
+def return_data_dictionary_fingerprint(data_dictionary):
+    """ Returns a hash of the compiled data_dictionary, which changes whenever a field changes."""
+
+    fields = [tuple(field) for field in data_dictionary.fields.values()]
+    return hashlib.sha256(pickle.dumps((INCREMENTAL_STATE_VERSION, fields), protocol=4)).hexdigest()
+
 
-        # Create a Pandas Excel writer using XlsxWriter as the engine.
-        writer = pd.ExcelWriter('redcap_excel_errors.xlsx', engine='xlsxwriter')
+def load_incremental_state(state_path):
+    """ Returns the state saved by a previous incremental run, or None when there is none."""
 
-        # Convert data_df to an XlsxWriter Object
-        data_df.to_excel(writer, sheet_name='Sheet1', index=False)
+    if not os.path.exists(state_path):
+        return None
+    try:
+        state = pd.read_pickle(state_path)
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != INCREMENTAL_STATE_VERSION:
+        return None
+    return state
 
-        # Get the xlsxwriter objects from the DataFrame writer object
-        data_workbook = writer.book
-        data_worksheet = writer.sheets['Sheet1']
 
-        formats = data_workbook.add_format()
-        formats.set_bg_color('#FF00FF')
+def save_incremental_state(state_path, state):
+    """ Saves the state of an incremental run to state_path, writing it to a temporary name first
+        so a half written state is never read."""
 
-        error_cols = list(error_data_df.columns)
-        for index, row in error_data_df.iterrows():
-            if row.any():
-                for j, col in enumerate(error_cols):
-                    if error_data_df.iloc[index][col]:
-                        if not isnan(data_df.iloc[index][col]):
-                            target_string = data_df.iloc[index][col]
-                        else:
-                            target_string = 'NaN'
-                        data_worksheet.write(index+1, j, target_string, formats)
+    temporary_state_path = state_path + '.' + str(os.getpid()) + '.tmp'
+    pd.to_pickle(state, temporary_state_path)
+    os.replace(temporary_state_path, state_path)
 
-        # Close the Pandas Excel writer and output the Excel file
-        writer.save()
+
+def transform_data_df_incrementally(data_df, data_dictionary, error_log, state_path, record_id_field=None,
+                                    workers=None, profiler=None, executor='thread'):
+    """ Converts data_df like transform_data_df, but only the rows that are new or have changed
+        since the run that saved the state at state_path. Each row is keyed by its record id and
+        hashed. Rows whose hash matches the previous run are taken from the converted output saved
+        then, and only the rest are converted. Everything is converted when there is no saved
+        state, or it was saved with different data field names or a different data dictionary.
+
+        Returns the same values as transform_data_df, followed by the new state. The caller
+        saves the state with save_incremental_state once the whole file converted without errors."""
+
+    row_keys = return_row_keys(data_df, record_id_field)
+    row_hashes = pd.Series(pd.util.hash_pandas_object(data_df, index=False).values, index=row_keys)
+    data_dictionary_fingerprint = return_data_dictionary_fingerprint(data_dictionary)
+
+    state = load_incremental_state(state_path)
+    if (state is None or state['data_field_names'] != list(data_df.columns) or
+            state['data_dictionary_fingerprint'] != data_dictionary_fingerprint):
+        changed_rows = np.ones(len(data_df), dtype=bool)
     else:
-        # create new csv file from the updated data DataFrame containing the data transformations
-        target_data_df.to_csv('G:\My Documents\Python Scripts\\new_test_patient1.csv', index=False)
+        previous_row_hashes = row_hashes.index.map(state['row_hashes'])
+        changed_rows = ~(previous_row_hashes.notna() & (previous_row_hashes.values == row_hashes.values))
+        changed_rows = np.asarray(changed_rows, dtype=bool)
+
+    error_log.write(str(int(changed_rows.sum())) + " of " + str(len(data_df)) +
+                    " rows are new or changed since the last run.\n")
+
+    # converts only the new and changed rows
+    changed_positions = np.flatnonzero(changed_rows)
+    target_data_df, changed_error_data_df, total_error_count, error_records = transform_data_df(
+        data_df.iloc[changed_positions], data_dictionary, error_log, workers=workers, executor=executor,
+        profiler=profiler, row_positions=changed_positions + 1)
+    error_data_df = changed_error_data_df.reindex(data_df.index)
+    error_data_df = error_data_df.astype(object).where(error_data_df.notna(), False)
+
+    if not total_error_count:
+        # the converted rows of the previous run for every row that has not changed
+        target_data_df.index = row_keys[changed_positions]
+        if not len(changed_positions):
+            target_data_df = state['converted_df']
+        elif len(changed_positions) < len(data_df):
+            target_data_df = pd.concat([state['converted_df'], target_data_df])
+            target_data_df = target_data_df[~target_data_df.index.duplicated(keep='last')]
+        target_data_df = target_data_df.loc[row_keys]
+        state = {
+            'version': INCREMENTAL_STATE_VERSION,
+            'data_field_names': list(data_df.columns),
+            'data_dictionary_fingerprint': data_dictionary_fingerprint,
+            'row_hashes': row_hashes,
+            'converted_df': target_data_df,
+        }
+        target_data_df = target_data_df.reset_index(drop=True)
+
+    return target_data_df, error_data_df, total_error_count, error_records, state
+
+
+def return_excel_engine(data_source):
+    """ Returns the engine pandas reads data_source with. The calamine engine is used for any excel
+        file when python-calamine is installed, because it is much faster than the others.
+        Otherwise .xlsx files are read by openpyxl, which pandas opens read-only so that rows are
+        streamed instead of loaded into a workbook, and .xls files by pandas' default reader."""
+
+    # only checks that python-calamine is installed, leaving pandas to import it
+    if importlib.util.find_spec('python_calamine') is not None:
+        return 'calamine'
+    if data_source.endswith('.xlsx'):
+        return 'openpyxl'
+    return None
+
+
+def return_column_selector(field_names, data_field_names):
+    """ Returns a function for the usecols argument of pandas' readers. It keeps the columns whose
+        properly formatted name is in field_names, and appends every column name it is asked about
+        to data_field_names, so that the whole header is known without reading the other columns."""
+
+    def select_column(data_field_name):
+        data_field_names.append(data_field_name)
+        return return_list_of_properly_formatted_field_names([data_field_name])[0] in field_names
+
+    return select_column
+
+
+def return_excel_cache_paths(data_source, sheet_name, cache_dir):
+    """ Returns the paths of the Parquet and pickle copies of the sheet_name sheet of data_source
+        in cache_dir. The file names are a hash of the excel file's contents, the sheet, and
+        EXCEL_CACHE_VERSION."""
+
+    file_hash = return_file_hash(data_source, (sheet_name, EXCEL_CACHE_VERSION))
+    cache_path = os.path.join(cache_dir, file_hash)
+    return cache_path + '.parquet', cache_path + '.pickle'
+
+
+def save_excel_cache(data_df, data_source, sheet_name, cache_dir):
+    """ Saves a copy of the data_df read from the sheet_name sheet of data_source in cache_dir. The
+        copy is a Parquet file, or a pickle when pyarrow is not installed or can not store the
+        sheet, for example when a column mixes numbers and text. Each file is written to a
+        temporary name first, so a half written copy is never read."""
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    parquet_path, pickle_path = return_excel_cache_paths(data_source, sheet_name, cache_dir)
+    temporary_parquet_path = parquet_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        data_df.to_parquet(temporary_parquet_path, index=False)
+        os.replace(temporary_parquet_path, parquet_path)
+        return
+    except (ImportError, ValueError, TypeError):
+        if os.path.exists(temporary_parquet_path):
+            os.remove(temporary_parquet_path)
+    temporary_pickle_path = pickle_path + '.' + str(os.getpid()) + '.tmp'
+    data_df.to_pickle(temporary_pickle_path)
+    os.replace(temporary_pickle_path, pickle_path)
+
+
+def load_excel_cache(data_source, sheet_name, cache_dir, field_names=None):
+    """ Returns the copy of the sheet_name sheet of data_source saved in cache_dir, or None when
+        there is none. When field_names is given, only the columns whose properly formatted name
+        is in field_names are read, and the whole header is kept in attrs['data_field_names']."""
+
+    parquet_path, pickle_path = return_excel_cache_paths(data_source, sheet_name, cache_dir)
+    if os.path.exists(parquet_path):
+        try:
+            import pyarrow.parquet
+            data_field_names = pyarrow.parquet.read_schema(parquet_path).names
+            columns = None
+            if field_names is not None:
+                columns = [name for name in data_field_names
+                           if return_list_of_properly_formatted_field_names([name])[0] in field_names]
+            data_df = pd.read_parquet(parquet_path, columns=columns)
+        except (ImportError, ValueError, IOError):
+            return None
+    elif os.path.exists(pickle_path):
+        try:
+            data_df = pd.read_pickle(pickle_path)
+        except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        data_field_names = list(data_df.columns)
+        if field_names is not None:
+            data_df = data_df[[name for name in data_field_names
+                               if return_list_of_properly_formatted_field_names([name])[0] in field_names]]
+    else:
+        return None
+    if field_names is not None:
+        data_df.attrs['data_field_names'] = data_field_names
+    return data_df
+
+
+def read_data_file(data_source, sheet_name=None, field_names=None, cache_dir=None):
+    """ Returns a DataFrame from a csv or excel file. When an excel file has more than one sheet,
+        sheet_name must say which sheet to read.
 
-    error_log.close()
+        When field_names is given, only the columns whose properly formatted name is in
+        field_names are read, and the whole header of the file is kept in the DataFrame's
+        attrs['data_field_names'], so that the columns that were not read can still be reported.
+
+        When cache_dir is given, the sheet read from an excel file is saved there as a Parquet
+        file, keyed by a hash of the file's contents, and later calls read that copy instead of
+        parsing the workbook again."""
+
+    data_field_names = []
+    usecols = None
+    if field_names is not None:
+        usecols = return_column_selector(field_names, data_field_names)
+
+    # Checks whether the data_source is a csv file or an excel file
+    if data_source.endswith('.csv'):
+        # Creates DataFrame from the data_source csv file
+        data_df = pd.read_csv(data_source, usecols=usecols)
+    elif data_source.endswith('.xlsx') or data_source.endswith('.xls'):
+        if cache_dir is not None:
+            data_df = load_excel_cache(data_source, sheet_name, cache_dir, field_names)
+            if data_df is not None:
+                return data_df
+        # Creates DataFrame from the data_source excel file, which is only opened once
+        data_source_excel = pd.ExcelFile(data_source, engine=return_excel_engine(data_source))
+        # the copy is saved under the sheet_name it is looked up by, which may be None
+        cached_sheet_name = sheet_name
+        if sheet_name is None:
+            if len(data_source_excel.sheet_names) > 1:
+                raise ValueError("There are multiple excel sheets within " + data_source +
+                                 ". Please specify a sheet name: " + str(data_source_excel.sheet_names))
+            sheet_name = data_source_excel.sheet_names[0]
+        if cache_dir is None:
+            data_df = data_source_excel.parse(sheet_name, usecols=usecols)
+        else:
+            # the whole sheet is cached, so that the copy can be used with any field_names
+            data_df = data_source_excel.parse(sheet_name)
+            save_excel_cache(data_df, data_source, cached_sheet_name, cache_dir)
+            if usecols is not None:
+                data_df = data_df[[name for name in data_df.columns if usecols(name)]]
+    else:
+        raise ValueError("Incorrect file type. Only .csv, .xls, and .xlsx are supported.")
+
+    if field_names is not None:
+        data_df.attrs['data_field_names'] = data_field_names
+    return data_df
+
+
+class RedcapConverter(object):
+    """ Converts DataFrames of data into the format REDCap expects, with a data dictionary that is
+        compiled once when the converter is made. Nothing is read from or written to disk by
+        convert(), so one converter can be kept for the life of a process and used for every
+        DataFrame it is given, from any number of threads.
+
+        data_dictionary is a compiled DataDictionary, or the DataFrame of a data dictionary.
+        workers and executor are passed on to transform_data_df for every conversion. When they
+        ask for a pool of workers, it is made once with the converter and used for every
+        conversion, until close() is called. The converter can also be used as a context manager
+        that closes it."""
+
+    def __init__(self, data_dictionary, workers=None, executor='thread'):
+        if not isinstance(data_dictionary, DataDictionary):
+            data_dictionary = DataDictionary(data_dictionary)
+        self.data_dictionary = data_dictionary
+        self.workers = workers
+        # the pool of workers this converter made, which it shuts down when it is closed
+        self.worker_pool = None
+        if not isinstance(executor, concurrent.futures.Executor):
+            self.worker_pool = return_worker_pool(workers, executor)
+            if self.worker_pool is not None:
+                executor = self.worker_pool
+        self.executor = executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Shuts down the pool of workers the converter made, if it made one."""
+
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+
+    @classmethod
+    def from_file(cls, metadata_source, sheet_name=None, cache_dir=None, workers=None, executor='thread'):
+        """ Returns a RedcapConverter for the data dictionary in a csv or excel metadata file. See
+            DataDictionary.from_file."""
+
+        return cls(DataDictionary.from_file(metadata_source, sheet_name, cache_dir=cache_dir),
+                   workers=workers, executor=executor)
+
+    def convert(self, data_df, error_log=None, first_position=1):
+        """ Converts data_df, which is not changed. Returns the converted_df, an error_mask of the
+            same shape as data_df that is True for every cell with an error, including every cell
+            of a column that does not match a field of the data dictionary, and a structured array
+            of ERROR_RECORD_DTYPE with a record for every error. A column with errors is left
+            unconverted in the converted_df, except for missing values in text fields, which are
+            recorded as errors but do not stop the field from being converted.
+
+            The error log that convert_file writes for the value errors is written to error_log
+            when it is given. first_position is the position reported for the first row of data_df."""
+
+        # checks data_field_names and changes to proper format, on a copy of the column index only
+        data_df = data_df.set_axis(
+            return_list_of_properly_formatted_field_names([str(name) for name in data_df.columns]), axis=1)
+        converted_df, error_data_df, total_error_count, error_records = transform_data_df(
+            data_df, self.data_dictionary, io.StringIO() if error_log is None else error_log,
+            first_position=first_position, workers=self.workers, executor=self.executor)
+        error_mask = error_data_df.astype(object).where(error_data_df.notna(), False).astype(bool)
+        error_records = np.concatenate(
+            [return_field_name_error_records(list(data_df.columns), self.data_dictionary), error_records])
+        return converted_df, error_mask, error_records
+
+
+def convert_file(data_source, data_dictionary, output_path, sheet_name=None,
+                 error_log_path='redcap_error_log.txt', error_workbook_path='redcap_excel_errors.xlsx',
+                 error_csv_path='redcap_errors.csv', chunksize=None, workers=None, metadata_source='',
+                 error_records_path=None, state_path=None, record_id_field=None, prune_columns=False,
+                 excel_cache_dir=None, profiler=None, profile_top_fields=PROFILE_TOP_FIELDS, executor='thread'):
+    """ Converts one data file with an already compiled data_dictionary. When there are no errors,
+        the converted data is written to output_path. When there are errors, an excel file that is
+        a duplicate of the original data with the error cells colored pink is written to
+        error_workbook_path instead, or, when a csv data_source is streamed in chunks of chunksize
+        rows, the rows containing errors are written to error_csv_path. The errors are summarized
+        in the text file at error_log_path. When error_records_path is given, a record of every
+        erroneous cell is written there as a csv or Parquet file by an ErrorRecordWriter.
+
+        When state_path is given, only the rows that are new or changed since the last run with the
+        same state_path are converted, and the rest are taken from the output of that run. Rows are
+        matched by their value in the record_id_field column, the first column by default. This
+        can not be combined with chunksize.
+
+        When prune_columns is True, columns that do not match a field of the data_dictionary are
+        not read at all. They are still reported as field name errors, but are left out of the
+        excel file of errors. When excel_cache_dir is given, the sheet read from an excel file is
+        cached there as a Parquet file, so that converting the same file again skips the workbook.
+
+        When a profiler is given, each stage of the conversion and each field is recorded in it,
+        and the stages and the profile_top_fields slowest fields are written to the error log.
+
+        workers and executor are passed on to transform_data_df, so a pool of workers kept by the
+        caller can be used for many files.
+
+        Returns True when the file was converted without errors."""
+
+    if state_path and chunksize:
+        raise ValueError("Incremental conversion can not be combined with converting in chunks.")
+
+    error_record_writer = None
+    if error_records_path:
+        error_record_writer = ErrorRecordWriter(error_records_path)
+
+    try:
+        with open(error_log_path, "w+") as error_log:
+            # captures current data and time
+            now = datetime.datetime.now()
+            # writes now, and the files used to the error log
+            error_log.write(str(now) + "\n")
+            error_log.write("Data dictionary file used: " + metadata_source + "\n")
+            error_log.write("Data file used: " + data_source + "\n")
+
+            # streams the data_source through in chunks and writes rows with errors to a csv file
+            if chunksize and data_source.endswith('.csv'):
+                converted = convert_csv_in_chunks(data_source, data_dictionary, output_path, error_csv_path,
+                                                  error_log, chunksize=chunksize, workers=workers,
+                                                  error_record_writer=error_record_writer, profiler=profiler,
+                                                  executor=executor)
+                if profiler is not None:
+                    profiler.write_log(error_log, profile_top_fields)
+                return converted
+
+            with return_stage(profiler, 'read data file'):
+                field_names = data_dictionary.fields if prune_columns else None
+                data_df = read_data_file(data_source, sheet_name, field_names=field_names,
+                                         cache_dir=excel_cache_dir)
+
+            with return_stage(profiler, 'normalize header', len(data_df)):
+                # checks data_field_names and changes to proper format
+                data_df.columns = return_list_of_properly_formatted_field_names(list(data_df.columns))
+                # the whole header, including the columns that were not read
+                reformatted_data_field_names = return_list_of_properly_formatted_field_names(
+                    data_df.attrs.get('data_field_names', list(data_df.columns)))
+
+            # *** adds 1 to a list every time an error is experienced.
+            total_error_count = []
+
+            # Field Label error reporting
+            if write_field_name_errors(reformatted_data_field_names, data_dictionary, error_log):
+                total_error_count.append(1)
+
+            write_value_errors_header(error_log)
+
+            # converts every column that matched the metadata
+            with return_stage(profiler, 'transform', len(data_df)):
+                if state_path:
+                    target_data_df, error_data_df, value_error_count, error_records, state = \
+                        transform_data_df_incrementally(data_df, data_dictionary, error_log, state_path,
+                                                        record_id_field=record_id_field, workers=workers,
+                                                        profiler=profiler, executor=executor)
+                else:
+                    target_data_df, error_data_df, value_error_count, error_records = transform_data_df(
+                        data_df, data_dictionary, error_log, workers=workers, executor=executor,
+                        profiler=profiler)
+            total_error_count.extend(value_error_count)
+
+            # a record of every erroneous field name and cell
+            if error_record_writer is not None:
+                with return_stage(profiler, 'write error records', len(error_records)):
+                    error_record_writer.write(
+                        return_field_name_error_records(reformatted_data_field_names, data_dictionary))
+                    error_record_writer.write(error_records)
+
+            # if there are errors throughout the file, return an Excel file containing the
+            # original data with error cells colored pink and a text file that explains the
+            # the errors found
+            if total_error_count:
+                # writes the original data with the error cells colored pink
+                with return_stage(profiler, 'write error workbook', len(data_df)):
+                    write_error_workbook(data_df, error_data_df, error_workbook_path)
+            else:
+                # create new csv file from the updated data DataFrame containing the data transformations
+                with return_stage(profiler, 'write csv', len(target_data_df)):
+                    target_data_df.to_csv(output_path, index=False)
+                # remembers the rows of this run for the next incremental run
+                if state_path:
+                    with return_stage(profiler, 'save state', len(target_data_df)):
+                        save_incremental_state(state_path, state)
+
+            if profiler is not None:
+                profiler.write_log(error_log, profile_top_fields)
+    finally:
+        if error_record_writer is not None:
+            error_record_writer.close()
+    return not total_error_count
+
+
+def read_manifest(manifest_path):
+    """ Returns a list of (data_source, output_path, sheet_name) tuples read from a manifest file.
+        Each line of the manifest is a data file, optionally followed by a comma and the path of
+        its converted csv file, and another comma and the excel sheet to read. Blank lines and
+        lines starting with '#' are skipped. Missing output paths and sheet names are None."""
+
+    manifest_entries = []
+    with open(manifest_path, newline='') as manifest:
+        for row in csv.reader(manifest):
+            row = [item.strip() for item in row]
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            row = row + [''] * (3 - len(row))
+            manifest_entries.append((row[0], row[1] or None, row[2] or None))
+    return manifest_entries
+
+
+def return_output_paths(data_source, output_dir=None, error_records_extension='.csv'):
+    """ Returns a dictionary of the paths the converted csv file and the error files of data_source
+        are written to in a batch, named after data_source and placed in output_dir, or next to
+        data_source when output_dir is None. error_records_extension is the extension of the
+        structured error report, '.csv' or '.parquet'."""
+
+    file_name = os.path.splitext(os.path.basename(data_source))[0]
+    if output_dir is None:
+        output_dir = os.path.dirname(data_source)
+    return {
+        'output_path': os.path.join(output_dir, file_name + '_redcap.csv'),
+        'error_log_path': os.path.join(output_dir, file_name + '_error_log.txt'),
+        'error_workbook_path': os.path.join(output_dir, file_name + '_excel_errors.xlsx'),
+        'error_csv_path': os.path.join(output_dir, file_name + '_errors.csv'),
+        'error_records_path': os.path.join(output_dir, file_name + '_error_records' + error_records_extension),
+    }
+
+
+def return_output_path_collisions(jobs):
+    """ Returns a list of (path, data source, other data source) for every path that more than one
+        of the (data source, sheet name, output paths) jobs would write, such as good.csv and
+        good.xlsx in the same output directory, or site1/upload.csv and site2/upload.csv. Paths are
+        compared once they are made absolute."""
+
+    collisions = []
+    # absolute path -> the data source that writes it
+    written_paths = {}
+    for data_source, sheet_name, output_paths in jobs:
+        for path in output_paths.values():
+            if path is None:
+                continue
+            absolute_path = os.path.normcase(os.path.abspath(path))
+            if absolute_path in written_paths:
+                collisions.append((path, written_paths[absolute_path], data_source))
+            else:
+                written_paths[absolute_path] = data_source
+    return collisions
+
+
+def return_argument_parser():
+    """ Returns the argparse parser for the command-line interface."""
+
+    parser = argparse.ArgumentParser(
+        prog='redcap_convert',
+        description="Converts a csv or excel data file into a csv file that is ready to be uploaded "
+                    "into REDCap, using a REDCap data dictionary. When there are errors, an excel "
+                    "file with the error cells colored pink and an error log are written instead.")
+    parser.add_argument('data', nargs='?', help="csv, xls or xlsx data file to convert")
+    parser.add_argument('metadata', help="csv, xls or xlsx REDCap data dictionary")
+    parser.add_argument('-o', '--output', help="path of the converted csv file "
+                                               "(default: the data file's name + '_redcap.csv')")
+    parser.add_argument('--sheet', help="sheet of an excel data file to read")
+    parser.add_argument('--metadata-sheet', help="sheet of an excel data dictionary to read")
+    parser.add_argument('--manifest', help="file listing many data files to convert against the same data "
+                                           "dictionary, one per line as: data[,output[,sheet]]")
+    parser.add_argument('--output-dir', help="directory for the output and error files of a --manifest batch "
+                                             "(default: next to each data file)")
+    parser.add_argument('--error-log', default='redcap_error_log.txt', help="path of the error log")
+    parser.add_argument('--error-workbook', default='redcap_excel_errors.xlsx',
+                        help="path of the excel file with the error cells colored pink")
+    parser.add_argument('--error-csv', default='redcap_errors.csv',
+                        help="path of the csv file of rows with errors when --chunksize is used")
+    parser.add_argument('--dictionary-cache', help="directory where compiled data dictionaries are cached, "
+                                                   "keyed by a hash of the data dictionary file")
+    parser.add_argument('--error-records', help="path of a structured report with a record for every error, "
+                                                "written as Parquet when it ends in '.parquet' and csv otherwise. "
+                                                "In a --manifest batch, its extension is used for every file")
+    parser.add_argument('--state', help="file where the rows of each run are remembered, so that the next run "
+                                        "only converts rows that are new or changed")
+    parser.add_argument('--record-id', help="field name that identifies each record for --state "
+                                            "(default: the first column)")
+    parser.add_argument('--only-dictionary-columns', action='store_true',
+                        help="only read the columns that match the data dictionary. The others are still "
+                             "reported, but are left out of the excel file of errors")
+    parser.add_argument('--excel-cache', help="directory where excel sheets are cached as Parquet files, "
+                                              "keyed by a hash of the excel file")
+    parser.add_argument('--profile', help="path of a JSON file with the time, rows and memory of each stage "
+                                          "and field. The stages and slowest fields are also written to the error log")
+    parser.add_argument('--profile-top', type=int, default=PROFILE_TOP_FIELDS,
+                        help="number of the slowest fields listed by --profile (default: " +
+                             str(PROFILE_TOP_FIELDS) + ")")
+    parser.add_argument('--chunksize', type=int, help="stream a csv data file through in chunks of this many rows")
+    parser.add_argument('--workers', type=int, help="number of workers that convert columns in parallel")
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread',
+                        help="run the workers as threads, or as processes, which only pay off for columns "
+                             "with many distinct dates or text values to validate (default: thread)")
+    return parser
+
+
+def main(argv=None):
+    """ Command-line entry point. Compiles the data dictionary once, then converts either the one
+        data file given, or every data file listed in a --manifest. Returns 0 when every file was
+        converted without errors, and 1 otherwise."""
+
+    parser = return_argument_parser()
+    # options may come between the data file and the data dictionary
+    args = parser.parse_intermixed_args(argv)
+    if (args.data is None) == (args.manifest is None):
+        parser.error("give either a data file or a --manifest")
+
+    profile = None
+    dictionary_profiler = None
+    if args.profile:
+        profile = {'data_dictionary': None, 'files': []}
+        dictionary_profiler = Profiler()
+
+    try:
+        # compiles the metadata into a hash index of field label -> field properties, once for every file
+        with return_stage(dictionary_profiler, 'compile data dictionary'):
+            data_dictionary = DataDictionary.from_file(args.metadata, args.metadata_sheet,
+                                                       cache_dir=args.dictionary_cache)
+    except ValueError as error:
+        parser.error(str(error))
+    if dictionary_profiler is not None:
+        profile['data_dictionary'] = dictionary_profiler.to_dict(args.profile_top)
+        dictionary_profiler.close()
+
+    if args.manifest is None:
+        output_paths = {
+            'output_path': args.output or return_output_paths(args.data)['output_path'],
+            'error_log_path': args.error_log,
+            'error_workbook_path': args.error_workbook,
+            'error_csv_path': args.error_csv,
+            'error_records_path': args.error_records,
+            'state_path': args.state,
+        }
+        jobs = [(args.data, args.sheet, output_paths)]
+    else:
+        if args.output_dir and not os.path.isdir(args.output_dir):
+            os.makedirs(args.output_dir)
+        jobs = []
+        for data_source, output_path, sheet_name in read_manifest(args.manifest):
+            output_paths = return_output_paths(data_source, args.output_dir)
+            output_paths['error_records_path'] = None
+            output_paths['state_path'] = None
+            if args.state:
+                output_paths['state_path'] = os.path.splitext(output_paths['output_path'])[0] + '.state'
+            if args.error_records:
+                output_paths['error_records_path'] = return_output_paths(
+                    data_source, args.output_dir, os.path.splitext(args.error_records)[1])['error_records_path']
+            if output_path:
+                output_paths['output_path'] = output_path
+            jobs.append((data_source, sheet_name or args.sheet, output_paths))
+
+    # files that would write over each other's output are refused before any is converted
+    collisions = return_output_path_collisions(jobs)
+    if collisions:
+        parser.error("\n".join(data_source + " and " + other_data_source + " would both write " + path
+                                for path, data_source, other_data_source in collisions) +
+                     "\nconvert them in batches with different --output-dir directories")
+
+    files_with_errors = 0
+    # one pool of workers converts the columns of every file, when --workers asks for one
+    with return_worker_pool(args.workers, args.executor) or contextlib.nullcontext(args.executor) as executor:
+        for data_source, sheet_name, output_paths in jobs:
+            profiler = Profiler() if args.profile else None
+            try:
+                converted = convert_file(data_source, data_dictionary, sheet_name=sheet_name,
+                                         chunksize=args.chunksize, workers=args.workers, executor=executor,
+                                         record_id_field=args.record_id,
+                                         prune_columns=args.only_dictionary_columns,
+                                         excel_cache_dir=args.excel_cache,
+                                         profiler=profiler, profile_top_fields=args.profile_top,
+                                         metadata_source=args.metadata, **output_paths)
+            except (ValueError, IOError) as error:
+                converted = False
+                print(data_source + ": " + str(error), file=sys.stderr)
+            if profiler is not None:
+                profiler.close()
+                file_profile = profiler.to_dict(args.profile_top)
+                file_profile['data_source'] = data_source
+                profile['files'].append(file_profile)
+            if converted:
+                print(data_source + ": converted to " + output_paths['output_path'])
+            else:
+                files_with_errors += 1
+                print(data_source + ": errors found, see " + output_paths['error_log_path'])
+    if profile is not None:
+        save_profile(profile, args.profile)
+    return 1 if files_with_errors else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,388 @@
+# Benchmarks for REDCap Data Convert.
+#
+#   python -m redcap_benchmark --rows 1000 10000 100000 --output benchmark.json
+#   python -m redcap_benchmark --rows 1000 --compare-versions
+#   python -m redcap_benchmark --rows 1000 --startup-budget-ms 800
+#
+# A synthetic data dictionary is made with the number of fields of each type given on the command
+# line, along with a matching dataset of each size in which a controlled fraction of the cells are
+# errors. Each stage of a conversion is timed separately: reading the file, normalizing the header,
+# validating text fields, recoding radio, dropdown and yesno fields, expanding checkbox fields,
+# converting the whole file, writing the excel file of errors, and writing the converted csv file.
+# The results are written as JSON, so the timings of two runs can be compared to find regressions.
+#
+# With --compare-versions, version1.py, version2.py and the current converter are each run from
+# start to finish on the same data. The older versions have their data file paths written into
+# their source, so they are run from a copy with those paths replaced. A version that fails is
+# recorded with its error instead of a time.
+#
+# Every run also checks how long the converter takes to start, with python -X importtime. The
+# benchmark fails when importing it takes longer than --startup-budget-ms, or when it imports a
+# module that is only needed on some paths, such as xlsxwriter, which is only needed when there
+# are errors.
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from redcap_convert import load_converter
+
+redcap_data_convert = load_converter()
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the number of fields of each type in the synthetic data dictionary
+DEFAULT_FIELD_COUNTS = {
+    'text': 5,
+    'date_mdy': 3,
+    'number_2dp': 3,
+    'integer': 3,
+    'radio': 10,
+    'dropdown': 10,
+    'yesno': 5,
+    'checkbox': 5,
+}
+
+DEFAULT_ROWS = [1000, 10000, 100000]
+
+# the older versions of the script, compared with the current converter by --compare-versions
+VERSION_SCRIPTS = ['version1.py', 'version2.py']
+
+# the columns of a REDCap data dictionary, in the order REDCap exports them
+METADATA_COLUMNS = ['Variable / Field Name', 'Form Name', 'Section Header', 'Field Type', 'Field Label',
+                    'Choices, Calculations, OR Slider Labels', 'Field Note',
+                    'Text Validation Type OR Show Slider Number', 'Text Validation Min',
+                    'Text Validation Max', 'Identifier?', 'Branching Logic (Show field only if...)',
+                    'Required Field?']
+
+# milliseconds that importing the converter may take
+DEFAULT_STARTUP_BUDGET_MS = 1000
+
+# times the converter is imported to measure its startup, of which the fastest is kept
+STARTUP_REPEATS = 3
+
+# modules that are only imported on the paths that need them, so must not be imported at startup
+LAZY_MODULES = ['xlsxwriter', 'openpyxl', 'python_calamine', 'pyarrow.parquet']
+
+# the stages of a conversion that are timed, in the order they run
+STAGES = ['load', 'header_normalization', 'validation', 'recoding', 'checkbox_expansion', 'transform',
+          'error_workbook', 'csv_write']
+
+
+def return_synthetic_metadata_df(field_counts, choice_count):
+    """ Returns a data dictionary DataFrame with field_counts[field type] fields of each type.
+        Text fields with validation are given as their validation type ('date_mdy', 'number_2dp',
+        'integer'). Radio, dropdown and checkbox fields have choice_count choices each. The
+        variable name of every field is its properly formatted field label, so the data can be
+        matched by the current converter, which uses labels, and the older versions, which use
+        variable names."""
+
+    rows = []
+    for field_type, count in field_counts.items():
+        for number in range(1, count + 1):
+            variable_name = field_type + '_field_' + str(number)
+            row = dict((column, np.nan) for column in METADATA_COLUMNS)
+            row['Variable / Field Name'] = variable_name
+            row['Form Name'] = 'benchmark'
+            row['Field Label'] = variable_name.replace('_', ' ').capitalize()
+            if field_type in ('radio', 'dropdown', 'checkbox'):
+                row['Field Type'] = field_type
+                row['Choices, Calculations, OR Slider Labels'] = ' | '.join(
+                    str(choice) + ', Choice ' + str(choice) for choice in range(1, choice_count + 1))
+            elif field_type == 'yesno':
+                row['Field Type'] = 'yesno'
+            else:
+                row['Field Type'] = 'text'
+                if field_type != 'text':
+                    row['Text Validation Type OR Show Slider Number'] = field_type
+            rows.append(row)
+    return pd.DataFrame(rows, columns=METADATA_COLUMNS)
+
+
+def return_synthetic_data_df(metadata_df, rows, error_rate, seed=0):
+    """ Returns a DataFrame of rows rows with one column per field of metadata_df, named by its
+        field label. Values are drawn the way they are typed by people, in mixed case and with
+        extra spaces. Each cell is an error with a probability of error_rate: a value that is not
+        a choice, a date or number that can not be read, or a missing value."""
+
+    random_state = np.random.RandomState(seed)
+    columns = {}
+    for field_label, field_type, validation_type, choices in zip(
+            metadata_df['Field Label'], metadata_df['Field Type'],
+            metadata_df['Text Validation Type OR Show Slider Number'],
+            metadata_df['Choices, Calculations, OR Slider Labels']):
+        if field_type in ('radio', 'dropdown'):
+            labels = np.array([choice.split(',', 1)[1].strip() for choice in choices.split('|')], dtype=object)
+            values = labels[random_state.randint(len(labels), size=rows)]
+            values = np.where(random_state.rand(rows) < 0.5, np.char.upper(values.astype(str)), values)
+            error_value = 'Not a choice'
+        elif field_type == 'checkbox':
+            labels = np.array([choice.split(',', 1)[1].strip() for choice in choices.split('|')], dtype=object)
+            first = labels[random_state.randint(len(labels), size=rows)]
+            second = labels[random_state.randint(len(labels), size=rows)]
+            values = np.where(random_state.rand(rows) < 0.5, first, first + ' | ' + second)
+            error_value = 'Not a choice'
+        elif field_type == 'yesno':
+            values = np.array(['Yes', 'no', ' YES ', 'No'], dtype=object)[random_state.randint(4, size=rows)]
+            error_value = 'maybe'
+        elif validation_type == 'date_mdy':
+            days = pd.to_datetime('1940-01-01') + pd.to_timedelta(random_state.randint(30000, size=rows), unit='D')
+            values = np.asarray(days.strftime('%m/%d/%Y'), dtype=object)
+            error_value = 'not a date'
+        elif validation_type == 'number_2dp':
+            values = np.round(random_state.rand(rows) * 100, 3).astype(object)
+            error_value = 'abc'
+        elif validation_type == 'integer':
+            values = random_state.randint(0, 120, size=rows).astype(object)
+            error_value = 'abc'
+        else:
+            values = np.array(['text ' + str(number) for number in range(rows)], dtype=object)
+            error_value = np.nan
+        values = np.asarray(values, dtype=object)
+        # half of the errors are values that can not be converted, and half are missing values
+        error_cells = random_state.rand(rows) < error_rate
+        missing_cells = error_cells & (random_state.rand(rows) < 0.5)
+        values[error_cells] = error_value
+        values[missing_cells] = np.nan
+        columns[field_label] = values
+    return pd.DataFrame(columns)
+
+
+def time_stage(timings, stage, function, *args, **kwargs):
+    """ Calls function with args and kwargs, adds the seconds it took to timings[stage], and returns
+        what it returned."""
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+    return result
+
+
+def run_benchmark(field_counts, rows, error_rate, choice_count, work_dir, seed=0):
+    """ Converts a synthetic dataset of rows rows and returns a dictionary of the seconds each of
+        the STAGES took, along with the size of the data and the number of errors found."""
+
+    metadata_df = return_synthetic_metadata_df(field_counts, choice_count)
+    data_dictionary = redcap_data_convert.DataDictionary(metadata_df)
+    data_path = os.path.join(work_dir, 'data_' + str(rows) + '.csv')
+    return_synthetic_data_df(metadata_df, rows, error_rate, seed).to_csv(data_path, index=False)
+
+    timings = {}
+    data_df = time_stage(timings, 'load', redcap_data_convert.read_data_file, data_path)
+    data_df.columns = time_stage(timings, 'header_normalization',
+                                 redcap_data_convert.return_list_of_properly_formatted_field_names,
+                                 list(data_df.columns))
+
+    # each matched column is converted on its own and its time added to the stage for its field type
+    for data_field_name in data_df.columns:
+        if data_field_name not in data_dictionary:
+            continue
+        field = data_dictionary[data_field_name]
+        if field.field_type == 'checkbox':
+            stage = 'checkbox_expansion'
+        elif field.field_type in data_dictionary.choice_field_types or field.field_type in data_dictionary.fixed_choices:
+            stage = 'recoding'
+        else:
+            stage = 'validation'
+        time_stage(timings, stage, redcap_data_convert.transform_data_column,
+                   data_field_name, data_df[data_field_name], field)
+
+    target_data_df, error_data_df, total_error_count, error_records = time_stage(
+        timings, 'transform', redcap_data_convert.transform_data_df, data_df, data_dictionary, io.StringIO())
+    time_stage(timings, 'error_workbook', redcap_data_convert.write_error_workbook,
+               data_df, error_data_df, os.path.join(work_dir, 'errors_' + str(rows) + '.xlsx'))
+    time_stage(timings, 'csv_write', target_data_df.to_csv,
+               os.path.join(work_dir, 'converted_' + str(rows) + '.csv'), index=False)
+
+    return {
+        'rows': rows,
+        'columns': len(data_df.columns),
+        'error_rate': error_rate,
+        'errors_found': len(error_records),
+        'seconds': dict((stage, round(timings[stage], 6)) for stage in STAGES),
+    }
+
+
+def return_version_command(script_name, data_path, metadata_path, output_path, work_dir):
+    """ Returns the command that runs script_name on data_path and metadata_path. The current
+        converter is run through its command line. The older versions have the paths of their data
+        file, data dictionary and output file written into their source in that order, so a copy
+        with those paths replaced is written to work_dir and run instead."""
+
+    if script_name == 'current':
+        return [sys.executable, '-m', 'redcap_convert', data_path, metadata_path, '-o', output_path,
+                '--error-log', os.path.join(work_dir, 'current_error_log.txt'),
+                '--error-workbook', os.path.join(work_dir, 'current_errors.xlsx')]
+
+    with open(os.path.join(PACKAGE_DIR, script_name)) as script:
+        source = script.read()
+    paths = iter([data_path, metadata_path, output_path])
+    source = re.sub(r"'G:[^']*'", lambda match: repr(next(paths, match.group(0))), source)
+    script_copy_path = os.path.join(work_dir, script_name)
+    with open(script_copy_path, 'w') as script_copy:
+        script_copy.write(source)
+    return [sys.executable, script_copy_path]
+
+
+def compare_versions(field_counts, rows, error_rate, choice_count, work_dir, seed=0, timeout=600):
+    """ Runs each of VERSION_SCRIPTS and the current converter from start to finish on the same
+        synthetic dataset of rows rows. Returns a dictionary of the seconds each took, or the last
+        line of its error output when it failed."""
+
+    metadata_path = os.path.join(work_dir, 'compare_metadata.csv')
+    data_path = os.path.join(work_dir, 'compare_data.csv')
+    metadata_df = return_synthetic_metadata_df(field_counts, choice_count)
+    metadata_df.to_csv(metadata_path, index=False)
+    return_synthetic_data_df(metadata_df, rows, error_rate, seed).to_csv(data_path, index=False)
+
+    results = {}
+    for script_name in VERSION_SCRIPTS + ['current']:
+        output_path = os.path.join(work_dir, script_name.replace('.py', '') + '_converted.csv')
+        command = return_version_command(script_name, data_path, metadata_path, output_path, work_dir)
+        environment = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+        start = time.perf_counter()
+        try:
+            completed = subprocess.run(command, cwd=work_dir, env=environment, capture_output=True,
+                                       text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            results[script_name] = {'status': 'timed out after ' + str(timeout) + ' seconds'}
+            continue
+        seconds = time.perf_counter() - start
+        # the current converter exits with 1 when it found errors in the data, which is not a failure
+        if completed.returncode == 0 or (script_name == 'current' and completed.returncode == 1):
+            results[script_name] = {'status': 'ok', 'seconds': round(seconds, 6)}
+        else:
+            error_lines = completed.stderr.strip().splitlines() or ['exit code ' + str(completed.returncode)]
+            results[script_name] = {'status': 'failed: ' + error_lines[-1]}
+    return {'rows': rows, 'error_rate': error_rate, 'versions': results}
+
+
+def return_import_times(module_name):
+    """ Returns a dictionary of module name -> (self microseconds, cumulative microseconds) for
+        every module imported when module_name is imported in a new interpreter, as reported by
+        python -X importtime."""
+
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+                               cwd=PACKAGE_DIR, env=dict(os.environ, PYTHONPATH=PACKAGE_DIR),
+                               capture_output=True, text=True, check=True)
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match:
+            import_times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return import_times
+
+
+def check_startup(budget_ms, module_name='redcap_convert', repeats=STARTUP_REPEATS):
+    """ Imports module_name in a new interpreter repeats times and returns a dictionary of the
+        fastest import time in milliseconds, the slowest modules it imported, any of LAZY_MODULES
+        that it imported, and whether it is within budget_ms with none of LAZY_MODULES imported."""
+
+    fastest_import_times = None
+    for repeat in range(repeats):
+        import_times = return_import_times(module_name)
+        if fastest_import_times is None or import_times[module_name][1] < fastest_import_times[module_name][1]:
+            fastest_import_times = import_times
+
+    import_ms = fastest_import_times[module_name][1] / 1000.0
+    slowest_modules = sorted(fastest_import_times.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    lazy_modules_imported = [name for name in LAZY_MODULES if name in fastest_import_times]
+    return {
+        'module': module_name,
+        'import_ms': round(import_ms, 3),
+        'budget_ms': budget_ms,
+        'slowest_modules_ms': dict((name, round(times[0] / 1000.0, 3)) for name, times in slowest_modules),
+        'lazy_modules_imported': lazy_modules_imported,
+        'passed': import_ms <= budget_ms and not lazy_modules_imported,
+    }
+
+
+def return_environment():
+    """ Returns the versions of Python and the libraries the timings depend on."""
+
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def return_argument_parser():
+    """ Returns the parser for the benchmark's command line."""
+
+    parser = argparse.ArgumentParser(
+        prog='redcap_benchmark',
+        description="Time each stage of a REDCap conversion on synthetic data dictionaries and datasets.")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help="sizes of the datasets, in rows (default: " + ' '.join(map(str, DEFAULT_ROWS)) + ")")
+    for field_type, count in DEFAULT_FIELD_COUNTS.items():
+        parser.add_argument('--' + field_type.replace('_', '-'), type=int, default=count, dest=field_type,
+                            help="number of " + field_type + " fields (default: " + str(count) + ")")
+    parser.add_argument('--choices', type=int, default=5,
+                        help="number of choices of each radio, dropdown and checkbox field (default: 5)")
+    parser.add_argument('--error-rate', type=float, default=0.01,
+                        help="fraction of the cells that are errors (default: 0.01)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random data (default: 0)")
+    parser.add_argument('--compare-versions', action='store_true',
+                        help="also run version1.py, version2.py and the current converter from start to "
+                             "finish on the smallest dataset")
+    parser.add_argument('--startup-budget-ms', type=float, default=DEFAULT_STARTUP_BUDGET_MS,
+                        help="fail when importing the converter takes longer than this many milliseconds "
+                             "(default: " + str(DEFAULT_STARTUP_BUDGET_MS) + ")")
+    parser.add_argument('--output', help="path of the JSON file of results (default: print them)")
+    return parser
+
+
+def main(argv=None):
+    """ Command-line entry point. Runs the benchmark at every size and writes the results as JSON.
+        Returns 1 when the converter's startup is over budget or imports one of LAZY_MODULES."""
+
+    args = return_argument_parser().parse_args(argv)
+    field_counts = dict((field_type, getattr(args, field_type)) for field_type in DEFAULT_FIELD_COUNTS)
+
+    results = {
+        'created': datetime.datetime.now().isoformat(),
+        'environment': return_environment(),
+        'field_counts': field_counts,
+        'choices': args.choices,
+        'runs': [],
+        'startup': check_startup(args.startup_budget_ms),
+    }
+    startup = results['startup']
+    print("startup: " + format(startup['import_ms'], '.1f') + " ms of a " + format(args.startup_budget_ms, 'g') +
+          " ms budget" + (", imports " + ", ".join(startup['lazy_modules_imported'])
+                          if startup['lazy_modules_imported'] else ""), file=sys.stderr)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in args.rows:
+            run = run_benchmark(field_counts, rows, args.error_rate, args.choices, work_dir, args.seed)
+            results['runs'].append(run)
+            print(str(rows) + " rows: " + ", ".join(
+                stage + " " + format(seconds, '.3f') + "s" for stage, seconds in run['seconds'].items()),
+                file=sys.stderr)
+        if args.compare_versions:
+            results['versions'] = compare_versions(field_counts, min(args.rows), args.error_rate, args.choices,
+                                                   work_dir, args.seed)
+
+    results_json = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results_json + '\n')
+    else:
+        print(results_json)
+    return 0 if startup['passed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
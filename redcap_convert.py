@@ -0,0 +1,41 @@
+# Command-line entry point for REDCap Data Convert.
+#
+#   python -m redcap_convert data.xlsx metadata.csv -o converted.csv --sheet Sheet1
+#   python -m redcap_convert --manifest uploads.txt metadata.csv --output-dir converted
+#
+# It can also be used as a library, converting DataFrames in-process with a converter whose data
+# dictionary is compiled once:
+#
+#   from redcap_convert import RedcapConverter
+#   converter = RedcapConverter.from_file('metadata.csv')
+#   converted_df, error_mask, error_records = converter.convert(data_df)
+#
+# The converter itself lives in REDCap_data_convert_version_0.7.py. Its file name is not a valid
+# module name, so it is loaded here by path and registered as the module 'redcap_data_convert'.
+# Registering it lets worker processes find its functions when columns are converted in parallel.
+
+import importlib.util
+import os
+import sys
+
+CONVERTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'REDCap_data_convert_version_0.7.py')
+
+
+def load_converter():
+    """ Returns the converter module, loading it the first time it is needed."""
+
+    if 'redcap_data_convert' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('redcap_data_convert', CONVERTER_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['redcap_data_convert'] = module
+        spec.loader.exec_module(module)
+    return sys.modules['redcap_data_convert']
+
+
+redcap_data_convert = load_converter()
+main = redcap_data_convert.main
+RedcapConverter = redcap_data_convert.RedcapConverter
+
+
+if __name__ == "__main__":
+    sys.exit(main())
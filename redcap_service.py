@@ -0,0 +1,388 @@
+# HTTP conversion service for REDCap Data Convert.
+#
+#   python -m redcap_service --dictionary-dir dictionaries --port 8080
+#   curl --data-binary @data.csv -o converted.csv \
+#        'http://localhost:8080/convert?dictionary=metadata.csv&filename=data.csv'
+#
+# The service keeps the converter and pandas loaded, so an upload does not pay for starting Python
+# and importing them. Conversions run in a pool of long-lived worker processes so the event loop
+# keeps answering requests, and each worker keeps the data dictionaries it has compiled in a pool of
+# the most recently used ones, so the same dictionary is not compiled again for every request.
+# Only the standard library's asyncio is used, so the service runs locally with nothing else.
+#
+# POST /convert converts the request body. Its query string names the data file with filename, so
+# its type is known, and may give the excel sheet to read with sheet. The data dictionary is either
+# named with dictionary, a file in the --dictionary-dir directory, or uploaded along with the data
+# as the 'metadata' file of a multipart/form-data request whose data is its 'data' file.
+#
+# The response is the converted csv file when there were no errors. Otherwise it is status 422 with
+# the excel file of the data with the error cells colored pink, or the error log when errors=log is
+# in the query string. Either file is streamed back in chunks. GET /health answers 'ok'.
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import email.parser
+import email.policy
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import urllib.parse
+
+from redcap_convert import load_converter
+
+redcap_data_convert = load_converter()
+
+# number of compiled data dictionaries kept in the pool
+DEFAULT_POOL_SIZE = 16
+
+# largest request body accepted, in megabytes
+DEFAULT_MAX_UPLOAD_MB = 512
+
+# bytes of a converted or error file sent in each chunk of a response
+RESPONSE_CHUNK_SIZE = 1 << 16
+
+CONTENT_TYPES = {
+    '.csv': 'text/csv; charset=utf-8',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.txt': 'text/plain; charset=utf-8',
+}
+
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    422: 'Unprocessable Entity',
+    500: 'Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+    """ An error that is answered with status and the message as plain text."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class DataDictionaryError(Exception):
+    """ A data dictionary that could not be compiled by a worker."""
+
+
+class DataDictionaryPool(object):
+    """ Keeps up to size compiled DataDictionaries, dropping the least recently used one when a new
+        one is added. Each is keyed by a hash of its metadata file's contents, so a dictionary
+        file that changes is compiled again, and the same dictionary uploaded many times is only
+        compiled once. The branching logic and calculations a dictionary compiles as it is used
+        are kept with it. The pool can be shared by threads."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.data_dictionaries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, metadata_path, sheet_name=None):
+        """ Returns the compiled DataDictionary whose metadata file's hash is key, compiling it from
+            the metadata file at metadata_path when it is not in the pool."""
+
+        with self.lock:
+            data_dictionary = self.data_dictionaries.pop(key, None)
+        if data_dictionary is None:
+            data_dictionary = redcap_data_convert.DataDictionary.from_file(metadata_path, sheet_name)
+        with self.lock:
+            self.data_dictionaries[key] = data_dictionary
+            while len(self.data_dictionaries) > self.size:
+                self.data_dictionaries.popitem(last=False)
+        return data_dictionary
+
+
+# the pool of compiled data dictionaries of this worker process, made by initialize_worker. Worker
+# processes live as long as the service, so their dictionaries stay compiled between requests.
+# Worker threads share the pool of the service's process
+worker_data_dictionary_pool = None
+
+
+def initialize_worker(pool_size=DEFAULT_POOL_SIZE):
+    """ Makes the pool of compiled data dictionaries of a worker, once for each process."""
+
+    global worker_data_dictionary_pool
+    if worker_data_dictionary_pool is None:
+        worker_data_dictionary_pool = DataDictionaryPool(pool_size)
+
+
+def convert_upload(data_path, metadata_path, dictionary_key, work_dir, sheet_name=None, metadata_sheet=None,
+                   metadata_name=''):
+    """ Converts the data file at data_path in a worker. The data dictionary is taken from the
+        worker's pool by dictionary_key, the hash of the metadata file at metadata_path, and is
+        only compiled when the worker does not have it yet. The converted csv file, error log and
+        excel file of errors are written to work_dir. metadata_name is the data dictionary named in
+        the error log. Returns True when there were no errors."""
+
+    initialize_worker()
+    try:
+        data_dictionary = worker_data_dictionary_pool.get(dictionary_key, metadata_path, metadata_sheet)
+    except (ValueError, KeyError, AttributeError) as error:
+        raise DataDictionaryError("The data dictionary could not be read: " + str(error))
+
+    return redcap_data_convert.convert_file(
+        data_path, data_dictionary, os.path.join(work_dir, 'converted.csv'), sheet_name=sheet_name,
+        metadata_source=metadata_name,
+        error_log_path=os.path.join(work_dir, 'error_log.txt'),
+        error_workbook_path=os.path.join(work_dir, 'errors.xlsx'),
+        error_csv_path=os.path.join(work_dir, 'errors.csv'))
+
+
+def return_upload_name(filename, default):
+    """ Returns the base name of an uploaded file's name, so it can not point outside the directory
+        it is saved in, or default when it has none."""
+
+    filename = os.path.basename((filename or '').replace('\\', '/'))
+    return filename or default
+
+
+def return_multipart_files(content_type, body):
+    """ Returns a dictionary of form field name -> (filename, contents) for every part of a
+        multipart/form-data body."""
+
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    if not message.is_multipart():
+        raise HTTPError(400, "The multipart/form-data body could not be read.")
+    files = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            files[name] = (part.get_filename(), part.get_payload(decode=True) or b'')
+    return files
+
+
+class ConversionService(object):
+    """ Answers HTTP requests to convert data files. dictionary_dir is the directory that data
+        dictionaries named in requests are read from. Conversions run in a pool of workers, worker
+        processes by default or threads when executor is 'thread'."""
+
+    def __init__(self, dictionary_dir=None, workers=None, executor='process', pool_size=DEFAULT_POOL_SIZE,
+                 max_upload_bytes=DEFAULT_MAX_UPLOAD_MB * 1048576):
+        self.dictionary_dir = dictionary_dir
+        self.max_upload_bytes = max_upload_bytes
+        # every worker keeps up to pool_size compiled data dictionaries
+        if executor == 'thread':
+            self.worker_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, initializer=initialize_worker, initargs=(pool_size,))
+        else:
+            self.worker_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=initialize_worker, initargs=(pool_size,))
+
+    async def handle_connection(self, reader, writer):
+        """ Reads one request from the connection, answers it, and closes the connection."""
+
+        try:
+            try:
+                method, path, headers, body = await self.read_request(reader)
+                await self.handle_request(method, path, headers, body, writer)
+            except HTTPError as error:
+                await self.write_response(writer, error.status, str(error) + '\n')
+            except Exception as error:
+                await self.write_response(writer, 500, 'The conversion failed: ' + str(error) + '\n')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """ Returns the method, path, headers and body of a request."""
+
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HTTPError(400, "The request line could not be read.")
+        method, path = parts[0].upper(), parts[1]
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if method == 'POST':
+            if 'content-length' not in headers:
+                raise HTTPError(411, "The request must have a Content-Length.")
+            try:
+                content_length = int(headers['content-length'])
+            except ValueError:
+                raise HTTPError(400, "The Content-Length is not a number.")
+            if content_length > self.max_upload_bytes:
+                raise HTTPError(413, "The upload is larger than " + str(self.max_upload_bytes) + " bytes.")
+            body = await reader.readexactly(content_length)
+        return method, path, headers, body
+
+    async def handle_request(self, method, path, headers, body, writer):
+        """ Answers a request for /health or /convert."""
+
+        url = urllib.parse.urlsplit(path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == '/health':
+            await self.write_response(writer, 200, 'ok\n')
+        elif url.path == '/convert':
+            if method != 'POST':
+                raise HTTPError(405, "Upload the data file with POST.")
+            await self.convert(query, headers, body, writer)
+        else:
+            raise HTTPError(404, "Not found. Use POST /convert or GET /health.")
+
+    async def convert(self, query, headers, body, writer):
+        """ Converts an uploaded data file and streams back the converted csv file, or the excel
+            file of errors or the error log when there are errors."""
+
+        work_dir = tempfile.mkdtemp(prefix='redcap_service_')
+        try:
+            metadata_upload = None
+            content_type = headers.get('content-type', '')
+            if content_type.lower().startswith('multipart/form-data'):
+                files = return_multipart_files(content_type, body)
+                if 'data' not in files:
+                    raise HTTPError(400, "The form has no 'data' file.")
+                data_name, data_contents = files['data']
+                metadata_upload = files.get('metadata')
+            else:
+                data_name, data_contents = query.get('filename'), body
+            data_name = return_upload_name(query.get('filename') or data_name, 'data.csv')
+            if os.path.splitext(data_name)[1].lower() not in ('.csv', '.xls', '.xlsx'):
+                raise HTTPError(400, "The data file must be a .csv, .xls, or .xlsx file. Name it with filename.")
+
+            if metadata_upload is not None:
+                metadata_name = return_upload_name(metadata_upload[0], 'metadata.csv')
+                metadata_path = os.path.join(work_dir, 'metadata_' + metadata_name)
+                with open(metadata_path, 'wb') as metadata_file:
+                    metadata_file.write(metadata_upload[1])
+            elif query.get('dictionary') and self.dictionary_dir:
+                metadata_name = return_upload_name(query['dictionary'], '')
+                metadata_path = os.path.join(self.dictionary_dir, metadata_name)
+                if not os.path.isfile(metadata_path):
+                    raise HTTPError(404, "There is no data dictionary named " + query['dictionary'] + ".")
+            else:
+                raise HTTPError(400, "Name a data dictionary with dictionary, or upload it as the 'metadata' file.")
+
+            # the data dictionary is hashed here, and compiled by the worker that converts the data
+            loop = asyncio.get_running_loop()
+            try:
+                dictionary_key = await loop.run_in_executor(
+                    None, redcap_data_convert.return_file_hash, metadata_path, query.get('metadata_sheet'))
+            except (ValueError, IOError) as error:
+                raise HTTPError(400, "The data dictionary could not be read: " + str(error))
+
+            data_path = os.path.join(work_dir, data_name)
+            with open(data_path, 'wb') as data_file:
+                data_file.write(data_contents)
+
+            try:
+                converted = await loop.run_in_executor(
+                    self.worker_pool, convert_upload, data_path, metadata_path, dictionary_key, work_dir,
+                    query.get('sheet'), query.get('metadata_sheet'), metadata_name)
+            except DataDictionaryError as error:
+                raise HTTPError(400, str(error).replace(work_dir + os.sep, ''))
+            except ValueError as error:
+                # the uploaded file is named without the temporary directory it was saved in
+                raise HTTPError(400, str(error).replace(work_dir + os.sep, ''))
+
+            if converted:
+                await self.write_file_response(writer, 200, os.path.join(work_dir, 'converted.csv'))
+            elif query.get('errors') == 'log' or not os.path.exists(os.path.join(work_dir, 'errors.xlsx')):
+                await self.write_file_response(writer, 422, os.path.join(work_dir, 'error_log.txt'))
+            else:
+                await self.write_file_response(writer, 422, os.path.join(work_dir, 'errors.xlsx'))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def write_response(self, writer, status, text):
+        """ Writes a whole plain text response."""
+
+        content = text.encode('utf-8')
+        writer.write(self.return_status_and_headers(status, CONTENT_TYPES['.txt'], [
+            ('Content-Length', str(len(content)))]))
+        writer.write(content)
+        await writer.drain()
+
+    async def write_file_response(self, writer, status, path):
+        """ Streams the file at path back in chunks of RESPONSE_CHUNK_SIZE bytes."""
+
+        extension = os.path.splitext(path)[1]
+        writer.write(self.return_status_and_headers(status, CONTENT_TYPES[extension], [
+            ('Transfer-Encoding', 'chunked'),
+            ('Content-Disposition', 'attachment; filename="' + os.path.basename(path) + '"')]))
+        with open(path, 'rb') as response_file:
+            for chunk in iter(lambda: response_file.read(RESPONSE_CHUNK_SIZE), b''):
+                writer.write(format(len(chunk), 'x').encode('ascii') + b'\r\n' + chunk + b'\r\n')
+                await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    def return_status_and_headers(self, status, content_type, headers):
+        """ Returns the status line and headers of a response."""
+
+        lines = ['HTTP/1.1 ' + str(status) + ' ' + STATUS_REASONS.get(status, ''),
+                 'Content-Type: ' + content_type, 'Connection: close']
+        lines.extend(name + ': ' + value for name, value in headers)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def close(self):
+        """ Shuts down the worker pool."""
+
+        self.worker_pool.shutdown()
+
+
+async def serve(host, port, service):
+    """ Answers requests on host and port with service until cancelled."""
+
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print("REDCap conversion service listening on http://" + host + ":" + str(port), file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def return_argument_parser():
+    """ Returns the parser for the service's command line."""
+
+    parser = argparse.ArgumentParser(
+        prog='redcap_service',
+        description="Convert uploaded data files into REDCap's import format over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument('--dictionary-dir', help="directory of the data dictionaries requests can name")
+    parser.add_argument('--workers', type=int, help="number of conversions run at once (default: one per CPU)")
+    parser.add_argument('--executor', choices=['process', 'thread'], default='process',
+                        help="run conversions in worker processes or threads (default: process)")
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help="number of compiled data dictionaries each worker keeps "
+                             "(default: " + str(DEFAULT_POOL_SIZE) + ")")
+    parser.add_argument('--max-upload-mb', type=int, default=DEFAULT_MAX_UPLOAD_MB,
+                        help="largest upload accepted, in megabytes (default: " + str(DEFAULT_MAX_UPLOAD_MB) + ")")
+    return parser
+
+
+def main(argv=None):
+    """ Command-line entry point. Runs the service until it is interrupted."""
+
+    args = return_argument_parser().parse_args(argv)
+    service = ConversionService(args.dictionary_dir, workers=args.workers, executor=args.executor,
+                                pool_size=args.pool_size, max_upload_bytes=args.max_upload_mb * 1048576)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
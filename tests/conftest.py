@@ -0,0 +1,76 @@
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redcap_convert import load_converter
+
+METADATA_COLUMNS = ['Variable / Field Name', 'Form Name', 'Section Header', 'Field Type', 'Field Label',
+                    'Choices, Calculations, OR Slider Labels', 'Field Note',
+                    'Text Validation Type OR Show Slider Number', 'Text Validation Min', 'Text Validation Max',
+                    'Identifier?', 'Branching Logic (Show field only if...)', 'Required Field?']
+
+
+@pytest.fixture(scope='session')
+def converter():
+    """ The converter module."""
+
+    return load_converter()
+
+
+@pytest.fixture
+def make_data_dictionary(converter):
+    """ Returns a function that builds a DataDictionary from (variable name, field type, field
+        label, choices or calculation, text validation type, min, max, branching logic) rows, with
+        everything after the field label optional."""
+
+    def make_data_dictionary(*fields):
+        rows = []
+        for field in fields:
+            field = tuple(field) + (None,) * (8 - len(field))
+            variable_name, field_type, field_label, choices, validation_type, minimum, maximum, branching_logic = field
+            rows.append({
+                'Variable / Field Name': variable_name, 'Form Name': 'form', 'Field Type': field_type,
+                'Field Label': field_label, 'Choices, Calculations, OR Slider Labels': choices,
+                'Text Validation Type OR Show Slider Number': validation_type, 'Text Validation Min': minimum,
+                'Text Validation Max': maximum, 'Branching Logic (Show field only if...)': branching_logic})
+        metadata_df = pd.DataFrame(rows, columns=METADATA_COLUMNS).astype(object)
+        return converter.DataDictionary(metadata_df.where(metadata_df.notna(), float('nan')))
+
+    return make_data_dictionary
+
+
+@pytest.fixture
+def convert(converter):
+    """ Returns a function that converts a DataFrame of columns with transform_data_df and returns
+        the target_data_df, error_data_df, whether any error blocks the csv file, and the error
+        records."""
+
+    def convert(data_dictionary, columns, **kwargs):
+        target_data_df, error_data_df, total_error_count, error_records = converter.transform_data_df(
+            pd.DataFrame(columns), data_dictionary, io.StringIO(), **kwargs)
+        return target_data_df, error_data_df, bool(total_error_count), error_records
+
+    return convert
+
+
+@pytest.fixture
+def evaluate(converter):
+    """ Returns a function that returns the result of an expression over rows rows, with fields a
+        dictionary of variable name -> list of values, and checkbox references looked up as
+        'name(code)'."""
+
+    def evaluate(expression, fields=None, rows=1):
+        fields = fields or {}
+
+        def return_field_values(variable_name, checkbox_code):
+            name = variable_name if checkbox_code is None else variable_name + '(' + checkbox_code + ')'
+            return pd.Series(fields[name], dtype=object)
+
+        return converter.evaluate_expression(converter.compile_expression(expression), return_field_values, rows)
+
+    return evaluate
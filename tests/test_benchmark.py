@@ -0,0 +1,22 @@
+import io
+
+import redcap_benchmark
+
+FIELD_COUNTS = {'radio': 2, 'checkbox': 1, 'yesno': 1, 'date_mdy': 1, 'number_2dp': 1, 'integer': 1, 'text': 1}
+
+
+def test_synthetic_data_without_errors_converts_cleanly(converter):
+    metadata_df = redcap_benchmark.return_synthetic_metadata_df(FIELD_COUNTS, 4)
+    data_dictionary = converter.DataDictionary(metadata_df)
+    data_df = redcap_benchmark.return_synthetic_data_df(metadata_df, 200, 0.0)
+    data_df.columns = converter.return_list_of_properly_formatted_field_names(list(data_df.columns))
+    _, _, total_error_count, error_records = converter.transform_data_df(data_df, data_dictionary, io.StringIO())
+    assert not total_error_count
+    assert not len(error_records)
+
+
+def test_every_stage_is_timed(tmp_path):
+    result = redcap_benchmark.run_benchmark(FIELD_COUNTS, 100, 0.1, 4, str(tmp_path))
+    assert set(result['seconds']) == set(redcap_benchmark.STAGES)
+    assert result['rows'] == 100
+    assert result['errors_found'] > 0
@@ -0,0 +1,98 @@
+import io
+
+import pandas as pd
+import pytest
+
+
+def test_or_binds_more_loosely_than_and(converter):
+    tree = converter.compile_expression("[a] = '1' or [b] = '1' and [c] = '1'")
+    assert tree[0] == 'or'
+    assert tree[2][0] == 'and'
+
+
+def test_comparisons_bind_more_loosely_than_arithmetic(converter):
+    assert converter.compile_expression('[a] + 1 > 2 * [b]') == (
+        'compare', '>', ('arithmetic', '+', ('field', 'a', None), ('literal', 1.0)),
+        ('arithmetic', '*', ('literal', 2.0), ('field', 'b', None)))
+
+
+def test_checkbox_and_event_references(converter):
+    assert converter.compile_expression("[site(2)] = '1'")[2] == ('field', 'site', '2')
+    assert converter.compile_expression("[event_1_arm_1][sex] = '1'")[2] == ('field', 'sex', None)
+    assert converter.return_expression_fields(converter.compile_expression(
+        "[event_1_arm_1][site(3)] = '1' and round([age], 0) > 18")) == set([('site', '3'), ('age', None)])
+
+
+@pytest.mark.parametrize('expression', ["[a] = ", "(1 + 2", "1 1", "nofunction(1)", "round(1", "[a] = 'x",
+                                        "[a] ~ 1", ""])
+def test_expressions_that_can_not_be_read(converter, expression):
+    with pytest.raises(ValueError):
+        converter.compile_expression(expression)
+
+
+def test_equality_compares_numbers_as_numbers_and_everything_else_as_text(evaluate):
+    fields = {'a': ['1.50', 'x', None, '2']}
+    assert evaluate('[a] = 1.5', fields, 4).tolist() == [True, False, False, False]
+    assert evaluate("[a] = 'x'", fields, 4).tolist() == [False, True, False, False]
+    assert evaluate("[a] = ''", fields, 4).tolist() == [False, False, True, False]
+    assert evaluate("[a] <> ''", fields, 4).tolist() == [True, True, False, True]
+    assert evaluate('[a] > 1', fields, 4).tolist() == [True, False, False, True]
+
+
+def test_and_or_of_checkbox_references(evaluate):
+    fields = {'sex': ['1', '1', '2'], 'site(2)': [1, 0, 1]}
+    assert evaluate("[sex] = '1' and [site(2)] = '1'", fields, 3).tolist() == [True, False, False]
+    assert evaluate("[sex] = '2' or [site(2)] = '1'", fields, 3).tolist() == [True, False, True]
+
+
+def test_missing_choice_values_are_flagged_but_do_not_block(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'))
+    target_data_df, error_data_df, blocked, error_records = convert(data_dictionary, {
+        'sex': ['Male', None, 'female']})
+    assert not blocked
+    assert error_data_df['sex'].tolist() == [False, True, False]
+    assert error_records['reason'].tolist() == ['missing value']
+    _, _, blocked, error_records = convert(data_dictionary, {'sex': ['Male', 'other']})
+    assert blocked
+    assert error_records['reason'].tolist() == ['not a choice']
+
+
+def test_fields_hidden_by_branching_logic_must_be_empty(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+        ('pregnant', 'yesno', 'Pregnant', None, None, None, None, "[sex] = '2'"))
+    # a blank value where the field is hidden is not even a missing value
+    target_data_df, error_data_df, blocked, error_records = convert(data_dictionary, {
+        'sex': ['Male', 'Female', 'Female'], 'pregnant': [None, 'Yes', None]})
+    assert not blocked
+    assert error_data_df['pregnant'].tolist() == [False, False, True]
+    assert [(record['row'], record['reason']) for record in error_records] == [(3, 'missing value')]
+    # a value where the field is hidden blocks the csv file
+    _, error_data_df, blocked, error_records = convert(data_dictionary, {
+        'sex': ['Male', 'Female'], 'pregnant': ['No', 'Yes']})
+    assert blocked
+    assert error_data_df['pregnant'].tolist() == [True, False]
+    assert error_records['reason'].tolist() == ['hidden by branching logic']
+
+
+def test_references_to_fields_not_in_the_data_dictionary_are_found_when_compiled(make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('site', 'checkbox', 'Site', '1, Left arm | 2, Right arm'),
+        ('side', 'text', 'Side', None, None, None, None, "[site(2)] = '1' or [site(3)] = '1'"),
+        ('reason', 'text', 'Reason', None, None, None, None, "[sex] = '2' and [site(1)] = '1'"),
+        ('other', 'text', 'Other', None, None, None, None, "[site(1)] = '1'"))
+    branching_logic = data_dictionary.return_compiled_branching_logic()
+    assert branching_logic['side'][1:] == (None, "refers to [site(3)], which is not in the data dictionary")
+    assert branching_logic['reason'][1:] == (None, "refers to [sex], which is not in the data dictionary")
+    assert branching_logic['other'][1] is not None and branching_logic['other'][2] is None
+
+
+def test_branching_logic_that_can_not_be_checked_is_noted(converter, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('side', 'text', 'Side', None, None, None, None, "[sex] = '2'"),
+        ('note', 'text', 'Note', None, None, None, None, "[side] = "))
+    error_log = io.StringIO()
+    converter.transform_data_df(pd.DataFrame({'side': ['left'], 'note': ['x']}), data_dictionary, error_log)
+    assert error_log.getvalue().splitlines()[:2] == [
+        "side: branching logic refers to [sex], which is not in the data dictionary: [sex] = '2' (rows 1 to 1)",
+        "note: branching logic could not be read: [side] =  (rows 1 to 1)"]
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('1 + 2 * 3', 7),
+    ('(1 + 2) * 3', 9),
+    ('10 - 4 - 3', 3),
+    ('12 / 3 / 2', 2),
+    ('2 * 3 ^ 2', 18),
+    ('2 ^ 3 ^ 2', 512),
+    ('-2 ^ 2', -4),
+    ('--3', 3),
+    ('2 ^ -1', 0.5),
+])
+def test_arithmetic_precedence(evaluate, expression, expected):
+    assert evaluate(expression)[0] == expected
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('round(2.5)', 3),
+    ('round(-2.5)', -3),
+    ('round(2.449, 1)', 2.4),
+    ('roundup(2.41, 1)', 2.5),
+    ('rounddown(-2.49, 1)', -2.4),
+    ('abs(-3)', 3),
+    ('sqrt(16)', 4),
+    ('min(3, 1, 2)', 1),
+    ('max(3, 1, 2)', 3),
+    ('sum(1, 2, 3)', 6),
+    ('mean(1, 2, 3)', 2),
+    ('if(2 > 1, 10, 20)', 10),
+    ('if(2 < 1, 10, 20)', 20),
+])
+def test_functions(evaluate, expression, expected):
+    assert evaluate(expression)[0] == pytest.approx(expected)
+
+
+def test_missing_values_and_division_by_zero_give_no_number(evaluate):
+    fields = {'a': ['4', None, '0'], 'b': ['2', '2', None]}
+    assert np.isnan(evaluate('[a] / [b]', fields, 3)[1:]).all()
+    assert not np.isfinite(evaluate('1 / [a]', fields, 3)[2])
+    # sum and mean leave out missing values, and have no number when every value is missing
+    assert evaluate('sum([a], [b])', fields, 3).tolist()[:3] == [6, 2, 0]
+    assert np.isnan(evaluate('mean([b], [b])', {'b': [None]}, 1)[0])
+
+
+def test_if_with_a_missing_condition_takes_the_false_value(evaluate):
+    assert evaluate('if([a], 1, 2)', {'a': [None]}, 1)[0] == 2
+
+
+def test_registered_functions_can_be_called(converter, evaluate):
+    converter.register_calculation_function('Double', lambda numbers: numbers * 2)
+    try:
+        assert evaluate('double(4)')[0] == 8
+    finally:
+        del converter.CALCULATION_FUNCTIONS['double']
+
+
+def test_calc_fields_are_filled_and_checked(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('weight', 'text', 'Weight', None, 'number'),
+        ('height', 'text', 'Height', None, 'number'),
+        ('bmi', 'calc', 'BMI', 'round([weight]/(([height]/100)^2),1)'))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {
+        'weight': ['70', '80', '60'], 'height': ['175', '180', '0'], 'bmi': ['22.9', None, None]})
+    assert not blocked
+    # dividing by a height of 0 leaves the calculation blank
+    assert target_data_df['bmi'].tolist()[:2] == ['22.9', '24.7']
+    assert pd.isna(target_data_df['bmi'].tolist()[2])
+    _, error_data_df, blocked, error_records = convert(data_dictionary, {
+        'weight': ['70'], 'height': ['175'], 'bmi': ['25']})
+    assert blocked
+    assert error_records['reason'].tolist() == ['does not match calculation']
+
+
+def test_given_calc_values_are_written_the_way_calculated_ones_are(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('weight', 'text', 'Weight', None, 'number'),
+        ('double', 'calc', 'Double', '[weight] * 2'))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {
+        'weight': ['30', '30.25', '30', '30.25'], 'double': ['60.0', '60.50', ' 60 ', None]})
+    assert not blocked
+    assert target_data_df['double'].tolist() == ['60', '60.5', '60', '60.5']
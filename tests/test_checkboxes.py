@@ -0,0 +1,24 @@
+def test_checkbox_columns_are_named_by_code_and_can_be_referenced(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('site', 'checkbox', 'Site', '1, Left arm | 2, Right arm'),
+        ('side', 'text', 'Side', None, None, None, None, "[site(2)] = '1'"))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {
+        'site': ['Left arm', 'Left arm|Right arm'], 'side': [None, 'right']})
+    assert not blocked
+    assert list(target_data_df.columns) == ['site___1', 'site___2', 'side']
+    assert target_data_df['site___2'].tolist() == [0, 1]
+    _, _, blocked, error_records = convert(data_dictionary, {'site': ['Left arm'], 'side': ['right']})
+    assert blocked
+    assert error_records['reason'].tolist() == ['hidden by branching logic']
+
+
+def test_checkbox_columns_use_the_codes_written_in_the_metadata(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('field', 'checkbox', 'Field', '0, A | 5, B'),
+        ('detail', 'text', 'Detail', None, None, None, None, "[field(5)] = '1'"))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {
+        'field': ['A', 'A|B', 'B'], 'detail': [None, 'both', 'only b']})
+    assert not blocked
+    assert list(target_data_df.columns) == ['field___0', 'field___5', 'detail']
+    assert target_data_df['field___0'].tolist() == [1, 1, 0]
+    assert target_data_df['field___5'].tolist() == [0, 1, 1]
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+
+def test_yes_no_and_true_false_use_redcap_codes(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(('smoker', 'yesno', 'Smoker'), ('agree', 'truefalse', 'Agree'))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {
+        'smoker': ['Yes', ' no ', 'YES'], 'agree': [True, False, 'true']})
+    assert not blocked
+    assert target_data_df['smoker'].astype(str).tolist() == ['1', '0', '1']
+    assert target_data_df['agree'].astype(str).tolist() == ['1', '0', '1']
+
+
+def test_choices_are_recoded_and_compared_with_the_codes_in_the_metadata(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('amount', 'radio', 'Amount', '0, None | 5, Some | 99, Unknown'),
+        ('reason', 'text', 'Reason', None, None, None, None, "[amount] = '99'"))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {
+        'amount': ['None', 'Unknown', 'some'], 'reason': [None, 'not asked', None]})
+    assert not blocked
+    assert target_data_df['amount'].astype(str).tolist() == ['0', '99', '5']
+    _, _, blocked, error_records = convert(data_dictionary, {'amount': ['Some'], 'reason': ['not asked']})
+    assert blocked
+    assert error_records['reason'].tolist() == ['hidden by branching logic']
+
+
+def test_coded_fields_are_categoricals_of_every_code(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female | 3, Other'),
+                                           ('site', 'checkbox', 'Site', '1, Left arm | 2, Right arm'))
+    target_data_df, _, blocked, _ = convert(data_dictionary, {'sex': ['Male', 'Female'], 'site': ['Left arm', None]})
+    assert not blocked
+    assert isinstance(target_data_df['sex'].dtype, pd.CategoricalDtype)
+    # codes that are not in the data are still categories, so every chunk of a file has the same ones
+    assert target_data_df['sex'].cat.categories.tolist() == ['1', '2', '3']
+    assert target_data_df['site___1'].dtype == np.int8
+    assert target_data_df.to_csv(index=False).splitlines() == ['sex,site___1,site___2', '1,1,0', '2,0,0']
@@ -0,0 +1,51 @@
+import io
+
+import pandas as pd
+
+
+def test_csv_files_are_converted_in_chunks(converter, make_data_dictionary, tmp_path):
+    data_dictionary = make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+                                           ('age', 'text', 'Age', None, 'integer'))
+    data_path = tmp_path / 'data.csv'
+    output_path = tmp_path / 'converted.csv'
+    error_output_path = tmp_path / 'errors.csv'
+    pd.DataFrame({'Sex': ['Male', 'Female', 'male', 'Female', 'Male'],
+                  'Age': ['30', '40', '50', '60', '70']}).to_csv(data_path, index=False)
+    error_output_path.write_text('left by an earlier conversion\n')
+    assert converter.convert_csv_in_chunks(str(data_path), data_dictionary, str(output_path), str(error_output_path),
+                                           io.StringIO(), chunksize=2)
+    assert output_path.read_text().splitlines() == ['sex,age', '1,30', '2,40', '1,50', '2,60', '1,70']
+    # no file of error rows is written when there are none
+    assert not error_output_path.exists()
+
+
+def test_error_rows_of_every_chunk_are_written_with_their_position_in_the_file(converter, make_data_dictionary,
+                                                                                tmp_path):
+    data_dictionary = make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+                                           ('age', 'text', 'Age', None, 'integer'))
+    data_path = tmp_path / 'data.csv'
+    output_path = tmp_path / 'converted.csv'
+    error_output_path = tmp_path / 'errors.csv'
+    pd.DataFrame({'Sex': ['Male', 'Female', 'other', 'Female', 'Male'],
+                  'Age': ['30', '40', '50', '60', 'old']}).to_csv(data_path, index=False)
+    assert not converter.convert_csv_in_chunks(str(data_path), data_dictionary, str(output_path),
+                                               str(error_output_path), io.StringIO(), chunksize=2)
+    assert not output_path.exists()
+    error_rows_df = pd.read_csv(error_output_path, dtype=str)
+    assert error_rows_df['row'].tolist() == ['3', '5']
+    assert error_rows_df['error_fields'].tolist() == ['sex', 'age']
+
+
+def test_skipped_checks_are_noted_for_every_chunk(converter, make_data_dictionary, tmp_path):
+    data_dictionary = make_data_dictionary(('age', 'text', 'Age', None, 'integer'),
+                                           ('weight', 'text', 'Weight', None, 'number'),
+                                           ('double', 'calc', 'Double', '[weight] * 2'))
+    data_path = tmp_path / 'data.csv'
+    error_log = io.StringIO()
+    pd.DataFrame({'Age': ['30', '40', '50'], 'Double': [None, None, None]}).to_csv(data_path, index=False)
+    converter.convert_csv_in_chunks(str(data_path), data_dictionary, str(tmp_path / 'converted.csv'),
+                                    str(tmp_path / 'errors.csv'), error_log, chunksize=2)
+    notes = [line for line in error_log.getvalue().splitlines() if line.startswith('double: ')]
+    assert len(notes) == 2
+    assert notes[0].endswith('(rows 1 to 2)')
+    assert notes[1].endswith('(rows 3 to 3)')
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+METADATA_COLUMNS = ['Variable / Field Name', 'Form Name', 'Field Type', 'Field Label',
+                    'Choices, Calculations, OR Slider Labels', 'Text Validation Type OR Show Slider Number']
+
+
+@pytest.fixture
+def metadata_path(tmp_path):
+    metadata_path = tmp_path / 'metadata.csv'
+    pd.DataFrame([{'Variable / Field Name': 'record_id', 'Field Type': 'text', 'Field Label': 'Record ID'}],
+                 columns=METADATA_COLUMNS).to_csv(metadata_path, index=False)
+    return metadata_path
+
+
+def test_options_may_come_between_the_data_file_and_the_data_dictionary(converter, metadata_path, tmp_path):
+    data_path = tmp_path / 'data.csv'
+    output_path = tmp_path / 'converted.csv'
+    pd.DataFrame({'Record ID': ['1', '2']}).to_csv(data_path, index=False)
+    assert converter.main([str(data_path), '-o', str(output_path), str(metadata_path),
+                           '--error-log', str(tmp_path / 'log.txt')]) == 0
+    assert output_path.read_text().splitlines() == ['record_id', '1', '2']
+
+
+def test_manifest_files_that_would_write_the_same_output_are_refused(converter, metadata_path, tmp_path,
+                                                                     capsys):
+    (tmp_path / 'site1').mkdir()
+    (tmp_path / 'site2').mkdir()
+    data_paths = [tmp_path / 'good.csv', tmp_path / 'site1' / 'upload.csv', tmp_path / 'site2' / 'upload.csv']
+    for data_path in data_paths:
+        pd.DataFrame({'Record ID': ['1']}).to_csv(data_path, index=False)
+    pd.DataFrame({'Record ID': ['1']}).to_excel(tmp_path / 'good.xlsx', index=False)
+    manifest_path = tmp_path / 'manifest.txt'
+    manifest_path.write_text('\n'.join(str(path) for path in data_paths + [tmp_path / 'good.xlsx']) + '\n')
+    output_dir = tmp_path / 'out'
+
+    with pytest.raises(SystemExit):
+        converter.main(['--manifest', str(manifest_path), '--output-dir', str(output_dir), str(metadata_path)])
+    error = capsys.readouterr().err
+    assert 'upload_redcap.csv' in error and 'good_redcap.csv' in error
+    # nothing is converted when any file would write over another
+    assert not list(output_dir.iterdir())
+
+    manifest_path.write_text('\n'.join(str(path) for path in data_paths[:2]) + '\n')
+    assert converter.main(['--manifest', str(manifest_path), '--output-dir', str(output_dir),
+                           str(metadata_path)]) == 0
+    assert (output_dir / 'upload_redcap.csv').exists()
@@ -0,0 +1,65 @@
+import pickle
+
+import pandas as pd
+
+from conftest import METADATA_COLUMNS
+
+
+def test_choices_keep_the_codes_written_in_the_metadata(make_data_dictionary):
+    data_dictionary = make_data_dictionary(
+        ('amount', 'radio', 'Amount', '0, None | 1, Some | 99, Unknown'),
+        ('count', 'dropdown', 'Count', '-1, Not asked | 5, Five, or more'))
+    assert data_dictionary['amount'].choices == {'none': '0', 'some': '1', 'unknown': '99'}
+    # a label is everything after the first comma
+    assert data_dictionary['count'].choices == {'not asked': '-1', 'five, or more': '5'}
+
+
+def test_fields_are_found_by_their_properly_formatted_label(make_data_dictionary):
+    data_dictionary = make_data_dictionary(('dob', 'text', 'Date of Birth', None, 'date_mdy'),
+                                           ('dob_again', 'text', 'Date of Birth', None, 'date_dmy'))
+    assert 'date_of_birth' in data_dictionary
+    assert len(data_dictionary) == 1
+    # the first row of a repeated label is used
+    assert data_dictionary['date_of_birth'].variable_name == 'dob'
+    assert data_dictionary['date_of_birth'].validation_type == 'date_mdy'
+
+
+def write_metadata(metadata_path, choices):
+    pd.DataFrame([{'Variable / Field Name': 'sex', 'Form Name': 'form', 'Field Type': 'radio', 'Field Label': 'Sex',
+                   'Choices, Calculations, OR Slider Labels': choices}],
+                 columns=METADATA_COLUMNS).to_csv(metadata_path, index=False)
+
+
+def test_compiled_dictionaries_are_loaded_from_the_cache(converter, monkeypatch, tmp_path):
+    metadata_path = tmp_path / 'metadata.csv'
+    cache_dir = tmp_path / 'cache'
+    write_metadata(metadata_path, '1, Male | 2, Female')
+    data_dictionary = converter.DataDictionary.from_file(str(metadata_path), cache_dir=str(cache_dir))
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def read_data_file(*args):
+        raise AssertionError("the metadata file was read again")
+
+    monkeypatch.setattr(converter, 'read_data_file', read_data_file)
+    cached_data_dictionary = converter.DataDictionary.from_file(str(metadata_path), cache_dir=str(cache_dir))
+    assert cached_data_dictionary.variable_names == data_dictionary.variable_names
+    assert cached_data_dictionary.fields == data_dictionary.fields
+
+
+def test_changed_metadata_files_and_old_caches_are_compiled_again(converter, tmp_path):
+    metadata_path = tmp_path / 'metadata.csv'
+    cache_dir = tmp_path / 'cache'
+    write_metadata(metadata_path, '1, Male | 2, Female')
+    converter.DataDictionary.from_file(str(metadata_path), cache_dir=str(cache_dir))
+    write_metadata(metadata_path, '1, Male | 2, Female | 3, Other')
+    data_dictionary = converter.DataDictionary.from_file(str(metadata_path), cache_dir=str(cache_dir))
+    assert data_dictionary['sex'].choices == {'male': '1', 'female': '2', 'other': '3'}
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # a cache written by a version of the converter that compiled dictionaries differently is not used
+    cache_path = converter.return_data_dictionary_cache_path(str(metadata_path), None, str(cache_dir))
+    with open(cache_path, 'wb') as cache_file:
+        pickle.dump({'version': converter.DATA_DICTIONARY_CACHE_VERSION - 1}, cache_file)
+    assert converter.load_data_dictionary_cache(cache_path) is None
+    assert converter.DataDictionary.from_file(str(metadata_path), cache_dir=str(cache_dir)).fields == \
+        data_dictionary.fields
@@ -0,0 +1,13 @@
+import pandas as pd
+
+
+def test_dates_without_a_year_are_not_dates(converter):
+    dates = converter.date_validation(pd.Series(['12', '3/4', 'March 4 1990']), 'date_mdy')
+    assert pd.isna(dates[0]) and pd.isna(dates[1])
+    assert dates[2] == '03/04/1990'
+
+
+def test_dates_are_read_in_the_order_of_the_validation_type(converter):
+    data_values = pd.Series(['2024-03-04', '04/03/2024', None])
+    assert converter.date_validation(data_values, 'date_dmy').tolist()[:2] == ['04/03/2024', '04/03/2024']
+    assert pd.isna(converter.date_validation(data_values, 'date_dmy')[2])
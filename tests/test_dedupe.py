@@ -0,0 +1,21 @@
+import pandas as pd
+
+
+def test_converting_distinct_values_gives_the_same_results_as_converting_every_value(convert,
+                                                                                    make_data_dictionary):
+    data_dictionary = make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+                                           ('site', 'checkbox', 'Site', '1, Left arm | 2, Right arm'),
+                                           ('dob', 'text', 'Date of birth', None, 'date_mdy'),
+                                           ('age', 'text', 'Age', None, 'integer', '0', '120'))
+    columns = {'sex': ['Male', 'male ', 'Male', 'other', None, 'other'],
+               'site': ['Left arm', 'Left arm|Right arm', 'Left arm', None, 'Right arm', 'Left arm'],
+               'dob': ['1/2/1990', '1/2/1990', 'soon', None, '1990-01-02', 'soon'],
+               'age': ['30', '30', '130', '30', 'old', None]}
+    deduped = convert(data_dictionary, columns)
+    every_value = convert(data_dictionary, columns, dedupe=False)
+    pd.testing.assert_frame_equal(deduped[0], every_value[0])
+    pd.testing.assert_frame_equal(deduped[1], every_value[1])
+    assert deduped[2] == every_value[2]
+    assert deduped[3].tolist() == every_value[3].tolist()
+    # every repeated erroneous value is recorded, not only the first
+    assert [record['row'] for record in deduped[3] if record['field'] == 'sex'] == [4, 5, 6]
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def return_error_records(converter, first_position):
+    return converter.return_error_records('age', [True, True, False], ['old', 7.5, '30'], 'not a valid integer',
+                                          first_position, 'integer')
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet'])
+def test_error_records_are_written_in_batches(converter, tmp_path, extension):
+    path = str(tmp_path / ('error_records' + extension))
+    with converter.ErrorRecordWriter(path, batch_size=2) as error_record_writer:
+        error_record_writer.write(return_error_records(converter, 1))
+        error_record_writer.write(np.empty(0, dtype=converter.ERROR_RECORD_DTYPE))
+        error_record_writer.write(return_error_records(converter, 4))
+    assert error_record_writer.number_of_records == 4
+
+    if extension == '.csv':
+        error_records_df = pd.read_csv(path, dtype={'value': str})
+    else:
+        error_records_df = pd.read_parquet(path)
+    assert list(error_records_df.columns) == ['row', 'field', 'value', 'expected', 'reason']
+    assert error_records_df['row'].tolist() == [1, 2, 4, 5]
+    # values of every type are written as text
+    assert error_records_df['value'].tolist() == ['old', '7.5', 'old', '7.5']
+    assert set(error_records_df['reason']) == set(['not a valid integer'])
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet'])
+def test_a_report_with_no_errors_has_only_its_columns(converter, tmp_path, extension):
+    path = str(tmp_path / ('error_records' + extension))
+    converter.ErrorRecordWriter(path).close()
+    error_records_df = pd.read_csv(path) if extension == '.csv' else pd.read_parquet(path)
+    assert list(error_records_df.columns) == ['row', 'field', 'value', 'expected', 'reason']
+    assert not len(error_records_df)
@@ -0,0 +1,19 @@
+import io
+
+
+def test_every_erroneous_cell_is_recorded_with_its_position(converter):
+    error_records = converter.return_error_records(
+        'sex', [False, True, True, False, True], ['Male', 'other', None, 'Female', 'other'], 'not a choice',
+        first_position=11, expected='male|female')
+    assert error_records['row'].tolist() == [12, 13, 15]
+    assert error_records['value'].tolist() == ['other', None, 'other']
+    assert error_records['reason'].tolist() == ['not a choice', 'missing value', 'not a choice']
+    assert set(error_records['expected']) == set(['male|female'])
+
+
+def test_error_summaries_give_the_first_positions_of_each_value(converter):
+    error_records = converter.return_error_records('sex', [True] * 4, ['x', 'y', 'x', None], 'not a choice')
+    error_log = io.StringIO()
+    converter.write_error_summary(error_records, error_log, max_examples=2)
+    assert error_log.getvalue().splitlines() == [
+        "sex: 4 errors (not a choice: 3, missing value: 1)", "    {'x': [1, 3], 'y': [2]}"]
@@ -0,0 +1,17 @@
+import openpyxl
+import pandas as pd
+
+
+def test_only_error_cells_are_colored_pink(converter, tmp_path):
+    data_df = pd.DataFrame({'sex': ['Male', 'other', None], 'age': ['30', None, '40']})
+    error_data_df = pd.DataFrame({'sex': [False, True, False], 'age': [False, True, False]})
+    workbook_path = tmp_path / 'errors.xlsx'
+    converter.write_error_workbook(data_df, error_data_df, str(workbook_path))
+
+    worksheet = openpyxl.load_workbook(workbook_path)['Sheet1']
+    assert [[cell.value for cell in row] for row in worksheet.iter_rows()] == [
+        ['sex', 'age'], ['Male', '30'], ['other', 'NaN'], [None, '40']]
+    pink_cells = [cell.coordinate for row in worksheet.iter_rows(min_row=2) for cell in row
+                  if cell.fill.fgColor.rgb == 'FFFF00FF']
+    # a missing value that is an error is written as 'NaN' so it can be colored
+    assert pink_cells == ['A3', 'B3']
@@ -0,0 +1,57 @@
+import os
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook_path = tmp_path / 'data.xlsx'
+    pd.DataFrame({'Record ID': [1, 2], 'Sex': ['Male', 'Female'], 'Notes': ['a', 'b']}).to_excel(
+        workbook_path, index=False)
+    return str(workbook_path)
+
+
+def forbid_reading_workbooks(converter, monkeypatch):
+    def excel_file(*args, **kwargs):
+        raise AssertionError("the workbook was read again")
+
+    monkeypatch.setattr(converter.pd, 'ExcelFile', excel_file)
+
+
+@pytest.mark.parametrize('sheet_name', [None, 'Sheet1'])
+def test_excel_sheets_are_read_from_the_cache(converter, workbook_path, tmp_path, monkeypatch, sheet_name):
+    cache_dir = str(tmp_path / 'cache')
+    data_df = converter.read_data_file(workbook_path, sheet_name, cache_dir=cache_dir)
+    assert [os.path.splitext(name)[1] for name in os.listdir(cache_dir)] == ['.parquet']
+
+    forbid_reading_workbooks(converter, monkeypatch)
+    pd.testing.assert_frame_equal(converter.read_data_file(workbook_path, sheet_name, cache_dir=cache_dir), data_df)
+    # only the columns asked for are read from the copy, and the whole header is kept
+    pruned_df = converter.read_data_file(workbook_path, sheet_name, field_names=set(['sex']), cache_dir=cache_dir)
+    assert list(pruned_df.columns) == ['Sex']
+    assert pruned_df.attrs['data_field_names'] == ['Record ID', 'Sex', 'Notes']
+
+
+def test_sheets_parquet_can_not_store_are_cached_as_pickles(converter, tmp_path, monkeypatch):
+    workbook_path = str(tmp_path / 'mixed.xlsx')
+    pd.DataFrame({'Age': [30, 'old'], 'Sex': ['Male', 'Female']}).to_excel(workbook_path, index=False)
+    cache_dir = str(tmp_path / 'cache')
+    data_df = converter.read_data_file(workbook_path, cache_dir=cache_dir)
+    assert [os.path.splitext(name)[1] for name in os.listdir(cache_dir)] == ['.pickle']
+
+    forbid_reading_workbooks(converter, monkeypatch)
+    pd.testing.assert_frame_equal(converter.read_data_file(workbook_path, cache_dir=cache_dir), data_df)
+    pruned_df = converter.read_data_file(workbook_path, field_names=set(['age']), cache_dir=cache_dir)
+    assert pruned_df['Age'].tolist() == [30, 'old']
+    assert pruned_df.attrs['data_field_names'] == ['Age', 'Sex']
+
+
+def test_workbooks_with_several_sheets_need_a_sheet_name(converter, tmp_path):
+    workbook_path = str(tmp_path / 'sheets.xlsx')
+    with pd.ExcelWriter(workbook_path) as writer:
+        pd.DataFrame({'Sex': ['Male']}).to_excel(writer, sheet_name='first', index=False)
+        pd.DataFrame({'Sex': ['Female']}).to_excel(writer, sheet_name='second', index=False)
+    with pytest.raises(ValueError):
+        converter.read_data_file(workbook_path)
+    assert converter.read_data_file(workbook_path, 'second')['Sex'].tolist() == ['Female']
@@ -0,0 +1,37 @@
+import io
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def data_dictionary(make_data_dictionary):
+    return make_data_dictionary(('record_id', 'text', 'Record ID'),
+                                ('age', 'text', 'Age', None, 'integer'))
+
+
+def test_record_id_can_be_given_as_it_appears_in_the_header(converter):
+    data_df = pd.DataFrame({'record_id': ['1', '1', '2']})
+    assert list(converter.return_row_keys(data_df, 'Record ID')) == ['1#0', '1#1', '2#0']
+    with pytest.raises(ValueError):
+        converter.return_row_keys(data_df, 'Participant')
+
+
+def test_only_changed_rows_are_converted_and_errors_keep_their_position(converter, data_dictionary, tmp_path):
+    state_path = str(tmp_path / 'data.state')
+    data_df = pd.DataFrame({'record_id': ['1', '2', '3', '4'], 'age': ['30', '40', '50', '60']})
+    target_data_df, _, total_error_count, _, state = converter.transform_data_df_incrementally(
+        data_df, data_dictionary, io.StringIO(), state_path)
+    assert not total_error_count
+    converter.save_incremental_state(state_path, state)
+
+    data_df.loc[2, 'age'] = 'old'
+    error_log = io.StringIO()
+    _, error_data_df, total_error_count, error_records, _ = converter.transform_data_df_incrementally(
+        data_df, data_dictionary, error_log, state_path)
+    assert total_error_count
+    assert error_log.getvalue().startswith('1 of 4 rows are new or changed since the last run.\n')
+    assert error_records['row'].tolist() == [3]
+    assert error_data_df['age'].tolist() == [False, False, True, False]
+    # the error log gives the position of the row in the whole file, not among the changed rows
+    assert "{'old': [3]}" in error_log.getvalue()
@@ -0,0 +1,25 @@
+import pandas as pd
+
+
+def test_integers_outside_64_bits_are_not_valid(converter):
+    converted_values, error_values, error_reasons = converter.numeric_validation(
+        pd.Series(['1e19', '12345678901234567890', '5']), 'integer')
+    assert error_values.tolist() == [True, True, False]
+    assert error_reasons.tolist()[:2] == ['not a valid integer'] * 2
+    assert converted_values.tolist()[2] == 5
+
+
+def test_numbers_are_checked_against_the_validation_min_and_max(converter):
+    converted_values, error_values, error_reasons = converter.numeric_validation(
+        pd.Series(['5', '500', '-1', None]), 'integer', 0, 120)
+    assert error_values.tolist() == [False, True, True, False]
+    assert error_reasons.tolist()[1:3] == ['more than the maximum of 120', 'less than the minimum of 0']
+    assert converted_values.tolist()[0] == 5
+
+
+def test_numbers_are_given_the_decimal_places_of_their_validation_type(converter):
+    converted_values, error_values, error_reasons = converter.numeric_validation(
+        pd.Series(['1.234', '12', 'abc', '1e3']), 'number_2dp')
+    assert error_values.tolist() == [False, False, True, False]
+    assert error_reasons.tolist()[2] == 'not a valid number_2dp'
+    assert converted_values[[0, 1, 3]].tolist() == ['1.23', '12.00', '1000.00']
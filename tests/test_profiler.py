@@ -0,0 +1,51 @@
+import io
+import tracemalloc
+
+import pandas as pd
+
+
+def test_nested_stages_are_recorded_with_their_memory(converter):
+    profiler = converter.Profiler()
+    try:
+        with profiler.stage('outer', 10):
+            with profiler.stage('inner', 5):
+                block = bytearray(4 << 20)
+            del block
+    finally:
+        profiler.close()
+    assert not tracemalloc.is_tracing()
+    inner, outer = profiler.records
+    assert (inner['name'], inner['rows'], outer['name'], outer['rows']) == ('inner', 5, 'outer', 10)
+    # the enclosing stage's peak includes the memory of the stages inside it
+    assert inner['memory_peak_bytes'] >= 4 << 20
+    assert outer['memory_peak_bytes'] >= inner['memory_peak_bytes']
+    assert outer['seconds'] >= inner['seconds']
+
+
+def test_fields_are_totalled_over_every_chunk_with_the_slowest_first(converter):
+    profiler = converter.Profiler(trace_memory=False)
+    profiler.add_record('load', 0.5, 300)
+    for seconds in (0.1, 0.2, 0.3):
+        profiler.add_record('age', seconds, 100, 'field')
+    profiler.add_record('sex', 0.4, 300, 'field')
+    totals = profiler.return_field_totals()
+    assert [(field['name'], field['seconds'], field['rows']) for field in totals] == [
+        ('age', 0.6, 300), ('sex', 0.4, 300)]
+    assert profiler.to_dict(top_fields=1)['slowest_fields'] == totals[:1]
+
+    error_log = io.StringIO()
+    profiler.write_log(error_log, top_fields=1)
+    lines = error_log.getvalue().splitlines()
+    assert lines[3].startswith('load: 0.500 seconds, 300 rows')
+    assert lines[4] == 'Slowest fields:'
+    assert lines[5].startswith('    age: 0.600 seconds, 300 rows')
+    assert len(lines) == 6
+
+
+def test_conversions_are_profiled_by_field(converter, make_data_dictionary):
+    data_dictionary = make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+                                           ('age', 'text', 'Age', None, 'integer'))
+    profiler = converter.Profiler(trace_memory=False)
+    converter.transform_data_df(pd.DataFrame({'sex': ['Male'], 'age': ['30']}), data_dictionary,
+                                io.StringIO(), profiler=profiler)
+    assert [(record['kind'], record['name']) for record in profiler.records] == [('field', 'sex'), ('field', 'age')]
@@ -0,0 +1,34 @@
+import concurrent.futures
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def data_dictionary(make_data_dictionary):
+    return make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+                                ('age', 'text', 'Age', None, 'integer'))
+
+
+def test_data_frames_are_converted_without_being_changed(converter, data_dictionary):
+    data_df = pd.DataFrame({'Sex': ['Male', 'Female'], 'Age': ['30', 'old'], 'Site': ['a', 'b']})
+    original_df = data_df.copy()
+    converted_df, error_mask, error_records = converter.RedcapConverter(data_dictionary).convert(
+        data_df, first_position=11)
+    pd.testing.assert_frame_equal(data_df, original_df)
+    assert converted_df['sex'].astype(str).tolist() == ['1', '2']
+    assert error_mask.to_dict('list') == {'sex': [False, False], 'age': [False, True], 'site': [True, True]}
+    assert [(record['row'], record['field'], record['reason']) for record in error_records] == [
+        (0, 'site', 'field name not in data dictionary'), (12, 'age', 'not a valid integer')]
+
+
+def test_a_pool_of_workers_is_kept_until_the_converter_is_closed(converter, data_dictionary):
+    data_df = pd.DataFrame({'Sex': ['Male'], 'Age': ['30']})
+    with converter.RedcapConverter(data_dictionary, workers=2) as redcap_converter:
+        worker_pool = redcap_converter.worker_pool
+        assert isinstance(worker_pool, concurrent.futures.ThreadPoolExecutor)
+        for _ in range(2):
+            assert redcap_converter.convert(data_df)[0]['age'].tolist() == [30]
+    assert redcap_converter.worker_pool is None
+    with pytest.raises(RuntimeError):
+        worker_pool.submit(len, 'closed')
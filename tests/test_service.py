@@ -0,0 +1,105 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import redcap_service
+
+METADATA_COLUMNS = ['Variable / Field Name', 'Form Name', 'Field Type', 'Field Label',
+                    'Choices, Calculations, OR Slider Labels', 'Text Validation Type OR Show Slider Number']
+
+
+@pytest.fixture
+def dictionary_dir(tmp_path):
+    dictionary_dir = tmp_path / 'dictionaries'
+    dictionary_dir.mkdir()
+    pd.DataFrame([{'Variable / Field Name': 'sex', 'Form Name': 'form', 'Field Type': 'radio', 'Field Label': 'Sex',
+                   'Choices, Calculations, OR Slider Labels': '1, Male | 2, Female'}],
+                 columns=METADATA_COLUMNS).to_csv(dictionary_dir / 'metadata.csv', index=False)
+    return dictionary_dir
+
+
+def test_data_dictionaries_are_compiled_once_and_the_least_recently_used_is_dropped(converter, monkeypatch,
+                                                                                 dictionary_dir):
+    compiled = []
+    from_file = converter.DataDictionary.from_file
+
+    def count_from_file(metadata_path, sheet_name=None):
+        compiled.append(metadata_path)
+        return from_file(metadata_path, sheet_name)
+
+    monkeypatch.setattr(converter.DataDictionary, 'from_file', count_from_file)
+    metadata_path = str(dictionary_dir / 'metadata.csv')
+    data_dictionary_pool = redcap_service.DataDictionaryPool(size=2)
+    first = data_dictionary_pool.get('a', metadata_path)
+    assert data_dictionary_pool.get('a', metadata_path) is first
+    data_dictionary_pool.get('b', metadata_path)
+    data_dictionary_pool.get('a', metadata_path)
+    data_dictionary_pool.get('c', metadata_path)
+    assert len(compiled) == 3
+    # 'b' was used least recently, so it was dropped to make room for 'c'
+    assert list(data_dictionary_pool.data_dictionaries) == ['a', 'c']
+
+
+def test_uploads_are_converted_with_the_worker_pool_of_dictionaries(dictionary_dir, tmp_path):
+    metadata_path = str(dictionary_dir / 'metadata.csv')
+    data_path = tmp_path / 'data.csv'
+    data_path.write_text('Sex\nMale\nFemale\n')
+    key = 'convert_upload ' + str(tmp_path)
+    assert redcap_service.convert_upload(str(data_path), metadata_path, key, str(tmp_path))
+    assert (tmp_path / 'converted.csv').read_text().splitlines() == ['sex', '1', '2']
+    assert key in redcap_service.worker_data_dictionary_pool.data_dictionaries
+
+    (tmp_path / 'broken.csv').write_text('not a data dictionary\n')
+    with pytest.raises(redcap_service.DataDictionaryError):
+        redcap_service.convert_upload(str(data_path), str(tmp_path / 'broken.csv'), key + ' broken', str(tmp_path))
+
+
+async def request(port, request_line, body=b''):
+    """ Returns the status and the body of the response to a request with body."""
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request_line.encode('latin-1') + b'\r\nContent-Length: ' + str(len(body)).encode('ascii') +
+                 b'\r\n\r\n' + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    if b'Transfer-Encoding: chunked' in head:
+        chunks = []
+        while True:
+            size, _, content = content.partition(b'\r\n')
+            size = int(size, 16)
+            if not size:
+                break
+            chunks.append(content[:size])
+            content = content[size + 2:]
+        content = b''.join(chunks)
+    return int(head.split()[1]), content
+
+
+def test_the_service_answers_conversion_requests(dictionary_dir):
+    service = redcap_service.ConversionService(str(dictionary_dir), workers=2, executor='thread')
+
+    async def run_requests():
+        server = await asyncio.start_server(service.handle_connection, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(
+                request(port, 'GET /health HTTP/1.1'),
+                request(port, 'POST /convert?dictionary=metadata.csv&filename=data.csv HTTP/1.1',
+                        b'Sex\nMale\nFemale\n'),
+                request(port, 'POST /convert?dictionary=metadata.csv&filename=data.csv&errors=log HTTP/1.1',
+                        b'Sex\nMale\nother\n'),
+                request(port, 'POST /convert?dictionary=missing.csv&filename=data.csv HTTP/1.1', b'Sex\nMale\n'),
+                request(port, 'POST /convert?dictionary=metadata.csv&filename=data.txt HTTP/1.1', b'Sex\nMale\n'))
+
+    try:
+        health, converted, errors, missing_dictionary, wrong_type = asyncio.run(run_requests())
+    finally:
+        service.close()
+    assert health == (200, b'ok\n')
+    assert converted == (200, b'sex\n1\n2\n')
+    assert errors[0] == 422 and b'not a choice' in errors[1]
+    assert missing_dictionary[0] == 404
+    assert wrong_type[0] == 400
@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+import redcap_benchmark
+
+
+def test_loading_the_converter_leaves_the_excel_and_parquet_libraries_unimported():
+    code = ("import sys\n"
+            "from redcap_convert import load_converter\n"
+            "load_converter()\n"
+            "print(' '.join(name for name in " + repr(redcap_benchmark.LAZY_MODULES) + " if name in sys.modules))\n")
+    completed = subprocess.run([sys.executable, '-c', code], cwd=redcap_benchmark.PACKAGE_DIR,
+                               env=dict(os.environ, PYTHONPATH=redcap_benchmark.PACKAGE_DIR),
+                               capture_output=True, text=True, check=True)
+    assert completed.stdout.split() == []
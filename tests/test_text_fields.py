@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+
+def test_boolean_columns_are_cleaned_as_text(converter):
+    assert converter.return_cleaned_data_values(pd.Series([True, False])).tolist() == ['true', 'false']
+    assert converter.return_cleaned_data_values(pd.Series([True, None, False])).tolist() == ['true', np.nan, 'false']
+
+
+def test_text_without_validation_is_only_checked_for_missing_values(converter):
+    data_values = pd.Series(['text', None, np.nan, pd.NA, '', 3], dtype=object)
+    assert converter.no_text_validation_error_values_for_df(data_values).tolist() == [
+        False, True, True, True, False, False]
+
+
+def test_notes_and_slider_fields_are_free_text(convert, make_data_dictionary):
+    data_dictionary = make_data_dictionary(('comments', 'notes', 'Comments'),
+                                           ('pain', 'slider', 'Pain', 'None | Lots', 'number'))
+    target_data_df, _, blocked, error_records = convert(data_dictionary, {
+        'comments': ['Felt fine today', None], 'pain': ['55', 'not a number']})
+    assert not blocked
+    assert target_data_df['comments'].tolist()[0] == 'Felt fine today'
+    assert error_records['reason'].tolist() == ['missing value']
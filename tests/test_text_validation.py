@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('validation_type, values, errors', [
+    ('email', ['someone@example.org', ' someone@example.org ', 'someone', 'a@b'], [False, False, True, True]),
+    ('phone', ['(212) 555-1234', '212.555.1234 ext. 5', '112-555-1234'], [False, False, True]),
+    ('zipcode', ['10001', '10001-1234', '1000'], [False, False, True]),
+    ('postalcode_canada', ['K1A 0B1', 'k1a0b1', 'D1A 0B1'], [False, False, True]),
+    ('time', ['09:30', '23:59', '24:00'], [False, False, True]),
+    ('alpha_only', ['abc', 'ab1'], [False, True]),
+])
+def test_text_is_checked_with_the_validator_of_its_type(converter, validation_type, values, errors):
+    assert converter.text_validation(pd.Series(values + [None]), validation_type).tolist() == errors + [False]
+
+
+def test_whole_floats_are_validated_as_integer_text(converter):
+    assert converter.text_validation(pd.Series([10001.0, np.nan]), 'zipcode').tolist() == [False, False]
+    assert converter.text_validation(pd.Series([2125551234.0, np.nan]), 'phone').tolist() == [False, False]
+
+
+def test_registered_validators_are_used(converter):
+    converter.register_text_validator('mrn', r"MRN[0-9]{6}")
+    converter.register_text_validator('even', lambda values: values.str.len() % 2 == 0)
+    try:
+        assert converter.text_validation(pd.Series(['MRN123456', 'MRN12']), 'mrn').tolist() == [False, True]
+        assert converter.text_validation(pd.Series(['ab', 'abc']), 'even').tolist() == [False, True]
+    finally:
+        del converter.TEXT_VALIDATORS['mrn']
+        del converter.TEXT_VALIDATORS['even']
@@ -0,0 +1,42 @@
+import concurrent.futures
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def data_dictionary(make_data_dictionary):
+    return make_data_dictionary(('sex', 'radio', 'Sex', '1, Male | 2, Female'),
+                                ('age', 'text', 'Age', None, 'integer'))
+
+
+COLUMNS = {'sex': ['Male', 'Female', 'other'], 'age': ['30', '40', 'old']}
+
+
+def test_worker_pools_are_threads_unless_processes_are_asked_for(converter):
+    with converter.return_worker_pool(2) as pool:
+        assert isinstance(pool, concurrent.futures.ThreadPoolExecutor)
+    with converter.return_worker_pool(2, 'process') as pool:
+        assert isinstance(pool, concurrent.futures.ProcessPoolExecutor)
+    assert converter.return_worker_pool(1) is None
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_columns_converted_in_parallel_match_columns_converted_one_after_another(convert, data_dictionary,
+                                                                                 executor):
+    expected_df, expected_error_df, _, expected_records = convert(data_dictionary, COLUMNS)
+    target_data_df, error_data_df, blocked, error_records = convert(data_dictionary, COLUMNS, workers=2,
+                                                                    executor=executor)
+    assert blocked
+    pd.testing.assert_frame_equal(target_data_df, expected_df)
+    pd.testing.assert_frame_equal(error_data_df, expected_error_df)
+    assert error_records.tolist() == expected_records.tolist()
+
+
+def test_a_pool_of_workers_from_the_caller_is_reused(convert, data_dictionary):
+    expected_df = convert(data_dictionary, COLUMNS)[0]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        for _ in range(2):
+            pd.testing.assert_frame_equal(convert(data_dictionary, COLUMNS, executor=pool)[0], expected_df)
+        # the pool is left open for the caller
+        assert pool.submit(len, 'ok').result() == 2